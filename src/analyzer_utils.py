@@ -0,0 +1,132 @@
+import nltk
+import os
+import re
+import unicodedata
+from functools import lru_cache
+from nltk.stem import PorterStemmer, WordNetLemmatizer
+
+# The chain of stages every page's text (and every search needle) is run through before it is stored, indexed or matched:
+#   "lowercase": lowercases the text
+#   "fold": folds accented and compatibility characters to their plain ASCII letters (é -> e, ﬁ -> fi)
+#   "stopwords": drops unimportant words (see stopWords)
+#   "stem": reduces every word to its Porter stem (swords -> sword, burning -> burn)
+#   "lemmatize": reduces every word to its WordNet dictionary form (swords -> sword, geese -> goose)
+# The text is split into tokens after the "lowercase" and "fold" stages, whatever order the stages are listed in.
+# Tables store the tokens the chain produced when they were crawled or pre-processed, so pre-process them again after changing it.
+# Search input is always lowercased (see query_utils.parseQuery), so keep "lowercase" in the chain unless only the index is searched.
+analyzerStageNames = ("lowercase", "fold", "stopwords", "stem", "lemmatize")
+analyzerStages = tuple(stage for stage in os.environ.get('ANALYZER_STAGES', "lowercase").split(',') if stage)
+
+# Number of consecutive tokens the index also stores as a single "shingle" term (0 or 1 for none),
+#   so phrases of exactly that many words are looked up directly instead of by intersecting positions
+shingleSize = int(os.environ.get('ANALYZER_SHINGLES', 0))
+
+# Same character set parser_utils keeps in a page's text: letters and digits of any script, apostrophes and hyphens
+tokenPattern = re.compile(r"(?:[^\W_]|['\-])+")
+
+# Words removed by the "stopwords" stage
+stopWords = frozenset(("i", "me", "my", "myself", "we", "our", "ours", "ourselves", "you",
+    "your", "yours", "yourself", "yourselves", "he", "him", "his", "himself", "she",
+    "her", "hers", "herself", "it", "its", "itself", "they", "them", "their", "theirs",
+    "themselves", "what", "which", "who", "whom", "this", "that", "these", "those",
+    "am", "is", "are", "was", "were", "be", "been", "being", "have", "has", "had",
+    "having", "do", "does", "did", "doing", "a", "an", "the", "and", "but", "if", "or",
+    "because", "as", "until", "while", "of", "at", "by", "for", "with", "about",
+    "against", "between", "into", "through", "during", "before", "after", "above",
+    "below", "to", "from", "up", "down", "in", "out", "on", "off", "over", "under",
+    "again", "further", "then", "once", "here", "there", "when", "where", "why", "how",
+    "all", "any", "both", "each", "few", "more", "most", "other", "some", "such", "no",
+    "nor", "not", "only", "own", "same", "so", "than", "too", "very", "s", "t", "can",
+    "will", "just", "don", "should", "now"))
+
+# Distinct words are only stemmed/lemmatized once per process
+wordCacheSize = 100000
+stemmer = PorterStemmer()
+lemmatizer = WordNetLemmatizer()
+
+
+def foldText(text):
+    '''
+    Decomposes every character of {text} and drops the accents, leaving plain letters where possible.
+    '''
+    if text.isascii():
+        return text
+    return ''.join(character for character in unicodedata.normalize('NFKD', text) if not unicodedata.combining(character))
+
+
+@lru_cache(maxsize=wordCacheSize)
+def stemWord(word):
+    return stemmer.stem(word, to_lowercase=False)
+
+
+@lru_cache(maxsize=wordCacheSize)
+def lemmatizeWord(word):
+    return lemmatizer.lemmatize(word)
+
+
+def getWordNet():
+    '''
+    Downloads the WordNet data the "lemmatize" stage needs, only if it isn't installed already.
+    '''
+    try:
+        nltk.data.find('corpora/wordnet')
+    except LookupError:
+        nltk.download('wordnet', quiet=True)
+
+
+def loadAnalyzer(stages=None):
+    '''
+    Checks a chain of stages (defaulting to analyzerStages) and loads everything they need,
+        so the first page a process analyzes doesn't pay for it.
+    '''
+    stages = analyzerStages if stages is None else stages
+    for stage in stages:
+        if stage not in analyzerStageNames:
+            raise ValueError(f'Unknown analyzer stage "{stage}"')
+
+    if "lemmatize" in stages:
+        getWordNet()
+        lemmatizeWord("warm")
+
+
+def analyzeText(text, stages=None):
+    '''
+    Runs a string of text through a chain of stages (defaulting to analyzerStages).
+    Returns the list of tokens it leaves.
+    '''
+    stages = analyzerStages if stages is None else stages
+
+    if "lowercase" in stages:
+        text = text.lower()
+    if "fold" in stages:
+        text = foldText(text)
+    tokens = tokenPattern.findall(text)
+
+    for stage in stages:
+        if stage == "stopwords":
+            tokens = [token for token in tokens if token.lower() not in stopWords]
+        elif stage == "stem":
+            tokens = [stemWord(token) for token in tokens]
+        elif stage == "lemmatize":
+            tokens = [lemmatizeWord(token) for token in tokens]
+
+    return tokens
+
+
+def getShingles(tokens, size=None):
+    '''
+    Returns a list of (shingle, position) tuples for every run of {size} (defaulting to shingleSize) consecutive tokens,
+        where shingle is the run's tokens joined by spaces and position is the position of its first token.
+    '''
+    size = shingleSize if size is None else size
+    if size < 2:
+        return []
+    return [(' '.join(tokens[position:position + size]), position) for position in range(len(tokens) - size + 1)]
+
+
+def analyzeNeedles(needles):
+    '''
+    Runs each search needle through the analyzer, so it can be matched against stored tokens.
+    Returns a dict mapping each needle to its tokens joined by spaces ("" if the analyzer drops all of it).
+    '''
+    return {needle: ' '.join(analyzeText(needle)) for needle in needles}
@@ -0,0 +1,88 @@
+import json
+import os
+import src.query_utils as query
+import src.redis_utils as redis
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+
+# Number of search results each process keeps in its in-memory LRU cache (0 disables caching)
+resultCacheSize = int(os.environ.get('RESULT_CACHE_SIZE', 256))
+
+# Whether results are also cached in Redis, so every process (and restart) shares them, and for how many seconds
+resultCacheRedis = os.environ.get('RESULT_CACHE_REDIS', "1") == "1"
+resultCacheSeconds = 3600
+
+# Inside a process: {searchKey: (tableVersion, searchResult)}, least recently used first
+resultCache = OrderedDict()
+resultCacheLock = Lock()
+cacheMetrics = {'hits': 0, 'redisHits': 0, 'misses': 0}
+
+
+def getSearchKey(tableName, userInput, searchMethod, amountOfResults=None, backend=None):
+    '''
+    Returns the key a search is cached under. The query is normalized first, so inputs that parse to
+        the same needles (differing only in case, spacing, duplicates or order) share one entry.
+    '''
+    normalizedQuery = sorted(set(tuple(sorted(conjunction)) for conjunction in query.parseQuery(userInput)))
+    return sha1(json.dumps([tableName, normalizedQuery, searchMethod, amountOfResults, backend]).encode('utf-8')).hexdigest()
+
+
+def getCachedSearch(tableName, searchKey, tableVersion):
+    '''
+    Looks up a search in the in-memory cache, then in Redis, ignoring results cached for an older version of the table.
+    Returns the cached (searchResults, foundPages, shardTimes), or None if it isn't cached.
+    '''
+    with resultCacheLock:
+        cachedVersion, searchResult = resultCache.get(searchKey, (None, None))
+        if cachedVersion == tableVersion:
+            resultCache.move_to_end(searchKey)
+            cacheMetrics['hits'] += 1
+            return searchResult
+
+    if resultCacheRedis and (searchResult := redis.getCachedSearch(tableName, tableVersion, searchKey)) is not None:
+        searchResults, foundPages, shardTimes = searchResult
+        searchResult = ([tuple(result) for result in searchResults], foundPages, shardTimes)
+        storeSearch(searchKey, tableVersion, searchResult)
+        with resultCacheLock:
+            cacheMetrics['redisHits'] += 1
+        return searchResult
+
+    with resultCacheLock:
+        cacheMetrics['misses'] += 1
+    return None
+
+
+def storeSearch(searchKey, tableVersion, searchResult):
+    '''
+    Adds a search result to the in-memory cache, evicting the least recently used results past resultCacheSize.
+    '''
+    with resultCacheLock:
+        resultCache[searchKey] = (tableVersion, searchResult)
+        resultCache.move_to_end(searchKey)
+        while len(resultCache) > resultCacheSize:
+            resultCache.popitem(last=False)
+
+
+def cacheSearch(tableName, searchKey, tableVersion, searchResult):
+    '''
+    Caches a (searchResults, foundPages, shardTimes) search result in memory and (if enabled) in Redis.
+    '''
+    storeSearch(searchKey, tableVersion, searchResult)
+    if resultCacheRedis:
+        redis.cacheSearch(tableName, tableVersion, searchKey, searchResult, resultCacheSeconds)
+
+
+def getCacheMetrics():
+    '''
+    Returns this process's result cache counters, its hit rate, and the number of results it holds.
+    '''
+    with resultCacheLock:
+        metrics = dict(cacheMetrics)
+        metrics['entries'] = len(resultCache)
+
+    lookups = metrics['hits'] + metrics['redisHits'] + metrics['misses']
+    metrics['hitRate'] = (metrics['hits'] + metrics['redisHits']) / lookups if lookups else 0
+    metrics['size'] = resultCacheSize
+    metrics['redis'] = resultCacheRedis
+    return metrics
@@ -1,233 +1,566 @@
+import asyncio
+import os
 import src.database_utils as database
+import src.fetch_utils as fetch
+import src.index_utils as index
+import src.parser_utils as parser
+import src.politeness_utils as politeness
 import src.redis_utils as redis
-import requests
-import re
-from bs4 import BeautifulSoup
 from celery import Celery
+from collections import deque
+from hashlib import sha1
+from src.link_utils import cleanLinks
+from threading import Event, Thread
 from time import time
 from urllib.parse import urlparse
+from uuid import uuid4
 
 app = Celery('Search_Engine', broker='redis://redis:6379/1')
 app.conf.result_backend = 'redis://redis:6379/1'
 
+# Scraped pages are buffered and written to the database in batches of this many pages,
+#   or sooner once the oldest buffered page has waited this many seconds
+pageBatchSize = 200
+pageBatchSeconds = 5
 
-def crawlWebsite(initialURL):
+# "celery" dispatches every page to the Celery workers; "async" crawls the whole site from
+#   this process with the asyncio fetcher (no workers or Redis queue needed, so it also merges its index here)
+crawlModes = ("celery", "async")
+defaultCrawlMode = os.environ.get('CRAWL_MODE', "celery")
+
+# Most URLs the coordinator pops from the queue (and dispatches to workers) at once
+crawlDispatchBatch = 100
+
+# Seconds the coordinator waits without hearing from a worker before giving up on a crawl
+#   (only reached if workers die mid-task, since every task reports back when it finishes)
+crawlStallSeconds = int(os.environ.get('CRAWL_STALL_SECONDS', 300))
+
+# Longest the coordinator (or an async crawl worker) sleeps while waiting for a host's request slot
+#   (slots can also free up by their leases expiring, or be released by other crawls)
+slotWaitSeconds = 1
+
+# Seconds between a crawl's heartbeats, which refresh its table's lock (see redis.registerCrawl())
+#   and keep its job from being reported as failed (see redis.getCrawlProgress())
+crawlHeartbeatSeconds = max(1, min(redis.crawlLockSeconds, redis.crawlJobStaleSeconds) / 3)
+
+# Times a page is put back on the queue after its host throttles it (see politeness.throttleStatuses)
+#   before it is counted as an error. Its host's slot is released first, so the retry waits out the host's backoff
+throttleRequeues = 3
+
+# Seconds between a pre-processing job's heartbeats (see redis.getPreProcessProgress())
+preProcessHeartbeatSeconds = max(1, redis.crawlJobStaleSeconds / 3)
+
+# Seconds between progress updates from an async crawl (Celery crawls report progress through their Redis counters)
+crawlProgressSeconds = 1
+
+
+def startCrawlJob(initialURL, crawlMode=None, incremental=False):
+    '''
+    Starts crawling a website in a background thread, so the caller doesn't wait for the crawl to finish.
+    Returns the crawl's id, which redis.getCrawlProgress() accepts to follow the crawl.
+    The crawl sends its job a heartbeat while it runs, so if this process dies with it the job is reported as failed.
+    '''
+    crawlId = uuid4().hex
+    redis.updateCrawlJob(crawlId, status="queued", initialURL=initialURL, crawlMode=crawlMode or defaultCrawlMode, startTime=time(),
+        heartbeat=time())
+    Thread(target=crawlWebsite, args=(initialURL, crawlMode, crawlId, incremental), name=f"crawl-{crawlId}", daemon=True).start()
+
+    return crawlId
+
+
+def startPreProcessJob(tableName):
+    '''
+    Starts pre-processing table {tableName} in a background thread, so the caller doesn't wait for every page to be re-analyzed.
+    Returns the job's id, which redis.getPreProcessProgress() accepts to follow it.
+    The job sends a heartbeat while it runs, so if this process dies with it the job is reported as failed.
+    '''
+    jobId = uuid4().hex
+    redis.updatePreProcessJob(jobId, status="queued", tableName=tableName, startTime=time(), heartbeat=time())
+    Thread(target=preProcessWebsite, args=(tableName, jobId), name=f"pre-process-{jobId}", daemon=True).start()
+
+    return jobId
+
+
+def preProcessWebsite(tableName, jobId=None):
+    '''
+    Re-analyzes the page_tokens of every page in table {tableName} with the current analyzer chain (see database.preProcessTable),
+        then rebuilds its index from them.
+    jobId names the pre-processing job its stage ("analyzing", then "indexing") and progress are reported to,
+        and defaults to a new random id.
+    '''
+    startProcessTime = time()
+    jobId = jobId or uuid4().hex
+    redis.updatePreProcessJob(jobId, status="running", tableName=tableName, stage="analyzing", startTime=startProcessTime,
+        heartbeat=startProcessTime)
+
+    jobStopped = Event()
+    Thread(target=keepPreProcessAlive, args=(jobId, jobStopped), name=f"pre-process-heartbeat-{jobId}", daemon=True).start()
+
+    try:
+        database.preProcessTable(tableName, jobId=jobId)
+        redis.updatePreProcessJob(jobId, stage="indexing")
+        index.buildIndex(tableName)
+    except Exception as processError:
+        redis.updatePreProcessJob(jobId, status="failed", error=str(processError), processTime=time() - startProcessTime)
+        raise
+    finally:
+        jobStopped.set()
+
+    redis.updatePreProcessJob(jobId, status="finished", processTime=time() - startProcessTime)
+
+
+def keepPreProcessAlive(jobId, jobStopped):
+    '''
+    Refreshes pre-processing job {jobId}'s heartbeat every preProcessHeartbeatSeconds until the jobStopped event is set,
+        so the job is only reported as failed once the process running it has died.
+    '''
+    while not jobStopped.wait(preProcessHeartbeatSeconds):
+        redis.updatePreProcessJob(jobId, heartbeat=time())
+
+
+def crawlWebsite(initialURL, crawlMode=None, crawlId=None, incremental=False):
     '''
     Parent function for connecting to and scraping/storing data from an entire website.
+    crawlMode is one of crawlModes, and defaults to defaultCrawlMode.
+    crawlId names the crawl's Redis namespace and job, and defaults to a new random id. Crawls of different
+        websites run side by side, each with its own queue, seen set and page buffer.
+    If incremental and the website was crawled before, its table is kept: every stored page is re-checked with a
+        conditional request, unchanged pages are skipped, changed and new pages are rewritten, and removed pages are deleted.
     Returns the total number of webpages visited by the crawler.
     '''
     startCrawlTime = time()
+    crawlMode = crawlMode or defaultCrawlMode
+    crawlId = crawlId or uuid4().hex
+    redis.updateCrawlJob(crawlId, status="running", initialURL=initialURL, crawlMode=crawlMode, startTime=startCrawlTime,
+        heartbeat=startCrawlTime, visited=0, queued=0, inFlight=0, errors=0, unchanged=0, removed=0, blocked=0)
 
     # Normalize user-input URL
     if "https" not in initialURL:
         initialURL = "https://" + initialURL
     initialURL = "https://" + urlparse(initialURL).hostname
 
-    # Check if URL is connectable
+    # Check if URL is connectable (a host that throttles the check is still reachable, and its pages are fetched politely)
     pageResponse = getPageResponse(initialURL)
-    if not pageResponse:
+    if pageResponse is None:
         print(f'ERROR: Could not connect to "{initialURL}"')
+        redis.updateCrawlJob(crawlId, status="failed", error=f'Could not connect to "{initialURL}"')
         return (0, 0)
 
-    # Create a table in the database for the website
+    # Register the crawl before touching its table, so a table that is still being crawled is never dropped
     tableName = database.getTableName(initialURL)
-    if database.tableExists(tableName):
-        database.dropTable(tableName)
-    database.createTable(tableName)
-
-    # Add the initial URL to the queue
-    redis.clearCache()
-    redis.addToQueue(initialURL)
-
-    # Process the queue while there are still items in the queue
-    while ((redis.getQueueCount()) > 0) or (processingQueue()):
-        if url := redis.popFromQueue():
-            redis.markVisited(url)
-            # DEBUG: print(f"Sending to Celery for processing: {url}")
-            processURL.delay(url, tableName)
+    if not redis.registerCrawl(tableName, initialURL, crawlId):
+        print(f'ERROR: "{initialURL}" is already being crawled')
+        redis.updateCrawlJob(crawlId, status="failed", error=f'"{initialURL}" is already being crawled')
+        return (0, 0)
+
+    crawlStopped = Event()
+    Thread(target=keepCrawlAlive, args=(tableName, crawlId, crawlStopped), name=f"crawl-heartbeat-{crawlId}", daemon=True).start()
+
+    try:
+        if incremental and database.tableExists(tableName):
+            # Keep the website's table (and index), re-checking the pages already in it.
+            #   A table from before page_source existed gets its stored pages moved into it and analyzed first,
+            #   and one from before the page-list indexes gets them built (concurrently, so the table stays usable)
+            database.addMissingColumns(tableName)
+            if 'page_text' in database.getColumns(tableName):
+                database.preProcessTable(tableName)
+            database.createListIndexes(tableName)
+            if not index.indexExists(tableName):
+                index.buildIndex(tableName)
+            storedPages = getStoredPages(tableName)
+        else:
+            # Create a table in the database for the website
+            if database.tableExists(tableName):
+                database.dropTable(tableName)
+            index.dropIndex(tableName)
+            database.createTable(tableName)
+            index.createIndex(tableName)
+            storedPages = []
+
+        if crawlMode == "async":
+            webpageVisitCount = asyncio.run(crawlWebsiteAsync(initialURL, tableName, crawlId, storedPages))
+        else:
+            webpageVisitCount = crawlWebsiteCelery(initialURL, tableName, crawlId, storedPages)
+
+        # Keep the crawl's final numbers in its job before its counters are cleared
+        crawlProgress = redis.getCrawlProgress(crawlId)
+    except Exception as crawlError:
+        redis.updateCrawlJob(crawlId, status="failed", error=str(crawlError), crawlTime=time() - startCrawlTime)
+        raise
+    finally:
+        crawlStopped.set()
+        redis.clearCrawl(crawlId)
+
+    database.recordCrawl(tableName)
+
+    # Fold what's left of the index's delta segment: in the background on the Celery workers,
+    #   or here for an async crawl, which may be running without any workers
+    if crawlMode == "async":
+        mergeIndexSegments(tableName)
+    else:
+        mergeIndexSegments.delay(tableName)
 
     # Return the total number of webpages visited and the time it took to crawl them
-    webpageVisitCount = redis.getVisitedCount()
     crawlTime = time() - startCrawlTime
+    redis.updateCrawlJob(crawlId, status="finished", visited=webpageVisitCount, queued=0, inFlight=0, errors=crawlProgress['errors'],
+        unchanged=crawlProgress['unchanged'], removed=crawlProgress['removed'], blocked=crawlProgress['blocked'], crawlTime=crawlTime)
 
     return (webpageVisitCount, crawlTime)
 
 
-@app.task
-def processURL(url, databaseTable):
+def keepCrawlAlive(tableName, crawlId, crawlStopped):
     '''
-    Parent function for connecting to and scraping/storing data from an individual webpage.
+    Refreshes crawl {crawlId}'s lock on table {tableName} and its job's heartbeat every crawlHeartbeatSeconds
+        until the crawlStopped event is set, so the lock only expires (and the job is only failed) once the crawling process has died.
     '''
-    print(f"Processing {url}")
+    while not crawlStopped.wait(crawlHeartbeatSeconds):
+        redis.updateCrawlJob(crawlId, heartbeat=time())
+        if not redis.refreshCrawl(tableName, crawlId):
+            print(f'ERROR: Crawl {crawlId} no longer holds the lock on table "{tableName}"')
+            return
 
-    # Get the page's HTML and parse it
-    # DEBUG: print(f"Getting page response for {url}")
-    pageResponse = getPageResponse(url)
-    if not pageResponse:
-        print(f"ERROR: Could not connect to {url}")
-        return 0
-    # DEBUG: print(f"Parsing page for {url}")
-    parsedPage = BeautifulSoup(pageResponse.text, 'html.parser')
-
-    # Queue all links from page that are on the same website and have not already been visited/queued
-    # DEBUG: print(f"Gettings links from {url}")
-    pageLinks = getLinks(url, parsedPage)
-    for link in pageLinks:
-        if redis.hasBeenVisited(link):
-            continue
-        #print(f"Adding {link} to queue")
-        redis.addToQueue(link)
 
-    # Scrape data from the page and append it to the database
-    # DEBUG: print(f"Scraping data from {url}")
-    pageData = scrapeData(parsedPage)
-    # DEBUG: print(f"Appending data from {url}")
-    database.appendData(url, pageData, databaseTable)
-    # DEBUG: print(f"Finished processing {url}")
-
-
-def getPageResponse(url):
+def getStoredPages(tableName):
     '''
-    Connects to a URL and returns the response.
+    Yields the pages already in table {tableName}, in batches of dicts of URL -> (etag, lastModified, contentHash).
     '''
-    # Pretend to be not a robot
-    requestHeaders = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36',
-       'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-       'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.3',
-       'Accept-Encoding': 'none',
-       'Accept-Language': 'en-US,en;q=0.8',
-       'Connection': 'keep-alive'
-       }
-
-    couldNotConnect = 0
-    try:
-        pageResponse = requests.get(url, requestHeaders)
-    except:
-        couldNotConnect = 1
+    storedPages = {}
+    for pageURL, *pageValidators in database.streamData(tableName, ('page_url', 'page_etag', 'page_modified', 'page_hash')):
+        storedPages[pageURL] = tuple(pageValidators)
+        if len(storedPages) >= database.streamItersize:
+            yield storedPages
+            storedPages = {}
 
-    if couldNotConnect or (pageResponse.status_code != 200):
-        return 0
+    if storedPages:
+        yield storedPages
 
-    return pageResponse
 
-
-def scrapeData(parsedPage):
-    ''''
-    Pulls and returns data from a parsed webpage.
+def crawlWebsiteCelery(initialURL, tableName, crawlId, storedPages=()):
     '''
-    if parsedPage.title:
-        pageTitle = parsedPage.title.string
-    else:
-        pageTitle = "None"
+    Crawls an entire website by dispatching every page to the Celery workers, using crawl {crawlId}'s Redis keys.
+    storedPages are batches of pages from an earlier crawl (see getStoredPages()) to re-check along with the website's links.
+    Returns the total number of webpages visited by the crawler.
+    '''
+    # Add the initial URL, and any pages from an earlier crawl (so pages that are no longer linked are still re-checked), to the queue
+    redis.addToQueue(crawlId, initialURL)
+    for pageValidators in storedPages:
+        redis.storePageValidators(crawlId, pageValidators)
+        redis.queueLinks(crawlId, list(pageValidators))
+
+    # Dispatch URLs as they are queued. Every dispatched URL is counted as in flight until its task reports back,
+    #   and a task queues its page's links before reporting, so once nothing is queued, pending or in flight the crawl is done.
+    # Popped URLs wait in pendingURLs until robots.txt allows them and the host has a free request slot
+    pendingURLs = deque()
+    lastProgressTime = time()
+    while True:
+        if not pendingURLs:
+            pendingURLs.extend(redis.popVisits(crawlId, crawlDispatchBatch))
+
+        waitSeconds = 0
+        while pendingURLs:
+            if not politeness.isAllowed(pendingURLs[0]):
+                redis.recordPageUpdate(crawlId, "blocked")
+                pendingURLs.popleft()
+                continue
+
+            slotId, waitSeconds = politeness.acquireSlot(pendingURLs[0])
+            if not slotId:
+                break
+            url = pendingURLs.popleft()
+            redis.startTasks(crawlId)
+            # DEBUG: print(f"Sending to Celery for processing: {url}")
+            processURL.delay(url, tableName, crawlId, slotId)
+            lastProgressTime = time()
+
+        # Wait for the host's next allowed request, or for a task to finish (releasing a slot and maybe queueing links)
+        if pendingURLs:
+            waitTime = min(max(waitSeconds, 0.01), slotWaitSeconds) if waitSeconds > 0 else slotWaitSeconds
+            if redis.waitForCrawlEvent(crawlId, waitTime):
+                lastProgressTime = time()
+            elif time() - lastProgressTime > crawlStallSeconds:
+                print(f"ERROR: No crawl progress for {crawlStallSeconds} seconds, stopping with {len(pendingURLs)} pages undispatched")
+                break
+            continue
 
-    rawPageText = parsedPage.get_text()
-    pageText = re.sub(r'[^A-Za-z0-9\'\-]', ' ', rawPageText)
+        # In-flight count is checked first: a task's links are queued before it stops counting as in flight
+        if redis.getInFlightCount(crawlId) <= 0:
+            if redis.getQueueCount(crawlId) == 0:
+                break
+            continue
+        if redis.getQueueCount(crawlId) > 0:
+            continue
+        if not redis.waitForCrawlEvent(crawlId, crawlStallSeconds):
+            print(f"ERROR: No crawl progress for {crawlStallSeconds} seconds, stopping with {redis.getInFlightCount(crawlId)} pages unfinished")
+            break
 
-    pageDesc = str(parsedPage.find("meta", attrs={'name': 'description'}))[14:-21]
-    if not pageDesc:
-        pageDesc = "None"
+    # Write whatever is left in the page buffer
+    flushPages(tableName, crawlId)
 
-    return (pageTitle, pageDesc, pageText)
+    visitedSetStats = redis.getVisitedSetStats(crawlId)
+    print(f"Seen set ({visitedSetStats['mode']}): {visitedSetStats['items']} URLs in {visitedSetStats['bytes']} bytes, "
+        f"estimated false-positive rate {visitedSetStats['errorRate']:.6f}")
 
+    return redis.getVisitedCount(crawlId)
 
-def getLinks(url, parsedPage):
+
+async def crawlWebsiteAsync(initialURL, tableName, crawlId, storedPages=()):
     '''
-    Gets a list of "raw" links found on the passed-in webpage.
-    Passes any links to the cleanLinks function for cleaning.
+    Crawls an entire website from this process, fetching up to fetch.fetchConcurrency pages at a time
+        over one keep-alive session and writing scraped pages to {tableName} in batches.
+    storedPages are batches of pages from an earlier crawl (see getStoredPages()) to re-check along with the website's links.
+    Reports progress to crawl {crawlId}'s job every crawlProgressSeconds.
+    Returns the total number of webpages visited by the crawler.
     '''
-    # Find all valid links (not NoneType) from the <a> tags on the webpage
-    links = []
-    for reference in parsedPage.find_all('a'):
-        if (link := reference.get('href')):
-            links.append(link)
+    urlQueue = asyncio.Queue()
+    urlQueue.put_nowait(initialURL)
+    seenURLs = {initialURL}
+    pageBuffer = []
+    loop = asyncio.get_running_loop()
+    slotReleased = asyncio.Condition()
+    throttleCounts = {}
+    crawlProgress = {'visited': 0, 'inFlight': 0, 'errors': 0, 'unchanged': 0, 'removed': 0, 'blocked': 0, 'reportTime': time()}
+
+    storedValidators = {}
+    for pageValidators in storedPages:
+        storedValidators.update(pageValidators)
+        for url in pageValidators:
+            if url not in seenURLs:
+                seenURLs.add(url)
+                urlQueue.put_nowait(url)
+
+    def reportProgress():
+        redis.updateCrawlJob(crawlId, visited=crawlProgress['visited'], queued=urlQueue.qsize(), inFlight=crawlProgress['inFlight'],
+            errors=crawlProgress['errors'], unchanged=crawlProgress['unchanged'], removed=crawlProgress['removed'], blocked=crawlProgress['blocked'])
+
+    async def crawlWorker(session):
+        while True:
+            url = await urlQueue.get()
+            try:
+                print(f"Processing {url}")
+                crawlProgress['inFlight'] += 1
+                if time() - crawlProgress['reportTime'] >= crawlProgressSeconds:
+                    crawlProgress['reportTime'] = time()
+                    reportProgress()
+
+                # robots.txt and host slots live in Redis (and robots.txt may need fetching), so they're checked off the event loop
+                if not await loop.run_in_executor(None, politeness.isAllowed, url):
+                    crawlProgress['blocked'] += 1
+                    continue
+                crawlProgress['visited'] += 1
+
+                # Wait for a request slot on the host: until its next allowed request time if it has one,
+                #   otherwise until another worker releases a slot. Then release it with the request's outcome
+                slotId, waitSeconds = await loop.run_in_executor(None, politeness.acquireSlot, url)
+                while not slotId:
+                    if waitSeconds > 0:
+                        await asyncio.sleep(waitSeconds)
+                    else:
+                        async with slotReleased:
+                            try:
+                                await asyncio.wait_for(slotReleased.wait(), slotWaitSeconds)
+                            except asyncio.TimeoutError:
+                                pass
+                    slotId, waitSeconds = await loop.run_in_executor(None, politeness.acquireSlot, url)
+                startRequestTime = time()
+                pageValidators = storedValidators.get(url)
+                fetchResult = await fetch.fetchPage(session, url, fetch.getConditionalHeaders(pageValidators))
+                pageStatus, pageHTML, pageHeaders = fetchResult or (None, None, {})
+                await loop.run_in_executor(None, politeness.releaseSlot, url, slotId, pageStatus, time() - startRequestTime,
+                    pageHeaders.get('Retry-After'))
+                async with slotReleased:
+                    slotReleased.notify_all()
+                if pageStatus in politeness.throttleStatuses and throttleCounts.get(url, 0) < throttleRequeues:
+                    throttleCounts[url] = throttleCounts.get(url, 0) + 1
+                    crawlProgress['visited'] -= 1
+                    urlQueue.put_nowait(url)
+                    continue
+                pageUpdate, pageHash = getPageUpdate(pageStatus, pageHTML, pageValidators)
+                if pageUpdate is None:
+                    print(f"ERROR: Could not connect to {url}")
+                    crawlProgress['errors'] += 1
+                    continue
+                if pageUpdate != "changed":
+                    crawlProgress[pageUpdate] += 1
+                    if pageUpdate == "removed":
+                        await loop.run_in_executor(None, removePage, url, tableName)
+                    continue
+                pageLinks, pageTitle, pageDesc, pageText = parser.parsePage(pageHTML)
+
+                # Queue all links from page that are on the same website and have not already been visited/queued
+                for link in cleanLinks(pageLinks, url):
+                    if link not in seenURLs:
+                        seenURLs.add(link)
+                        urlQueue.put_nowait(link)
+
+                pageBuffer.append((url, pageTitle, pageDesc, pageText, pageHeaders.get('ETag'), pageHeaders.get('Last-Modified'), pageHash))
+                if len(pageBuffer) >= pageBatchSize:
+                    pages = pageBuffer[:]
+                    pageBuffer.clear()
+                    await loop.run_in_executor(None, writePages, pages, tableName)
+                    if await loop.run_in_executor(None, index.getDeltaSize, tableName) >= index.indexMergeThreshold:
+                        await loop.run_in_executor(None, index.mergeIndex, tableName)
+            finally:
+                crawlProgress['inFlight'] -= 1
+                urlQueue.task_done()
+
+    async with fetch.createAsyncSession() as session:
+        crawlWorkers = [asyncio.create_task(crawlWorker(session)) for worker in range(fetch.fetchConcurrency)]
+        await urlQueue.join()
+        for worker in crawlWorkers:
+            worker.cancel()
+
+    if pageBuffer:
+        writePages(pageBuffer, tableName)
+    reportProgress()
+
+    return crawlProgress['visited']
 
-    # Filter unwanted links before returning.
-    if links:
-        cleanedLinks = cleanLinks(links, url)
-        return cleanedLinks
-    else:
-        return []
 
+@app.task
+def processURL(url, databaseTable, crawlId, slotId=None):
+    '''
+    Parent function for connecting to and scraping/storing data from an individual webpage.
+    slotId is the host request slot the coordinator took for the page, released once the page is fetched.
+    Always reports back to the crawl coordinator when finished, whether or not the page could be processed.
+    '''
+    print(f"Processing {url}")
 
-def cleanLinks(links, pageURL):
+    try:
+        # Get the page's HTML (conditionally, if an earlier crawl stored the page) and parse it if it has changed
+        # DEBUG: print(f"Getting page response for {url}")
+        pageValidators = redis.getPageValidators(crawlId, url)
+        pageResponse = getPageResponse(url, pageValidators, slotId)
+        if pageResponse is not None and pageResponse.status_code in politeness.throttleStatuses:
+            # The host's slot was released with the throttle, backing the host off, so the page can wait in the queue
+            if redis.requeueThrottled(crawlId, url, throttleRequeues):
+                return 0
+            pageResponse = None
+        if pageResponse is None:
+            pageUpdate, pageHash = (None, None)
+        else:
+            pageUpdate, pageHash = getPageUpdate(pageResponse.status_code, pageResponse.text, pageValidators)
+        if pageUpdate is None:
+            print(f"ERROR: Could not connect to {url}")
+            redis.recordError(crawlId)
+            return 0
+        if pageUpdate != "changed":
+            redis.recordPageUpdate(crawlId, pageUpdate)
+            if pageUpdate == "removed":
+                removePage(url, databaseTable)
+            return 0
+        # DEBUG: print(f"Parsing page for {url}")
+        pageLinks, pageTitle, pageDesc, pageText = parser.parsePage(pageResponse.text)
+
+        # Queue all links from page that are on the same website and have not already been visited/queued
+        # DEBUG: print(f"Gettings links from {url}")
+        redis.queueLinks(crawlId, cleanLinks(pageLinks, url))
+
+        # Buffer the page's data to be appended to the database
+        # DEBUG: print(f"Buffering data from {url}")
+        pageData = (pageTitle, pageDesc, pageText, pageResponse.headers.get('ETag'), pageResponse.headers.get('Last-Modified'), pageHash)
+        bufferLength, bufferAge = redis.bufferPage(crawlId, url, pageData)
+        if bufferLength >= pageBatchSize or bufferAge >= pageBatchSeconds:
+            flushPages(databaseTable, crawlId, pageBatchSize)
+        # DEBUG: print(f"Finished processing {url}")
+    finally:
+        redis.finishTask(crawlId)
+
+
+def flushPages(databaseTable, crawlId, batchSize=None):
     '''
-    Accepts a list of raw links/references pulled from a webpage's <a> tags.
-    Passes links through a series of filters to prune unwanted links.
-    Returns a list of cleaned links.
+    Writes crawl {crawlId}'s buffered pages to the database (and its index) in batches.
+    Writes a single batch of {batchSize} pages, or everything in the buffer if not given.
+    Returns the number of pages written.
     '''
-    badInclusions = ["mailto:", "tel:", "/Category:", "/File:",
-                    "/Talk:", "/User:", "/Blog:", "/User_blog:", "/Special:",
-                    "/Template:", "/Help:", "/Source:", "/Forum:", "_talk:",
-                    "/ru/", "/es/", "/ja/", "/de/", "/fi/", "/fr/", "/f/", "/pt-br/",
-                    "/uk/", "/he/", "/tr/", "/vi/", "/sv/", "/lt/", "/pl/", "/hu/",
-                    "/ko/", "/da/", "/zh/", "/cs/", "/nl/", "/it/", "/el/", "/pt/",
-                    "/th/", "/id/", "/lac-es/"]
+    pagesWritten = 0
+    while pages := redis.popBufferedPages(crawlId, batchSize or pageBatchSize):
+        try:
+            writePages(pages, databaseTable)
+        except Exception:
+            # Page writes are upserts, so putting the batch back to be retried can't create duplicates
+            redis.requeueBufferedPages(crawlId, pages)
+            raise
+        pagesWritten += len(pages)
 
-    # Tuple, not list, because surprisingly str.endswith() accepts tuples
-    badExtensions = (".jpg", ".png", ".gif", ".pdf", ".aspx",
-                    "/view", "/download",
-                    "/es", "/de", "/ja", "/fr", "/zh", "/pl", "/ru", "/nl", "/uk",
-                    "/ko", "/it", "/hu", "/sv", "/cs", "/ms", "/da", "/pt-br", "/vi",
-                    "/pt-pt", "/tr", "/el", "/fi", "/no", "/th", "/id", "/lt")
+        if batchSize:
+            break
 
-    javaNonsense = "/javascript:void(0);"
-    parsedPage = urlparse(pageURL)
+    if pagesWritten and index.getDeltaSize(databaseTable) >= index.indexMergeThreshold:
+        mergeIndexSegments.delay(databaseTable)
 
-    cleanLinks = []
-    for link in links:
-        potentialLink = link.rstrip('/')
+    return pagesWritten
 
-        # Filter links to the initial URL
-        if not potentialLink:
-            continue
 
-        # Filter links that end with unwanted extensions
-        if potentialLink.endswith(badExtensions):
-            continue
+def writePages(pages, databaseTable):
+    '''
+    Writes a batch of (pageURL, pageTitle, pageDesc, pageText, pageETag, pageModified, pageHash) pages
+        to the database and its index, analyzing each page's text once for both.
+    The database keeps the tokens in page_tokens and the text compressed in page_source (see database.compressText).
+    '''
+    pageTokens = [database.preProcessText(page[3]) for page in pages]
+    database.appendDataBatch([(*page[:3], database.compressText(page[3]), *page[4:], tokens) for page, tokens in zip(pages, pageTokens)],
+        databaseTable)
+    index.indexPages([(page[0], page[1], tokens) for page, tokens in zip(pages, pageTokens)], databaseTable)
 
-        # Filter links that contain unwanted tags/sequences
-        if any(tag in potentialLink for tag in badInclusions):
-            continue
 
-        # Remove any page anchors and/or queries from link
-        if not (potentialLink := potentialLink.split('#', 1)[0]):
-            continue
-        if not (potentialLink := potentialLink.split('?', 1)[0]):
-            continue
+def removePage(url, databaseTable):
+    '''
+    Deletes a page that no longer exists from the database and its index.
+    '''
+    database.deleteRow(databaseTable, url)
+    index.removePage(url, databaseTable)
 
-        # Expand website references to full URL
-        if "http" not in potentialLink:
-            if potentialLink[0] == '/':
-                potentialLink = "https://" + parsedPage.hostname + potentialLink
-            else:
-                potentialLink = "https://" + parsedPage.hostname + (parsedPage.path).rstrip('/') + "/" + potentialLink
 
-        # Ignore links to other domains
-        if parsedPage.hostname != urlparse(potentialLink).hostname:
-            continue
+@app.task
+def mergeIndexSegments(databaseTable):
+    '''
+    Merges the delta segment of a table's index into its main segment.
+    '''
+    return index.mergeIndex(databaseTable)
 
-        # Only visit https:// URLs (not http://)
-        if urlparse(potentialLink).scheme == "http":
-            potentialLink = "https" + potentialLink[4:]
 
-        # Trim this javascript nonsense
-        if javaNonsense in potentialLink:
-            potentialLink = potentialLink.replace(javaNonsense, '')
+def getPageResponse(url, pageValidators=None, slotId=None):
+    '''
+    Connects to a URL and returns the response, or None if it could not connect or the page wasn't found.
+    If the page's (etag, lastModified, contentHash) from an earlier crawl are given, the request is conditional,
+        and 304 Not Modified and fetch.goneStatuses responses are returned too.
+    Throttled responses (politeness.throttleStatuses) are returned as well, so the caller can re-queue the page.
+    If the host request slot {slotId} is given, it is released with the request's outcome.
+    '''
+    # Reuse this worker's keep-alive session (which sends fetch.requestHeaders) instead of a new connection per page
+    startRequestTime = time()
+    try:
+        pageResponse = fetch.getSession().get(url, headers=fetch.getConditionalHeaders(pageValidators), timeout=fetch.fetchTimeoutSeconds)
+    except:
+        pageResponse = None
 
-        # Link has passed through all filters and is suitable to be appended to queue
-        cleanLinks.append(potentialLink)
+    if slotId:
+        politeness.releaseSlot(url, slotId, pageResponse.status_code if pageResponse is not None else None,
+            time() - startRequestTime, pageResponse.headers.get('Retry-After') if pageResponse is not None else None)
+    if pageResponse is None:
+        return None
 
-    return cleanLinks
+    if pageResponse.status_code == 200 or pageResponse.status_code in politeness.throttleStatuses:
+        return pageResponse
+    if pageValidators and (pageResponse.status_code == 304 or pageResponse.status_code in fetch.goneStatuses):
+        return pageResponse
+    return None
 
 
-def processingQueue():
+def getPageUpdate(pageStatus, pageHTML, pageValidators=None):
     '''
-    Checks if Celery worker still has active tasks.
-    Returns a value if active; returns 0 if inactive.
+    Decides what a (re-)crawl does with a page, from its response status and HTML and its validators from an earlier crawl.
+    Returns a tuple of (pageUpdate, pageHash), where pageUpdate is "changed" (parse and store the page),
+        "unchanged", "removed", or None if the page couldn't be fetched, and pageHash is the HTML's content hash.
     '''
-    inspectWorker = app.control.inspect()
-    activeTasksDict = inspectWorker.active()
-    if activeTasksDict:
-        return list(activeTasksDict.items())[0][1]
-    else:
-        return 0
\ No newline at end of file
+    if pageStatus == 200:
+        pageHash = sha1(pageHTML.encode('utf-8', errors='replace')).hexdigest()
+        if pageValidators and pageValidators[2] == pageHash:
+            return ("unchanged", pageHash)
+        return ("changed", pageHash)
+
+    if pageValidators and pageStatus == 304:
+        return ("unchanged", None)
+    if pageValidators and pageStatus in fetch.goneStatuses:
+        return ("removed", None)
+    return (None, None)
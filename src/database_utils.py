@@ -1,11 +1,169 @@
-import nltk
+import os
 import psycopg2
-from nltk.tokenize import word_tokenize
+import zlib
+import src.analyzer_utils as analyzer
+import src.redis_utils as redis
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from itertools import count, islice
+from multiprocessing import Pool
 from psycopg2 import sql
+from psycopg2.extras import execute_values
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+from threading import BoundedSemaphore, Lock
+from time import time
 from urllib.parse import urlparse
 
 databaseConnectionParamaters = {"host": "postgres", "database": "searchEngineDb", "user": "postgres", "password": "postgres"}
 
+# Maximum number of open connections per process (Django process or Celery worker child)
+poolMaxConnections = int(os.environ.get('DATABASE_POOL_SIZE', 8))
+
+# Seconds to wait for a free connection before giving up, so code that holds one connection while waiting
+#   for another can't block every thread of the process forever once the pool is exhausted
+poolTimeoutSeconds = float(os.environ.get('DATABASE_POOL_TIMEOUT', 30))
+
+# Connections idle for longer than this many seconds are checked with "SELECT 1" before being reused
+poolHealthCheckSeconds = 30
+
+# The pool belongs to the process that created it; forked children (e.g. Celery prefork workers) build their own
+connectionPool = None
+connectionPoolPid = None
+connectionPoolSlots = None
+connectionPoolLock = Lock()
+inheritedPools = []
+connectionLastUsed = {}
+poolMetrics = {'checkouts': 0, 'connectionsOpened': 0, 'healthCheckFailures': 0, 'timeouts': 0, 'waitTime': 0.0}
+
+# Number of rows streamData() fetches from the server per round-trip
+streamItersize = 2000
+
+# Gives every server-side cursor a unique name
+streamCursorIds = count()
+
+# Every function that changes a table's pages bumps its version (see redis_utils.bumpTableVersion),
+#   which invalidates its cached search results and resident shards, and updates its row of the catalog
+
+# The catalog holds every website table's row count, size on disk, last crawl time and pre-processing state,
+#   so listing tables is a single query instead of a COUNT(*) scan of each one.
+#   It lives in the index's schema (index_utils.indexSchema), so it never shows up as a website itself
+catalogSchema = 'search_index'
+catalogTable = sql.Identifier(catalogSchema, 'catalog')
+catalogReady = False
+
+# Columns of a website's table, in the order appendDataBatch() expects a page's fields, and the type of any that aren't VARCHAR
+pageColumns = ('page_url', 'page_title', 'page_desc', 'page_source', 'page_etag', 'page_modified', 'page_hash', 'page_tokens')
+pageColumnTypes = {'page_source': sql.SQL("BYTEA")}
+
+# Every page's text is analyzed once, when it is written, and searches only ever read the resulting page_tokens.
+#   The text itself is only read again to re-analyze it (see preProcessTable), so it is kept zlib-compressed in page_source
+#   at this level, leaving page_tokens the only uncompressed copy of a page's text
+pageSourceCompression = 6
+
+# Number of pages listPages() returns at a time
+pageListSize = 100
+
+# Pre-processing analyzes pages in a pool of this many processes, which are sent pages in chunks of preProcessChunkSize
+#   and whose results are written back preProcessBatchSize pages at a time
+preProcessWorkers = int(os.environ.get('PREPROCESS_WORKERS', os.cpu_count() or 1))
+preProcessChunkSize = 25
+preProcessBatchSize = 1000
+
+
+def getConnectionPool():
+    '''
+    Returns this process's connection pool, creating it on first use (or after a fork).
+    '''
+    global connectionPool, connectionPoolPid, connectionPoolSlots
+    with connectionPoolLock:
+        if connectionPoolPid != os.getpid():
+            # Keep a forked parent's pool referenced so its connections (whose sockets are shared
+            #   with the parent) are never garbage collected, and so never closed, from the child
+            if connectionPool is not None:
+                inheritedPools.append(connectionPool)
+            connectionPool = ThreadedConnectionPool(0, poolMaxConnections, **databaseConnectionParamaters)
+            connectionPoolPid = os.getpid()
+            connectionPoolSlots = BoundedSemaphore(poolMaxConnections)
+            connectionLastUsed.clear()
+            for metric in poolMetrics:
+                poolMetrics[metric] = 0
+
+    return connectionPool
+
+
+def checkoutConnection(pool):
+    '''
+    Takes a connection from {pool}, replacing it if it has gone stale.
+    '''
+    while True:
+        databaseConnection = pool.getconn()
+        lastUsed = connectionLastUsed.get(id(databaseConnection))
+        if lastUsed is None:
+            poolMetrics['connectionsOpened'] += 1
+            return databaseConnection
+
+        if time() - lastUsed < poolHealthCheckSeconds and not databaseConnection.closed:
+            return databaseConnection
+
+        try:
+            databaseCursor = databaseConnection.cursor()
+            databaseCursor.execute("SELECT 1")
+            databaseConnection.rollback()
+            return databaseConnection
+        except psycopg2.Error:
+            poolMetrics['healthCheckFailures'] += 1
+            connectionLastUsed.pop(id(databaseConnection), None)
+            pool.putconn(databaseConnection, close=True)
+
+
+@contextmanager
+def getDatabaseConnection():
+    '''
+    Context manager that lends out a pooled database connection and returns it to the pool afterwards.
+    Any transaction left uncommitted is rolled back when the connection is returned.
+    Blocks while all of the process's poolMaxConnections connections are in use, raising PoolError
+        if none is returned within poolTimeoutSeconds.
+    '''
+    pool = getConnectionPool()
+    slots = connectionPoolSlots
+
+    startWaitTime = time()
+    slotAcquired = slots.acquire(timeout=poolTimeoutSeconds)
+    poolMetrics['waitTime'] += time() - startWaitTime
+    if not slotAcquired:
+        poolMetrics['timeouts'] += 1
+        raise PoolError(f"No database connection became free within {poolTimeoutSeconds} seconds "
+            f"(all {poolMaxConnections} are in use; raise DATABASE_POOL_SIZE if this keeps happening)")
+    try:
+        databaseConnection = checkoutConnection(pool)
+        poolMetrics['checkouts'] += 1
+        try:
+            yield databaseConnection
+        finally:
+            if databaseConnection.closed:
+                connectionLastUsed.pop(id(databaseConnection), None)
+                pool.putconn(databaseConnection, close=True)
+            else:
+                connectionLastUsed[id(databaseConnection)] = time()
+                pool.putconn(databaseConnection)
+    finally:
+        slots.release()
+
+
+def getPoolMetrics():
+    '''
+    Returns a dict of this process's connection pool usage.
+    '''
+    pool = getConnectionPool()
+    with connectionPoolLock:
+        poolStatistics = dict(poolMetrics)
+        poolStatistics['inUse'] = len(pool._used)
+        poolStatistics['idle'] = len(pool._pool)
+        poolStatistics['maxConnections'] = poolMaxConnections
+        poolStatistics['pid'] = connectionPoolPid
+
+    return poolStatistics
+
 
 def getTableName(url):
     '''
@@ -30,13 +188,12 @@ def tableExists(tableName):
     Checks to see if a table with name {tableName} already exists in database.
     Returns True if found, False if not.
     '''
-    databaseConnection = psycopg2.connect(**databaseConnectionParamaters)
-    databaseCursor = databaseConnection.cursor()
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
 
-    databaseCursor.execute("SELECT EXISTS(SELECT * FROM information_schema.tables WHERE table_name = %s)", (tableName, ))
-    result = databaseCursor.fetchone()[0]
+        databaseCursor.execute("SELECT EXISTS(SELECT * FROM information_schema.tables WHERE table_name = %s)", (tableName, ))
+        result = databaseCursor.fetchone()[0]
 
-    databaseConnection.close()
     return result
 
 
@@ -44,131 +201,484 @@ def createTable(tableName):
     '''
     Creates a table with name {tableName} in the database
     '''
-    databaseConnection = psycopg2.connect(**databaseConnectionParamaters)
-    databaseCursor = databaseConnection.cursor()
+    createCatalog()
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
 
-    query = sql.SQL("CREATE TABLE {table} (page_url VARCHAR, page_title VARCHAR, page_desc VARCHAR, page_text VARCHAR);").format(
-        table = sql.Identifier(tableName))
-    databaseCursor.execute(query)
+        query = sql.SQL("CREATE TABLE {table} (page_url VARCHAR PRIMARY KEY, page_title VARCHAR, page_desc VARCHAR, page_source BYTEA, "
+            "page_etag VARCHAR, page_modified VARCHAR, page_hash VARCHAR, page_tokens VARCHAR);").format(
+            table = sql.Identifier(tableName))
+        databaseCursor.execute(query)
+        updateCatalog(databaseCursor, tableName, rowCount=0, pre_processed=True, analyzer_stages=",".join(analyzer.analyzerStages))
+
+        databaseConnection.commit()
 
-    databaseConnection.commit()
-    databaseConnection.close()
+    createListIndexes(tableName)
+
+
+def createListIndexes(tableName):
+    '''
+    Creates the indexes listPages() reads table {tableName} with, if they don't exist yet: the title index it walks
+        in title order, and a pg_trgm trigram index over titles and URLs that finds the rows a filter matches without a full scan.
+    Builds them with CREATE INDEX CONCURRENTLY, so pages can still be written and listed while a large table is indexed.
+        That can't run in a transaction, so the connection is put in autocommit mode for the duration.
+    Returns the names of the indexes created.
+    '''
+    listIndexes = {
+        f"{tableName}_title": sql.SQL("((COALESCE(page_title, '')), page_url)"),
+        f"{tableName}_trgm": sql.SQL("USING gin (page_title gin_trgm_ops, page_url gin_trgm_ops)"),
+        }
+    createdIndexes = []
+
+    with getDatabaseConnection() as databaseConnection:
+        databaseConnection.autocommit = True
+        try:
+            databaseCursor = databaseConnection.cursor()
+            databaseCursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+            for indexName, indexDefinition in listIndexes.items():
+                # A concurrent build that failed (or was interrupted) leaves an invalid index behind, which is dropped and built again
+                databaseCursor.execute("SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = %s AND c.relnamespace = 'public'::regnamespace", (indexName, ))
+                indexState = databaseCursor.fetchone()
+                if indexState and indexState[0]:
+                    continue
+                if indexState:
+                    databaseCursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {name}").format(
+                        name = sql.Identifier(indexName)))
+
+                databaseCursor.execute(sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}").format(
+                    name = sql.Identifier(indexName),
+                    table = sql.Identifier(tableName),
+                    definition = indexDefinition))
+                createdIndexes.append(indexName)
+        finally:
+            databaseConnection.autocommit = False
+
+    return createdIndexes
+
+
+def getColumns(tableName):
+    '''
+    Returns the set of column names of table {tableName}.
+    '''
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        databaseCursor.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s", (tableName, ))
+        columns = set(column for column, in databaseCursor.fetchall())
+
+    return columns
+
+
+def hasPrimaryKey(databaseCursor, tableName):
+    '''
+    Returns whether table {tableName} has a primary key, on the caller's cursor.
+    '''
+    databaseCursor.execute("SELECT 1 FROM information_schema.table_constraints WHERE table_schema = 'public' AND table_name = %s "
+        "AND constraint_type = 'PRIMARY KEY'", (tableName, ))
+    return databaseCursor.fetchone() is not None
+
+
+def addMissingColumns(tableName):
+    '''
+    Adds any of pageColumns (e.g. the page_etag, page_modified and page_hash validators used to re-crawl only changed pages,
+        or page_source and page_tokens) that a table created before they existed is missing.
+    A table whose pages' text is still in page_text gets it moved to page_source by preProcessTable().
+    Also adds the page_url primary key that page upserts need, first deleting pages with no URL and all but
+        one copy of any duplicated URL.
+    Returns a list of the columns that were added.
+    '''
+    missingColumns = [column for column in pageColumns if column not in getColumns(tableName)]
+    deletedCount = 0
+
+    createCatalog()
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        if missingColumns:
+            query = sql.SQL("ALTER TABLE {table} {columns}").format(
+                table = sql.Identifier(tableName),
+                columns = sql.SQL(', ').join(sql.SQL("ADD COLUMN IF NOT EXISTS {column} {type}").format(
+                    column = sql.Identifier(column),
+                    type = pageColumnTypes.get(column, sql.SQL("VARCHAR")))
+                    for column in missingColumns))
+            databaseCursor.execute(query)
+
+        if not hasPrimaryKey(databaseCursor, tableName):
+            databaseCursor.execute(sql.SQL("DELETE FROM {table} WHERE page_url IS NULL").format(
+                table = sql.Identifier(tableName)))
+            deletedCount = databaseCursor.rowcount
+
+            databaseCursor.execute(sql.SQL("DELETE FROM {table} AS page USING {table} AS duplicate "
+                "WHERE page.page_url = duplicate.page_url AND page.ctid < duplicate.ctid").format(
+                table = sql.Identifier(tableName)))
+            deletedCount += databaseCursor.rowcount
+
+            databaseCursor.execute(sql.SQL("ALTER TABLE {table} ADD CONSTRAINT {name} PRIMARY KEY (page_url)").format(
+                table = sql.Identifier(tableName),
+                name = sql.Identifier(f"{tableName}_pkey")))
+            if deletedCount:
+                updateCatalog(databaseCursor, tableName, rowChange=-deletedCount)
+
+        databaseConnection.commit()
+    if deletedCount:
+        redis.bumpTableVersion(tableName)
+    return missingColumns
 
 
 def dropTable(tableName):
     '''
     Drops a table with name {tableName} from the database
     '''
-    databaseConnection = psycopg2.connect(**databaseConnectionParamaters)
-    databaseCursor = databaseConnection.cursor()
+    createCatalog()
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
 
-    query = sql.SQL("DROP TABLE {table};").format(
-        table = sql.Identifier(tableName))
-    databaseCursor.execute(query)
+        query = sql.SQL("DROP TABLE {table};").format(
+            table = sql.Identifier(tableName))
+        databaseCursor.execute(query)
+        removeFromCatalog(databaseCursor, tableName)
 
-    databaseConnection.commit()
-    databaseConnection.close()
+        databaseConnection.commit()
+    redis.bumpTableVersion(tableName)
 
 
 def changeTableName(tableName, newName):
     '''
     Renames table {tableName} to {newName} in the database.
     '''
-    databaseConnection = psycopg2.connect(**databaseConnectionParamaters)
-    databaseCursor = databaseConnection.cursor()
+    createCatalog()
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
 
-    query = sql.SQL("ALTER TABLE {old} RENAME TO {new}").format(
-        old = sql.Identifier(tableName),
-        new = sql.Identifier(newName))
-    databaseCursor.execute(query)
+        query = sql.SQL("ALTER TABLE {old} RENAME TO {new}").format(
+            old = sql.Identifier(tableName),
+            new = sql.Identifier(newName))
+        databaseCursor.execute(query)
 
-    databaseConnection.commit()
-    databaseConnection.close()
+        # The primary key and listPages() indexes keep their names otherwise, which would clash with a re-crawl of {tableName}
+        for indexSuffix in ("pkey", "title", "trgm"):
+            query = sql.SQL("ALTER INDEX IF EXISTS {old} RENAME TO {new}").format(
+                old = sql.Identifier(f"{tableName}_{indexSuffix}"),
+                new = sql.Identifier(f"{newName}_{indexSuffix}"))
+            databaseCursor.execute(query)
+
+        databaseCursor.execute(sql.SQL("UPDATE {catalog} SET table_name = %s WHERE table_name = %s").format(
+            catalog = catalogTable),
+            (newName, tableName))
+
+        databaseConnection.commit()
+    redis.bumpTableVersion(tableName, newName)
 
 
 def copyTable(tableName, newName):
     '''
     Creates a copy of {tableName} with name {newName}
     '''
-    databaseConnection = psycopg2.connect(**databaseConnectionParamaters)
-    databaseCursor = databaseConnection.cursor()
+    createCatalog()
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        # LIKE ... INCLUDING ALL keeps the page_url primary key, which upserts and batched updates match rows on
+        query = sql.SQL("CREATE TABLE {new} (LIKE {old} INCLUDING ALL); INSERT INTO {new} SELECT * FROM {old}").format(
+            old = sql.Identifier(tableName),
+            new = sql.Identifier(newName))
+        databaseCursor.execute(query)
+        copiedRows = databaseCursor.rowcount
 
-    query = sql.SQL("CREATE TABLE {new} AS SELECT * FROM {old}").format(
-        old = sql.Identifier(tableName),
-        new = sql.Identifier(newName))
-    databaseCursor.execute(query)
+        databaseCursor.execute(sql.SQL("SELECT crawled_at, pre_processed, analyzer_stages FROM {catalog} WHERE table_name = %s").format(
+            catalog = catalogTable),
+            (tableName,))
+        crawledAt, preProcessed, analyzerStages = databaseCursor.fetchone() or (None, False, None)
+        updateCatalog(databaseCursor, newName, rowCount=copiedRows, crawled_at=crawledAt, pre_processed=preProcessed, analyzer_stages=analyzerStages)
 
-    databaseConnection.commit()
-    databaseConnection.close()
+        databaseConnection.commit()
+    redis.bumpTableVersion(newName)
 
 
 def appendData(url, pageData, tableName):
     '''
-    Appends specified data to the database.
+    Appends specified data to the database, analyzing the page's text for its page_tokens.
     '''
     pageTitle, pageDesc, pageText = pageData
+    appendDataBatch([(url, pageTitle, pageDesc, compressText(pageText), None, None, None, preProcessText(pageText or ""))], tableName)
 
-    databaseConnection = psycopg2.connect(**databaseConnectionParamaters)
-    databaseCursor = databaseConnection.cursor()
 
-    databaseCursor.execute(sql.SQL("INSERT INTO {} VALUES (%s, %s, %s, %s)").format(
-        sql.Identifier(tableName)),
-        [url, pageTitle, pageDesc, pageText])
+def appendDataBatch(pages, tableName):
+    '''
+    Appends a batch of pages to the database in a single statement and transaction.
+    Each page is a tuple of (pageURL, pageTitle, pageDesc, pageSource), where pageSource is the page's text as compressText() returns it,
+        optionally followed by the (pageETag, pageModified, pageHash) validators a re-crawl uses to skip unchanged pages
+        and the page's analyzed tokens (see preProcessText).
+    Pages whose URL is already in the table are overwritten, so re-appending a page never duplicates it.
+    '''
+    # A single upsert can't touch the same row twice, so only keep the latest copy of each page
+    pages = list({page[0]: page for page in pages}.values())
+    if not pages:
+        return
+    columns = pageColumns[:len(pages[0])]
+
+    createCatalog()
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        # xmax is 0 for rows the upsert inserted (rather than updated), which are the only ones that change the row count
+        upsertedRows = execute_values(databaseCursor, sql.SQL("INSERT INTO {} ({}) VALUES %s ON CONFLICT (page_url) DO UPDATE SET {} RETURNING xmax = 0").format(
+            sql.Identifier(tableName),
+            sql.SQL(', ').join(map(sql.Identifier, columns)),
+            sql.SQL(', ').join(sql.SQL("{column} = EXCLUDED.{column}").format(column = sql.Identifier(column)) for column in columns[1:])),
+            pages, fetch=True)
+        updateCatalog(databaseCursor, tableName, rowChange=sum(inserted for inserted, in upsertedRows))
 
-    databaseConnection.commit()
-    databaseConnection.close()
+        databaseConnection.commit()
+    redis.bumpTableVersion(tableName)
 
 
-def fetchAllData(tableName):
+def streamData(tableName, columns=None, orderBy=None, itersize=None):
     '''
-    Returns all rows of data found in table with name {tableName} in database.
+    Yields the rows of table {tableName} one at a time from a server-side cursor,
+        so only {itersize} rows are ever held in memory regardless of the table's size.
+    Optionally selects only {columns} (all columns if not given), each a column name or an sql.Composable expression,
+        and sorts by column {orderBy}.
     '''
-    databaseConnection = psycopg2.connect(**databaseConnectionParamaters)
-    databaseCursor = databaseConnection.cursor()
-
-    query = sql.SQL("SELECT * FROM {table}").format(
+    if columns:
+        selectColumns = sql.SQL(', ').join(sql.Identifier(column) if isinstance(column, str) else column for column in columns)
+    else:
+        selectColumns = sql.SQL('*')
+    query = sql.SQL("SELECT {columns} FROM {table}").format(
+        columns = selectColumns,
         table = sql.Identifier(tableName))
-    databaseCursor.execute(query)
+    if orderBy:
+        query = sql.SQL("{query} ORDER BY {column}").format(
+            query = query,
+            column = sql.Identifier(orderBy))
+
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor(name=f"stream_{next(streamCursorIds)}")
+        databaseCursor.itersize = itersize or streamItersize
+        databaseCursor.execute(query)
+        for row in databaseCursor:
+            yield row
+
+
+def streamTokens(tableName, itersize=None):
+    '''
+    Yields a (pageURL, pageTitle, pageTokens) tuple for every page of table {tableName}, where pageTokens is the
+        page's text as analyzed by analyzer_utils, joined by spaces (as stored in page_tokens).
+    '''
+    for pageURL, pageTitle, *tokenColumns in streamData(tableName, ('page_url', 'page_title', *getTokenColumns(tableName)), itersize=itersize):
+        yield (pageURL, pageTitle, readTokens(*tokenColumns))
+
+
+def getTokenColumns(tableName):
+    '''
+    Returns the columns that select a page's tokens from table {tableName} (see readTokens()): page_tokens, followed,
+        for a table that hasn't been pre-processed since its pages' text was stored in page_text, by the text of any page without tokens.
+    '''
+    columns = getColumns(tableName)
+    if 'page_text' not in columns:
+        return [sql.Identifier('page_tokens')]
+    if 'page_tokens' not in columns:
+        return [sql.SQL("NULL"), sql.Identifier('page_text')]
+    return [sql.Identifier('page_tokens'), sql.SQL("CASE WHEN page_tokens IS NULL THEN page_text END")]
 
-    data = databaseCursor.fetchall()
-    databaseConnection.close()
-    return data
+
+def readTokens(pageTokens, pageText=None):
+    '''
+    Returns a page's analyzed tokens from the columns getTokenColumns() selects.
+    Only the pages of a table still waiting to be pre-processed can come without tokens, and are analyzed here.
+    '''
+    if pageTokens is None and pageText:
+        return preProcessText(pageText)
+    return pageTokens or ""
+
+
+def createCatalog():
+    '''
+    Creates the catalog if it doesn't exist yet, filling it from every existing table (see rebuildCatalog).
+    Only checks the database once per process.
+    '''
+    global catalogReady
+    if catalogReady:
+        return
+
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        databaseCursor.execute("SELECT to_regclass(%s) IS NULL", (f"{catalogSchema}.catalog",))
+        catalogCreated = databaseCursor.fetchone()[0]
+
+        databaseCursor.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {schema}").format(
+            schema = sql.Identifier(catalogSchema)))
+        databaseCursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {catalog} (table_name VARCHAR PRIMARY KEY, row_count BIGINT, "
+            "table_bytes BIGINT, crawled_at TIMESTAMPTZ, pre_processed BOOLEAN, analyzer_stages VARCHAR)").format(
+            catalog = catalogTable))
+
+        databaseConnection.commit()
+
+    catalogReady = True
+    if catalogCreated:
+        rebuildCatalog()
+
+
+def updateCatalog(databaseCursor, tableName, rowChange=0, rowCount=None, **fields):
+    '''
+    Updates table {tableName}'s row of the catalog (adding it if it has none): adds {rowChange} to its row count
+        (or sets it to {rowCount}), refreshes its size, and sets any other catalog {fields} (e.g. crawled_at=...).
+    Runs on the caller's cursor so the catalog commits together with the change it describes.
+    Callers create the catalog (see createCatalog) before opening their transaction: creating it rebuilds it from
+        every table on another connection, which would wait forever on any table the transaction has locked.
+    '''
+    columns = ['table_name', 'row_count', 'table_bytes'] + list(fields)
+    if rowCount is None:
+        rowCountUpdate = sql.SQL("row_count = {catalog}.row_count + %s").format(catalog = catalogTable)
+        rowCountValue = rowChange
+    else:
+        rowCountUpdate = sql.SQL("row_count = EXCLUDED.row_count")
+        rowCountValue = rowCount
+
+    query = sql.SQL("INSERT INTO {catalog} ({columns}) VALUES (%s, %s, pg_total_relation_size(quote_ident(%s)::regclass){values}) "
+        "ON CONFLICT (table_name) DO UPDATE SET {rowCount}, {updates}").format(
+        catalog = catalogTable,
+        columns = sql.SQL(', ').join(map(sql.Identifier, columns)),
+        values = sql.SQL('').join(sql.SQL(', %s') for field in fields),
+        rowCount = rowCountUpdate,
+        updates = sql.SQL(', ').join(sql.SQL("{column} = EXCLUDED.{column}").format(column = sql.Identifier(column)) for column in columns[2:]))
+    databaseCursor.execute(query, [tableName, rowCountValue, tableName] + list(fields.values()) + ([rowChange] if rowCount is None else []))
+
+
+def removeFromCatalog(databaseCursor, tableName):
+    '''
+    Removes table {tableName}'s row from the catalog, on the caller's cursor (see updateCatalog).
+    '''
+    databaseCursor.execute(sql.SQL("DELETE FROM {catalog} WHERE table_name = %s").format(
+        catalog = catalogTable),
+        (tableName,))
+
+
+def recordCrawl(tableName):
+    '''
+    Records in the catalog that table {tableName} has just been crawled.
+    '''
+    createCatalog()
+    with getDatabaseConnection() as databaseConnection:
+        updateCatalog(databaseConnection.cursor(), tableName, crawled_at=datetime.now(timezone.utc))
+        databaseConnection.commit()
+
+
+def rebuildCatalog():
+    '''
+    Recomputes the catalog from the tables themselves: counts every table's rows (a full scan of each),
+        measures its size, and checks whether its pages' text and tokens are stored the way they're written now
+        (in page_source and page_tokens, rather than page_text). Crawl times and analyzer chains are kept,
+        and tables that no longer exist are removed.
+    Returns the rebuilt catalog, as getAllTables() does.
+    '''
+    createCatalog()
+
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        databaseCursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
+        tableNames = [tableName for tableName, in databaseCursor.fetchall()]
+        databaseCursor.execute("SELECT table_name FROM information_schema.columns WHERE table_schema = 'public' "
+            "GROUP BY table_name HAVING bool_or(column_name = 'page_tokens') AND bool_or(column_name = 'page_source') "
+            "AND NOT bool_or(column_name = 'page_text')")
+        tokenTables = set(tableName for tableName, in databaseCursor.fetchall())
+
+        databaseCursor.execute(sql.SQL("DELETE FROM {catalog} WHERE NOT (table_name = ANY(%s))").format(
+            catalog = catalogTable),
+            (tableNames,))
+        for tableName in tableNames:
+            databaseCursor.execute(sql.SQL("SELECT COUNT(*) FROM {table}").format(
+                table = sql.Identifier(tableName)))
+            rowCount = databaseCursor.fetchone()[0]
+            updateCatalog(databaseCursor, tableName, rowCount=rowCount, pre_processed=tableName in tokenTables)
+
+        databaseConnection.commit()
+
+    return getAllTables()
+
+
+def listPages(tableName, after=None, before=None, pageFilter=None, pageSize=None):
+    '''
+    Returns one page of table {tableName}'s (pageURL, pageTitle) rows in title order, reading only those two columns
+        and walking the title index from a cursor, so each page costs the same however large the table is.
+    after/before are the (pageTitle, pageURL) of the row to start after (or end before); the first rows are returned if neither is given.
+    pageFilter optionally only keeps rows whose title or URL contains it (case-insensitively), which the trigram index
+        finds directly for filters of three or more characters. Tables created before these indexes existed get them
+        from a re-crawl or "manage.py rebuildcatalog" (see createListIndexes), and are scanned until then.
+    Returns a tuple of (rows, hasMore), where hasMore is whether more rows follow in the direction walked.
+    '''
+    pageSize = pageSize or pageListSize
+    conditions = []
+    parameters = []
+    if after or before:
+        conditions.append(sql.SQL("(COALESCE(page_title, ''), page_url) {operator} (%s, %s)").format(
+            operator = sql.SQL('<' if before else '>')))
+        parameters.extend(before or after)
+    if pageFilter:
+        conditions.append(sql.SQL("(page_title ILIKE %s OR page_url ILIKE %s)"))
+        escapedFilter = pageFilter.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        parameters.extend([f"%{escapedFilter}%"] * 2)
+
+    query = sql.SQL("SELECT page_url, page_title FROM {table}{where} ORDER BY COALESCE(page_title, '') {direction}, page_url {direction} LIMIT %s").format(
+        table = sql.Identifier(tableName),
+        where = sql.SQL(' WHERE ') + sql.SQL(' AND ').join(conditions) if conditions else sql.SQL(''),
+        direction = sql.SQL('DESC' if before else 'ASC'))
+
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        databaseCursor.execute(query, parameters + [pageSize + 1])
+        rows = databaseCursor.fetchall()
+
+    hasMore = len(rows) > pageSize
+    rows = rows[:pageSize]
+    if before:
+        rows.reverse()
+    return (rows, hasMore)
 
 
 def getAllTables():
     '''
-    Gets a list of lists of all tables in the database and their rowcounts.
+    Gets a list of lists of all tables in the database, read from the catalog in a single query:
+        [tableName, rowCount, tableBytes, crawledAt, preProcessed]
     List is sorted alphabetically by table name.
     '''
-    databaseConnection = psycopg2.connect(**databaseConnectionParamaters)
-    databaseCursor = databaseConnection.cursor()
+    createCatalog()
 
-    databaseCursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
-    databaseTables = databaseCursor.fetchall()
-    databaseConnection.close()
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
 
-    tableData = []
-    for table in databaseTables:
-        tableName = table[0]
-        rowCount = getRowCount(tableName)
-        tableData.append([tableName, rowCount])
+        databaseCursor.execute(sql.SQL("SELECT table_name, row_count, table_bytes, crawled_at, pre_processed FROM {catalog} ORDER BY table_name").format(
+            catalog = catalogTable))
+        tableData = [list(table) for table in databaseCursor.fetchall()]
 
-    return sorted(tableData)
+    return tableData
 
 
 def getRowCount(tableName):
     '''
-    Returns the number of rows in table {tableName}.
+    Returns the number of rows in table {tableName}, from the catalog if it's there (counting them if not).
     '''
-    databaseConnection = psycopg2.connect(**databaseConnectionParamaters)
-    databaseCursor = databaseConnection.cursor()
+    createCatalog()
 
-    query = sql.SQL("SELECT COUNT(*) from {table}").format(
-        table = sql.Identifier(tableName))
-    databaseCursor.execute(query)
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        databaseCursor.execute(sql.SQL("SELECT row_count FROM {catalog} WHERE table_name = %s").format(
+            catalog = catalogTable),
+            (tableName,))
+        if catalogRow := databaseCursor.fetchone():
+            return catalogRow[0]
+
+        query = sql.SQL("SELECT COUNT(*) from {table}").format(
+            table = sql.Identifier(tableName))
+        databaseCursor.execute(query)
 
-    rowCount = databaseCursor.fetchall()
-    databaseConnection.close()
+        rowCount = databaseCursor.fetchall()
     return rowCount[0][0]
 
 
@@ -176,61 +686,141 @@ def deleteRow(tableName, pageURL):
     '''
     Deletes the row in {tableName} where column page_url = {pageURL}.
     '''
-    databaseConnection = psycopg2.connect(**databaseConnectionParamaters)
-    databaseCursor = databaseConnection.cursor()
+    createCatalog()
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
 
-    query = sql.SQL("DELETE FROM {table} where {col} = %s").format(
-        table = sql.Identifier(tableName),
-        col = sql.Identifier('page_url'))
-    databaseCursor.execute(query, (pageURL,))
+        query = sql.SQL("DELETE FROM {table} where {col} = %s").format(
+            table = sql.Identifier(tableName),
+            col = sql.Identifier('page_url'))
+        databaseCursor.execute(query, (pageURL,))
+        updateCatalog(databaseCursor, tableName, rowChange=-databaseCursor.rowcount)
 
-    databaseConnection.commit()
-    databaseConnection.close()
+        databaseConnection.commit()
+    redis.bumpTableVersion(tableName)
+
+
+def initPreProcessWorker():
+    '''
+    Runs once in each pre-processing worker, loading everything the analyzer needs before any pages arrive
+        instead of on the worker's first page.
+    '''
+    analyzer.loadAnalyzer()
 
 
 def preProcessText(pageText):
     '''
-    Accepts the text of a webpage as a string and returns the 'processed' text.
-    Removes extra whitespace, punctuation, and unwanted words.
+    Accepts the text of a webpage as a string and returns the 'processed' text:
+        the tokens analyzer_utils.analyzeText() leaves, joined by spaces.
     '''
-    stop_words = ["i", "me", "my", "myself", "we", "our", "ours", "ourselves", "you",
-        "your", "yours", "yourself", "yourselves", "he", "him", "his", "himself", "she",
-        "her", "hers", "herself", "it", "its", "itself", "they", "them", "their", "theirs",
-        "themselves", "what", "which", "who", "whom", "this", "that", "these", "those",
-        "am", "is", "are", "was", "were", "be", "been", "being", "have", "has", "had",
-        "having", "do", "does", "did", "doing", "a", "an", "the", "and", "but", "if", "or",
-        "because", "as", "until", "while", "of", "at", "by", "for", "with", "about",
-        "against", "between", "into", "through", "during", "before", "after", "above",
-        "below", "to", "from", "up", "down", "in", "out", "on", "off", "over", "under",
-        "again", "further", "then", "once", "here", "there", "when", "where", "why", "how",
-        "all", "any", "both", "each", "few", "more", "most", "other", "some", "such", "no",
-        "nor", "not", "only", "own", "same", "so", "than", "too", "very", "s", "t", "can",
-        "will", "just", "don", "should", "now"]
+    return ' '.join(analyzer.analyzeText(pageText))
 
-    # Tokenize the text
-    tokenizedText = word_tokenize(pageText)
 
-    # Remove all stopwords from the text
-    processedText = [word for word in tokenizedText if not word.lower() in stop_words]
+def compressText(pageText):
+    '''
+    Returns a page's text as stored in page_source: encoded as UTF-8 and zlib-compressed.
+    '''
+    return zlib.compress((pageText or "").encode('utf-8'), pageSourceCompression)
+
+
+def decompressText(pageSource):
+    '''
+    Returns the text of a page from its page_source (see compressText).
+    '''
+    return zlib.decompress(pageSource).decode('utf-8')
 
-    return " ".join(processedText)
 
+def preProcessPage(pageData):
+    '''
+    Accepts a (pageURL, pageSource, pageText) row, where pageText is only used if the page has no page_source yet.
+    Returns a (pageURL, pageTokens, pageSource) row, where pageSource is None unless the page needs it written.
+    '''
+    pageURL, pageSource, pageText = pageData
+    if pageSource is not None:
+        return (pageURL, preProcessText(decompressText(pageSource)), None)
+    return (pageURL, preProcessText(pageText or ""), compressText(pageText))
 
-def preProcessTable(tableName):
-    websiteData = fetchAllData(tableName)
-    nltk.download('punkt')
 
-    databaseConnection = psycopg2.connect(**databaseConnectionParamaters)
-    databaseCursor = databaseConnection.cursor()
+def preProcessTable(tableName, workers=None, batchSize=None, jobId=None):
+    '''
+    (Re)computes the page_tokens of every page in {tableName} from its page_source with the current analyzer chain,
+        adding the columns first if the table doesn't have them.
+    A table from before page_source existed has every page's page_text compressed into it, and its page_text column dropped.
+    Rows are streamed from the table in batches of {batchSize}, analyzed by a pool of {workers} processes,
+        and written back with one UPDATE per batch, so memory use stays flat regardless of the table's size.
+    While the pool works on one batch, the previous batch is written and the next one is read.
+    If {jobId} is given, the pages processed so far (out of the table's total) are reported to that pre-processing job
+        after every batch (see redis.updatePreProcessJob).
+    '''
+    batchSize = batchSize or preProcessBatchSize
+    analyzer.loadAnalyzer()
+    addMissingColumns(tableName)
+    hasPageText = 'page_text' in getColumns(tableName)
+
+    totalPages = getRowCount(tableName)
+    websiteData = streamData(tableName, ('page_url', 'page_source', sql.Identifier('page_text') if hasPageText else sql.SQL("NULL")))
+    if jobId:
+        redis.updatePreProcessJob(jobId, processed=0, total=totalPages)
+
+    startTime = time()
+    processedCount = 0
+
+    with Pool(workers or preProcessWorkers, initializer=initPreProcessWorker) as workerPool:
+        pendingBatch = None
+        while True:
+            # page_source arrives as a memoryview, which can't be sent to the pool
+            pageBatch = [(pageURL, bytes(pageSource) if pageSource is not None else None, pageText)
+                for pageURL, pageSource, pageText in islice(websiteData, batchSize)]
+            processingBatch = None
+            if pageBatch:
+                processingBatch = workerPool.map_async(preProcessPage, pageBatch, preProcessChunkSize)
+
+            if pendingBatch:
+                processedPages = pendingBatch.get()
+                updatePageTokens(processedPages, tableName, hasPageText)
+
+                processedCount += len(processedPages)
+                elapsedSeconds = time() - startTime
+                print(f"Pre-processed {processedCount}/{totalPages} pages of {tableName} "
+                    f"({processedCount / elapsedSeconds:.1f} pages/sec)")
+                if jobId:
+                    redis.updatePreProcessJob(jobId, processed=processedCount)
+
+            if not processingBatch:
+                break
+            pendingBatch = processingBatch
+
+    createCatalog()
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        # Every page's text is in page_source now
+        if hasPageText:
+            databaseCursor.execute(sql.SQL("ALTER TABLE {table} DROP COLUMN IF EXISTS page_text").format(
+                table = sql.Identifier(tableName)))
+        updateCatalog(databaseCursor, tableName, pre_processed=True, analyzer_stages=",".join(analyzer.analyzerStages))
+
+        databaseConnection.commit()
+    redis.bumpTableVersion(tableName)
+
+
+def updatePageTokens(pages, tableName, clearPageText=False):
+    '''
+    Overwrites the page_tokens of a batch of (pageURL, pageTokens, pageSource) pages in a single statement and transaction,
+        also setting the page_source of those that give one.
+    If {clearPageText}, each page's page_text is cleared, so the rewritten rows no longer carry it.
+    '''
+    if not pages:
+        return
 
-    for pageData in websiteData:
-        pageURL = pageData[0]
-        pageText = pageData[3]
-        processedText = preProcessText(pageText)
+    with getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
 
-        databaseCursor.execute(sql.SQL("UPDATE {} SET page_text = %s WHERE page_url = %s").format(
-            sql.Identifier(tableName)),
-            [processedText, pageURL])
+        execute_values(databaseCursor, sql.SQL("UPDATE {table} SET page_tokens = processed.page_tokens, "
+            "page_source = COALESCE(processed.page_source::bytea, {table}.page_source){clearText} "
+            "FROM (VALUES %s) AS processed (page_url, page_tokens, page_source) WHERE {table}.page_url = processed.page_url").format(
+            table = sql.Identifier(tableName),
+            clearText = sql.SQL(", page_text = NULL") if clearPageText else sql.SQL("")),
+            pages, page_size=len(pages))
 
-    databaseConnection.commit()
-    databaseConnection.close()
\ No newline at end of file
+        databaseConnection.commit()
\ No newline at end of file
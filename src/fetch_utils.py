@@ -0,0 +1,98 @@
+import aiohttp
+import asyncio
+import os
+import random
+import requests
+from threading import local
+
+# Name the crawler identifies itself by, in its User-Agent and when matching robots.txt User-agent lines
+crawlerName = os.environ.get('CRAWLER_NAME', "Website-Search-Engine")
+
+# Identify as the crawler robots.txt is checked for, so hosts see the same agent their rules were applied to
+requestHeaders = {'User-Agent': f'Mozilla/5.0 (compatible; {crawlerName}/1.0)',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.3',
+    'Accept-Encoding': 'gzip, deflate',
+    'Accept-Language': 'en-US,en;q=0.8',
+    'Connection': 'keep-alive'
+    }
+
+# Maximum number of requests in flight at once, and per host
+fetchConcurrency = 16
+fetchConnectionsPerHost = 8
+
+# Seconds before a request is abandoned, and how many times (with exponential backoff) a timed out
+#   or failed connection is retried. Responses are never retried here: a throttled page goes back to the caller,
+#   which holds the host's request slot and re-queues the page once the slot is released (see politeness.throttleStatuses)
+fetchTimeoutSeconds = 15
+fetchRetries = 3
+fetchBackoffSeconds = 0.5
+
+# Responses meaning a page has been removed, so a re-crawl deletes it
+goneStatuses = (404, 410)
+
+# One requests.Session per thread, so every page fetched by a worker reuses its open connections
+threadSessions = local()
+
+
+def getSession():
+    '''
+    Returns this thread's keep-alive requests.Session, creating it on first use.
+    '''
+    if not hasattr(threadSessions, 'session'):
+        session = requests.Session()
+        session.headers.update(requestHeaders)
+        threadSessions.session = session
+
+    return threadSessions.session
+
+
+def getBackoff(attempt):
+    '''
+    Returns how many seconds to wait before retry number {attempt}, with jitter so retries don't arrive together.
+    '''
+    return fetchBackoffSeconds * (2 ** attempt) * (1 + random.random())
+
+
+def getConditionalHeaders(pageValidators):
+    '''
+    Accepts a page's (etag, lastModified, contentHash) from an earlier crawl, or None.
+    Returns the request headers that let the server answer 304 Not Modified if the page hasn't changed.
+    '''
+    conditionalHeaders = {}
+    if pageValidators:
+        etag, lastModified, contentHash = pageValidators
+        if etag:
+            conditionalHeaders['If-None-Match'] = etag
+        if lastModified:
+            conditionalHeaders['If-Modified-Since'] = lastModified
+
+    return conditionalHeaders
+
+
+def createAsyncSession():
+    '''
+    Returns an aiohttp session that keeps connections alive and pools them per host.
+    Must be created (and closed) inside a running event loop.
+    '''
+    connector = aiohttp.TCPConnector(limit=fetchConcurrency, limit_per_host=fetchConnectionsPerHost)
+    return aiohttp.ClientSession(connector=connector, headers=requestHeaders,
+        timeout=aiohttp.ClientTimeout(total=fetchTimeoutSeconds))
+
+
+async def fetchPage(session, url, headers=None):
+    '''
+    Fetches a URL with an aiohttp session (sending any extra {headers}), retrying timeouts and connection errors with backoff.
+    Returns a tuple of (status, pageText, responseHeaders), where pageText is None unless the status is 200,
+        or None if no response could be fetched. Every response (including 429 and 503) is returned as soon as it arrives.
+    '''
+    for attempt in range(fetchRetries + 1):
+        try:
+            async with session.get(url, headers=headers) as pageResponse:
+                if pageResponse.status != 200:
+                    return (pageResponse.status, None, pageResponse.headers)
+                return (pageResponse.status, await pageResponse.text(errors='replace'), pageResponse.headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt == fetchRetries:
+                return None
+            await asyncio.sleep(getBackoff(attempt))
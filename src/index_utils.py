@@ -0,0 +1,554 @@
+import math
+import src.analyzer_utils as analyzer
+import src.database_utils as database
+import src.query_utils as query
+import src.redis_utils as redis
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+# Index tables live in their own schema so they never show up as searchable websites
+indexSchema = 'search_index'
+
+# Okapi BM25 term-frequency saturation and document-length normalization parameters
+bm25K1 = 1.2
+bm25B = 0.75
+
+# Suffixes of every table that makes up a table's index
+indexTableSuffixes = ("_postings", "_docs", "_delta", "_tombstones", "_terms", "_stats")
+
+# Number of pages added/removed since the last merge before the delta segment gets merged into the main postings
+indexMergeThreshold = 500
+
+
+def tokenizeText(text):
+    '''
+    Splits a string of text into a list of index terms with the analyzer chain (see analyzer_utils).
+    '''
+    return analyzer.analyzeText(text)
+
+
+def getPostings(pageTokens):
+    '''
+    Accepts the analyzed tokens of a webpage (a string joined by spaces, as stored in page_tokens) and returns a tuple of
+        (postings, documentLength), where postings is a dict mapping each term on the page to a list of its token positions.
+    Shingles (see analyzer_utils.shingleSize) are posted at the position of their first token, but don't add to the page's length.
+    '''
+    postings = {}
+    tokens = pageTokens.split()
+    for position, term in enumerate(tokens):
+        postings.setdefault(term, []).append(position)
+    for shingle, position in analyzer.getShingles(tokens):
+        postings.setdefault(shingle, []).append(position)
+
+    return (postings, len(tokens))
+
+
+def getIndexTables(tableName):
+    '''
+    Returns the (postings, docs) SQL identifiers of the index for table {tableName}.
+    '''
+    return (sql.Identifier(indexSchema, f"{tableName}_postings"),
+            sql.Identifier(indexSchema, f"{tableName}_docs"))
+
+
+def getDeltaTables(tableName):
+    '''
+    Returns the (delta, tombstones) SQL identifiers of the index for table {tableName}.
+    The delta segment holds postings of pages indexed since the last merge, and tombstones
+        lists every page whose postings in the main segment are out of date.
+    '''
+    return (sql.Identifier(indexSchema, f"{tableName}_delta"),
+            sql.Identifier(indexSchema, f"{tableName}_tombstones"))
+
+
+def getStatisticsTables(tableName):
+    '''
+    Returns the (terms, stats) SQL identifiers of the index for table {tableName}.
+    Terms holds each term's document frequency and IDF, stats the table's page count and average page length.
+    '''
+    return (sql.Identifier(indexSchema, f"{tableName}_terms"),
+            sql.Identifier(indexSchema, f"{tableName}_stats"))
+
+
+def getLivePostingsQuery(tableName):
+    '''
+    Returns an SQL subquery selecting the current postings of table {tableName}: every posting in
+        the main segment that hasn't been superseded, plus every posting in the delta segment.
+    '''
+    postingsTable = getIndexTables(tableName)[0]
+    deltaTable, tombstonesTable = getDeltaTables(tableName)
+
+    return sql.SQL("(SELECT * FROM {postings} m WHERE NOT EXISTS (SELECT 1 FROM {tombstones} t WHERE t.page_url = m.page_url) "
+        "UNION ALL SELECT * FROM {delta})").format(
+        postings = postingsTable,
+        tombstones = tombstonesTable,
+        delta = deltaTable)
+
+
+def indexExists(tableName):
+    '''
+    Checks to see if an index has been built for table {tableName}.
+    Returns True if found, False if not.
+    '''
+    with database.getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        databaseCursor.execute("SELECT EXISTS(SELECT * FROM information_schema.tables WHERE table_schema = %s AND table_name = %s)",
+            (indexSchema, f"{tableName}_docs"))
+        result = databaseCursor.fetchone()[0]
+
+    return result
+
+
+def createIndex(tableName):
+    '''
+    Creates the (empty) index tables for table {tableName}.
+    '''
+    postingsTable, docsTable = getIndexTables(tableName)
+    deltaTable, tombstonesTable = getDeltaTables(tableName)
+    termsTable, statsTable = getStatisticsTables(tableName)
+
+    with database.getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        databaseCursor.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {schema}").format(
+            schema = sql.Identifier(indexSchema)))
+        databaseCursor.execute(sql.SQL("CREATE TABLE {docs} (page_url VARCHAR PRIMARY KEY, page_title VARCHAR, doc_length INTEGER)").format(
+            docs = docsTable))
+        databaseCursor.execute(sql.SQL("CREATE TABLE {postings} (term VARCHAR, page_url VARCHAR, term_freq INTEGER, positions INTEGER[])").format(
+            postings = postingsTable))
+        databaseCursor.execute(sql.SQL("CREATE INDEX {name} ON {postings} (term)").format(
+            name = sql.Identifier(f"{tableName}_postings_term"),
+            postings = postingsTable))
+        databaseCursor.execute(sql.SQL("CREATE TABLE {delta} (LIKE {postings})").format(
+            delta = deltaTable,
+            postings = postingsTable))
+        databaseCursor.execute(sql.SQL("CREATE INDEX {name} ON {delta} (term)").format(
+            name = sql.Identifier(f"{tableName}_delta_term"),
+            delta = deltaTable))
+        databaseCursor.execute(sql.SQL("CREATE INDEX {name} ON {delta} (page_url)").format(
+            name = sql.Identifier(f"{tableName}_delta_page"),
+            delta = deltaTable))
+        databaseCursor.execute(sql.SQL("CREATE TABLE {tombstones} (page_url VARCHAR PRIMARY KEY)").format(
+            tombstones = tombstonesTable))
+        databaseCursor.execute(sql.SQL("CREATE TABLE {terms} (term VARCHAR PRIMARY KEY, doc_freq INTEGER, idf DOUBLE PRECISION)").format(
+            terms = termsTable))
+        databaseCursor.execute(sql.SQL("CREATE TABLE {stats} (doc_count INTEGER, avg_doc_length DOUBLE PRECISION)").format(
+            stats = statsTable))
+
+        databaseConnection.commit()
+
+
+def dropIndex(tableName):
+    '''
+    Drops the index for table {tableName} if one exists.
+    '''
+    with database.getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        databaseCursor.execute(sql.SQL("DROP TABLE IF EXISTS {tables}").format(
+            tables = sql.SQL(', ').join(sql.Identifier(indexSchema, tableName + suffix) for suffix in indexTableSuffixes)))
+
+        databaseConnection.commit()
+    redis.bumpTableVersion(tableName)
+
+
+def renameIndex(tableName, newName):
+    '''
+    Renames the index for table {tableName} so that it follows the table to {newName}.
+    '''
+    if not indexExists(tableName):
+        return
+
+    with database.getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        for suffix in indexTableSuffixes:
+            databaseCursor.execute(sql.SQL("ALTER TABLE {old} RENAME TO {new}").format(
+                old = sql.Identifier(indexSchema, tableName + suffix),
+                new = sql.Identifier(newName + suffix)))
+        for suffix in ("_postings_term", "_delta_term", "_delta_page", "_docs_pkey", "_tombstones_pkey", "_terms_pkey"):
+            databaseCursor.execute(sql.SQL("ALTER INDEX {old} RENAME TO {new}").format(
+                old = sql.Identifier(indexSchema, tableName + suffix),
+                new = sql.Identifier(newName + suffix)))
+
+        databaseConnection.commit()
+
+
+def buildIndex(tableName):
+    '''
+    (Re)builds the inverted index for table {tableName} from the text of every page.
+    '''
+    dropIndex(tableName)
+    createIndex(tableName)
+    postingsTable, docsTable = getIndexTables(tableName)
+
+    websiteData = database.streamTokens(tableName)
+
+    with database.getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        # Redirects can store the same URL twice; only index its first row
+        indexedPages = set()
+        for pageData in websiteData:
+            pageURL = pageData[0]
+            pageTitle = pageData[1]
+            if pageURL in indexedPages:
+                continue
+            indexedPages.add(pageURL)
+            postings, documentLength = getPostings(pageData[2])
+
+            execute_values(databaseCursor, sql.SQL("INSERT INTO {docs} VALUES %s").format(
+                docs = docsTable),
+                [(pageURL, pageTitle, documentLength)])
+            execute_values(databaseCursor, sql.SQL("INSERT INTO {postings} VALUES %s").format(
+                postings = postingsTable),
+                [(term, pageURL, len(positions), positions) for term, positions in postings.items()])
+
+        updateStatistics(databaseCursor, tableName)
+
+        databaseConnection.commit()
+    redis.bumpTableVersion(tableName)
+
+
+def updateStatistics(databaseCursor, tableName):
+    '''
+    Recomputes the page count, average page length, and per-term document frequency and IDF
+        of table {tableName}'s index from its main segment, so BM25 ranking doesn't have to at query time.
+    Runs on the caller's cursor so the statistics commit together with the postings they describe.
+    '''
+    postingsTable, docsTable = getIndexTables(tableName)
+    termsTable, statsTable = getStatisticsTables(tableName)
+
+    databaseCursor.execute(sql.SQL("DELETE FROM {stats}").format(
+        stats = statsTable))
+    databaseCursor.execute(sql.SQL("INSERT INTO {stats} SELECT COUNT(*), COALESCE(AVG(doc_length), 0) FROM {docs}").format(
+        stats = statsTable,
+        docs = docsTable))
+
+    databaseCursor.execute(sql.SQL("TRUNCATE {terms}").format(
+        terms = termsTable))
+    databaseCursor.execute(sql.SQL("INSERT INTO {terms} SELECT p.term, COUNT(*), LN(1 + (s.doc_count - COUNT(*) + 0.5) / (COUNT(*) + 0.5)) "
+        "FROM {postings} p CROSS JOIN {stats} s GROUP BY p.term, s.doc_count").format(
+        terms = termsTable,
+        postings = postingsTable,
+        stats = statsTable))
+
+
+def indexPages(pages, tableName):
+    '''
+    Adds (or replaces) a batch of pages in the index of table {tableName} in a single transaction.
+    Each page is a tuple of (pageURL, pageTitle, pageTokens), where pageTokens is the page's analyzed text as stored in page_tokens.
+    The pages' postings are written to the delta segment and merged into the main segment later.
+    '''
+    pages = list({page[0]: page for page in pages}.values())
+    postingsTable, docsTable = getIndexTables(tableName)
+    deltaTable, tombstonesTable = getDeltaTables(tableName)
+
+    pageDocs = []
+    pagePostings = []
+    for pageURL, pageTitle, pageTokens in pages:
+        postings, documentLength = getPostings(pageTokens)
+        pageDocs.append((pageURL, pageTitle, documentLength))
+        pagePostings.extend((term, pageURL, len(positions), positions) for term, positions in postings.items())
+    pageURLs = [page[0] for page in pages]
+
+    with database.getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        execute_values(databaseCursor, sql.SQL("INSERT INTO {docs} VALUES %s ON CONFLICT (page_url) DO UPDATE SET page_title = EXCLUDED.page_title, doc_length = EXCLUDED.doc_length").format(
+            docs = docsTable),
+            pageDocs)
+        execute_values(databaseCursor, sql.SQL("INSERT INTO {tombstones} VALUES %s ON CONFLICT DO NOTHING").format(
+            tombstones = tombstonesTable),
+            [(pageURL,) for pageURL in pageURLs])
+        databaseCursor.execute(sql.SQL("DELETE FROM {delta} WHERE page_url = ANY(%s)").format(
+            delta = deltaTable),
+            [pageURLs])
+        execute_values(databaseCursor, sql.SQL("INSERT INTO {delta} VALUES %s").format(
+            delta = deltaTable),
+            pagePostings, page_size=1000)
+
+        databaseConnection.commit()
+    redis.bumpTableVersion(tableName)
+
+
+def removePage(url, tableName):
+    '''
+    Removes a single page from the index of table {tableName}.
+    '''
+    postingsTable, docsTable = getIndexTables(tableName)
+    deltaTable, tombstonesTable = getDeltaTables(tableName)
+
+    with database.getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        databaseCursor.execute(sql.SQL("DELETE FROM {docs} WHERE page_url = %s").format(
+            docs = docsTable),
+            [url])
+        databaseCursor.execute(sql.SQL("INSERT INTO {tombstones} VALUES (%s) ON CONFLICT DO NOTHING").format(
+            tombstones = tombstonesTable),
+            [url])
+        databaseCursor.execute(sql.SQL("DELETE FROM {delta} WHERE page_url = %s").format(
+            delta = deltaTable),
+            [url])
+
+        databaseConnection.commit()
+    redis.bumpTableVersion(tableName)
+
+
+def getDeltaSize(tableName):
+    '''
+    Returns the number of pages added to or removed from table {tableName}'s index since its last merge.
+    '''
+    deltaTable, tombstonesTable = getDeltaTables(tableName)
+
+    with database.getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        databaseCursor.execute(sql.SQL("SELECT COUNT(*) FROM {tombstones}").format(
+            tombstones = tombstonesTable))
+        deltaSize = databaseCursor.fetchone()[0]
+
+    return deltaSize
+
+
+def mergeIndex(tableName):
+    '''
+    Folds the delta segment of table {tableName}'s index into its main segment.
+    Returns the number of pages merged, or 0 if another merge of the same index is already running.
+    '''
+    postingsTable, docsTable = getIndexTables(tableName)
+    deltaTable, tombstonesTable = getDeltaTables(tableName)
+
+    with database.getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        # Only one merge per index at a time; any others have nothing left to do
+        databaseCursor.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", (f"{indexSchema}.{tableName}",))
+        if not databaseCursor.fetchone()[0]:
+            return 0
+
+        # Block new index writes (but not searches) so nothing lands between the copy and the truncate
+        databaseCursor.execute(sql.SQL("LOCK TABLE {delta}, {tombstones} IN EXCLUSIVE MODE").format(
+            delta = deltaTable,
+            tombstones = tombstonesTable))
+        databaseCursor.execute(sql.SQL("DELETE FROM {postings} m USING {tombstones} t WHERE m.page_url = t.page_url").format(
+            postings = postingsTable,
+            tombstones = tombstonesTable))
+        databaseCursor.execute(sql.SQL("INSERT INTO {postings} SELECT * FROM {delta}").format(
+            postings = postingsTable,
+            delta = deltaTable))
+        databaseCursor.execute(sql.SQL("SELECT COUNT(*) FROM {tombstones}").format(
+            tombstones = tombstonesTable))
+        mergedPages = databaseCursor.fetchone()[0]
+        databaseCursor.execute(sql.SQL("TRUNCATE {delta}, {tombstones}").format(
+            delta = deltaTable,
+            tombstones = tombstonesTable))
+        updateStatistics(databaseCursor, tableName)
+
+        databaseConnection.commit()
+    redis.bumpTableVersion(tableName)
+    return mergedPages
+
+
+def checkIndex(tableName):
+    '''
+    Compares the index of table {tableName} against the table's contents.
+    Returns a dict of lists of page URLs:
+        missing: pages in the table that aren't in the index
+        extra: pages in the index that are no longer in the table
+        stale: pages whose indexed title, length, or terms don't match the table
+    '''
+    postingsTable, docsTable = getIndexTables(tableName)
+
+    with database.getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        databaseCursor.execute(sql.SQL("SELECT page_url, page_title, doc_length FROM {docs}").format(
+            docs = docsTable))
+        indexedDocs = {pageURL: (pageTitle, documentLength) for pageURL, pageTitle, documentLength in databaseCursor.fetchall()}
+
+        databaseCursor.execute(sql.SQL("SELECT page_url, COUNT(*), SUM(term_freq) FROM {postings} p GROUP BY page_url").format(
+            postings = getLivePostingsQuery(tableName)))
+        indexedTerms = {pageURL: (termCount, int(tokenCount)) for pageURL, termCount, tokenCount in databaseCursor.fetchall()}
+
+    indexReport = {'missing': [], 'extra': [], 'stale': []}
+    tablePages = set()
+    for pageData in database.streamTokens(tableName):
+        pageURL = pageData[0]
+        if pageURL in tablePages:
+            continue
+        tablePages.add(pageURL)
+
+        if pageURL not in indexedDocs:
+            indexReport['missing'].append(pageURL)
+            continue
+
+        postings, documentLength = getPostings(pageData[2])
+        expectedTerms = (len(postings), sum(len(positions) for positions in postings.values())) if postings else None
+        if indexedDocs[pageURL] != (pageData[1], documentLength) or indexedTerms.get(pageURL) != expectedTerms:
+            indexReport['stale'].append(pageURL)
+
+    indexReport['extra'] = [pageURL for pageURL in indexedDocs if pageURL not in tablePages]
+    return indexReport
+
+
+def lookupTerms(tableName, terms):
+    '''
+    Returns the postings for each of {terms} in the index of table {tableName}.
+    Return value is a dict mapping each term to a dict of:
+        pageURL: (pageTitle, termFrequency, positions, documentLength)
+    '''
+    postingsTable, docsTable = getIndexTables(tableName)
+
+    with database.getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        query = sql.SQL("SELECT p.term, p.page_url, d.page_title, p.term_freq, p.positions, d.doc_length FROM {postings} p JOIN {docs} d USING (page_url) WHERE p.term = ANY(%s)").format(
+            postings = getLivePostingsQuery(tableName),
+            docs = docsTable)
+        databaseCursor.execute(query, (list(terms),))
+
+        termPostings = {term: {} for term in terms}
+        for term, pageURL, pageTitle, termFrequency, positions, documentLength in databaseCursor.fetchall():
+            termPostings[term][pageURL] = (pageTitle, termFrequency, positions, documentLength)
+
+    return termPostings
+
+
+def countPhrase(positionLists):
+    '''
+    Accepts the positions of each consecutive term of a phrase on one page.
+    Returns the number of places on the page where the terms appear in order.
+    '''
+    firstPositions = positionLists[0]
+    laterPositions = [set(positions) for positions in positionLists[1:]]
+    return sum(1 for position in firstPositions
+        if all((position + offset + 1) in positions for offset, positions in enumerate(laterPositions)))
+
+
+def matchQuery(tableName, parsedQuery):
+    '''
+    Evaluates a parsed query against the index of table {tableName} with a single postings lookup.
+    Needles are analyzed like page text, and needles the analyzer drops entirely are left out. Phrases are matched by intersecting the positions of their terms,
+        except phrases of exactly analyzer_utils.shingleSize terms, which are looked up as a single shingle term.
+    Returns a tuple of (termPostings, pageMatches), where termPostings is the lookupTerms() result for
+        every term in the query and pageMatches maps each matching page's URL to its number of matches.
+    '''
+    needleTerms = {needle: tokenizeText(needle) for needle in query.getNeedles(parsedQuery)}
+    parsedQuery = query.dropEmptyNeedles(parsedQuery, needleTerms)
+    needleTerms = {needle: terms for needle, terms in needleTerms.items() if terms}
+    for needle, terms in needleTerms.items():
+        if len(terms) == analyzer.shingleSize > 1:
+            needleTerms[needle] = [' '.join(terms)]
+    queryTerms = set(term for terms in needleTerms.values() for term in terms)
+    if not queryTerms:
+        return ({}, {})
+
+    termPostings = lookupTerms(tableName, queryTerms)
+
+    # Count every needle on every page that contains all of its terms
+    pageNeedleCounts = {}
+    for needle, terms in needleTerms.items():
+        candidatePages = set(termPostings[terms[0]])
+        for term in terms[1:]:
+            candidatePages &= set(termPostings[term])
+
+        for pageURL in candidatePages:
+            if len(terms) == 1:
+                numberOfMatches = termPostings[terms[0]][pageURL][1]
+            else:
+                numberOfMatches = countPhrase([termPostings[term][pageURL][2] for term in terms])
+            pageNeedleCounts.setdefault(pageURL, {})[needle] = numberOfMatches
+
+    pageMatches = {}
+    for pageURL, needleCounts in pageNeedleCounts.items():
+        if numberOfMatches := query.evaluateQuery(parsedQuery, needleCounts):
+            pageMatches[pageURL] = numberOfMatches
+
+    return (termPostings, pageMatches)
+
+
+def getPageTitles(termPostings):
+    '''
+    Returns a dict mapping the URL of every page in a lookupTerms() result to its title.
+    '''
+    return {pageURL: pagePostings[0] for pages in termPostings.values() for pageURL, pagePostings in pages.items()}
+
+
+def searchIndex(tableName, parsedQuery):
+    '''
+    Looks up a parsed query in the index of table {tableName} without reading any page text.
+    Returns an unsorted list of (numberOfMatches, pageURL, pageTitle) tuples.
+    '''
+    termPostings, pageMatches = matchQuery(tableName, parsedQuery)
+    pageTitles = getPageTitles(termPostings)
+
+    return [(numberOfMatches, pageURL, pageTitles[pageURL]) for pageURL, numberOfMatches in pageMatches.items()]
+
+
+def getTermStatistics(tableName, terms):
+    '''
+    Returns a tuple of (termIDF, documentCount, averageDocumentLength) for the index of table {tableName},
+        where termIDF is a dict mapping each of {terms} to its precomputed IDF.
+    The statistics precomputed by updateStatistics() only describe the main segment, so while the delta segment
+        holds unmerged changes the page count and average length are computed from the docs table (which is always current)
+        and termIDF is left empty, for rankIndex() to compute every IDF from the live postings.
+    '''
+    postingsTable, docsTable = getIndexTables(tableName)
+    deltaTable, tombstonesTable = getDeltaTables(tableName)
+    termsTable, statsTable = getStatisticsTables(tableName)
+
+    with database.getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor()
+
+        databaseCursor.execute(sql.SQL("SELECT EXISTS(SELECT 1 FROM {tombstones})").format(
+            tombstones = tombstonesTable))
+        if databaseCursor.fetchone()[0]:
+            databaseCursor.execute(sql.SQL("SELECT COUNT(*), COALESCE(AVG(doc_length), 0) FROM {docs}").format(
+                docs = docsTable))
+            documentCount, averageDocumentLength = databaseCursor.fetchone()
+            return ({}, documentCount, averageDocumentLength)
+
+        databaseCursor.execute(sql.SQL("SELECT term, idf FROM {terms} WHERE term = ANY(%s)").format(
+            terms = termsTable),
+            (list(terms),))
+        termIDF = dict(databaseCursor.fetchall())
+
+        databaseCursor.execute(sql.SQL("SELECT doc_count, avg_doc_length FROM {stats}").format(
+            stats = statsTable))
+        documentCount, averageDocumentLength = databaseCursor.fetchone() or (0, 0)
+
+    return (termIDF, documentCount, averageDocumentLength)
+
+
+def rankIndex(tableName, parsedQuery):
+    '''
+    Scores every page of table {tableName} that matches a parsed query with Okapi BM25,
+        summed over every term in the query.
+    Returns an unsorted list of (score, pageURL, pageTitle) tuples.
+    '''
+    termPostings, pageMatches = matchQuery(tableName, parsedQuery)
+    if not pageMatches:
+        return []
+
+    termIDF, documentCount, averageDocumentLength = getTermStatistics(tableName, termPostings)
+    documentCount = max(documentCount, 1)
+    averageDocumentLength = averageDocumentLength or 1
+
+    pageScores = {}
+    pageTitles = getPageTitles(termPostings)
+    for term, pages in termPostings.items():
+        # Without a precomputed IDF (the delta segment has unmerged changes), every live page containing the term is in its postings
+        if (idf := termIDF.get(term)) is None:
+            documentFrequency = len(pages)
+            idf = math.log(1 + (max(documentCount - documentFrequency, 0) + 0.5) / (documentFrequency + 0.5))
+
+        for pageURL, (pageTitle, termFrequency, positions, documentLength) in pages.items():
+            if pageURL not in pageMatches:
+                continue
+            lengthNorm = bm25K1 * (1 - bm25B + bm25B * documentLength / averageDocumentLength)
+            pageScores[pageURL] = pageScores.get(pageURL, 0) + idf * termFrequency * (bm25K1 + 1) / (termFrequency + lengthNorm)
+
+    return [(score, pageURL, pageTitles[pageURL]) for pageURL, score in pageScores.items()]
@@ -0,0 +1,120 @@
+import json
+import os
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+# Links containing any of these tags/sequences are never crawled
+badInclusions = ("mailto:", "tel:", "/Category:", "/File:",
+                "/Talk:", "/User:", "/Blog:", "/User_blog:", "/Special:",
+                "/Template:", "/Help:", "/Source:", "/Forum:", "_talk:",
+                "/ru/", "/es/", "/ja/", "/de/", "/fi/", "/fr/", "/f/", "/pt-br/",
+                "/uk/", "/he/", "/tr/", "/vi/", "/sv/", "/lt/", "/pl/", "/hu/",
+                "/ko/", "/da/", "/zh/", "/cs/", "/nl/", "/it/", "/el/", "/pt/",
+                "/th/", "/id/", "/lac-es/")
+
+# Links ending with any of these are never crawled
+badExtensions = (".jpg", ".png", ".gif", ".pdf", ".aspx",
+                "/view", "/download",
+                "/es", "/de", "/ja", "/fr", "/zh", "/pl", "/ru", "/nl", "/uk",
+                "/ko", "/it", "/hu", "/sv", "/cs", "/ms", "/da", "/pt-br", "/vi",
+                "/pt-pt", "/tr", "/el", "/fi", "/no", "/th", "/id", "/lt")
+
+javaNonsense = "/javascript:void(0);"
+
+# Per-site rules live in {linkRulesDirectory}/{hostname}.json, e.g.
+#   {"badInclusions": ["/Recent_changes"], "badExtensions": [".mp4"], "replaceDefaults": false}
+#   Listed rules are added to the defaults above, or replace them if replaceDefaults is true
+linkRulesDirectory = os.environ.get('LINK_RULES_DIR', 'link_rules')
+
+
+def loadLinkRules(hostname):
+    '''
+    Returns a tuple of (badInclusions, badExtensions) for a site, from its rules file if it has one.
+    '''
+    rulesPath = os.path.join(linkRulesDirectory, f"{hostname}.json")
+    if not os.path.isfile(rulesPath):
+        return (badInclusions, badExtensions)
+
+    with open(rulesPath) as rulesFile:
+        siteRules = json.load(rulesFile)
+
+    if siteRules.get('replaceDefaults'):
+        return (tuple(siteRules.get('badInclusions', ())), tuple(siteRules.get('badExtensions', ())))
+    return (badInclusions + tuple(siteRules.get('badInclusions', ())), badExtensions + tuple(siteRules.get('badExtensions', ())))
+
+
+@lru_cache(maxsize=None)
+def compileLinkFilter(hostname):
+    '''
+    Compiles a site's link rules once: every bad inclusion into a single regex alternation,
+        and bad extensions into a tuple for str.endswith().
+    Returns a tuple of (inclusionPattern, extensions), where inclusionPattern is None if there are no inclusions.
+    '''
+    siteInclusions, siteExtensions = loadLinkRules(hostname)
+
+    # Longest first, so the alternation never stops at a shorter tag that a longer one starts with
+    inclusionPattern = None
+    if siteInclusions:
+        inclusionPattern = re.compile('|'.join(re.escape(tag) for tag in sorted(set(siteInclusions), key=len, reverse=True)))
+
+    return (inclusionPattern, tuple(siteExtensions))
+
+
+def cleanLinks(links, pageURL):
+    '''
+    Accepts a list of raw links/references pulled from a webpage's <a> tags.
+    Passes links through the site's compiled filters to prune unwanted links, parsing each link at most once.
+    Returns a list of cleaned links.
+    '''
+    parsedPage = urlsplit(pageURL)
+    inclusionPattern, extensions = compileLinkFilter(parsedPage.hostname)
+
+    # Prefixes for expanding relative references, built once per page
+    siteRoot = "https://" + parsedPage.hostname
+    pageDirectory = siteRoot + parsedPage.path.rstrip('/') + "/"
+
+    cleanLinks = []
+    for link in links:
+        potentialLink = link.rstrip('/')
+
+        # Filter links to the initial URL
+        if not potentialLink:
+            continue
+
+        # Filter links that end with unwanted extensions or contain unwanted tags/sequences
+        if potentialLink.endswith(extensions):
+            continue
+        if inclusionPattern and inclusionPattern.search(potentialLink):
+            continue
+
+        # Remove any page anchors and/or queries from link
+        if not (potentialLink := potentialLink.split('#', 1)[0]):
+            continue
+        if not (potentialLink := potentialLink.split('?', 1)[0]):
+            continue
+
+        # Expand website references to full URL (which are always https:// URLs on this site, so need no parsing)
+        if "http" not in potentialLink:
+            if potentialLink[0] == '/':
+                potentialLink = siteRoot + potentialLink
+            else:
+                potentialLink = pageDirectory + potentialLink
+        else:
+            # Ignore links to other domains
+            parsedLink = urlsplit(potentialLink)
+            if parsedPage.hostname != parsedLink.hostname:
+                continue
+
+            # Only visit https:// URLs (not http://)
+            if parsedLink.scheme == "http":
+                potentialLink = "https" + potentialLink[4:]
+
+        # Trim this javascript nonsense
+        if javaNonsense in potentialLink:
+            potentialLink = potentialLink.replace(javaNonsense, '')
+
+        # Link has passed through all filters and is suitable to be appended to queue
+        cleanLinks.append(potentialLink)
+
+    return cleanLinks
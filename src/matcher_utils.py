@@ -0,0 +1,96 @@
+import os
+import src.analyzer_utils as analyzer
+from ahocorapy.keywordtree import KeywordTree
+from functools import lru_cache
+from src.search_algorithms.boyer_moore import BMcompile, BMcompileBytes, BMsearch, BMsearchBytes
+from src.search_algorithms.knuth_morris_pratt import KMPsearch, KMPsearchFind, KMPtable
+from src.search_algorithms.robin_karp import RKcompile, RKcompileNumpy, RKsearch, RKsearchNumpy
+
+# Number of compiled matchers kept around for repeated queries
+matcherCacheSize = 128
+
+# Which implementation of the BM/KMP/RK algorithms to run:
+#   "python": the reference character-by-character implementations
+#   "fast": the same algorithms on bytes/memoryviews, str.find() skip loops, and NumPy rolling hashes
+searchBackends = ("python", "fast")
+searchBackend = os.environ.get('SEARCH_BACKEND', "python")
+
+
+@lru_cache(maxsize=matcherCacheSize)
+def compileMatcher(searchMethod, needles, backend=None):
+    '''
+    Does all of a search method's per-needle preprocessing once for a tuple of needles:
+        the Boyer-Moore bad-character/good-suffix tables, the Knuth-Morris-Pratt failure table,
+        the Robin-Karp hash constants, or a single Aho-Corasick automaton over every needle.
+    Compiled matchers are cached, so repeated queries skip preprocessing entirely.
+    backend selects the implementation of the BM/KMP/RK algorithms and defaults to searchBackend.
+    Returns a function that accepts a haystack and returns a dict mapping each needle to its number of matches.
+    '''
+    backend = backend or searchBackend
+    if backend not in searchBackends:
+        raise ValueError(f'Unknown search backend "{backend}"')
+
+    if searchMethod == "AC":     # Search method is Aho-Corasick algorithm
+        keywordTree = KeywordTree(case_insensitive=True)
+        for needle in needles:
+            keywordTree.add(needle)
+        keywordTree.finalize()
+
+        def matchNeedles(haystack):
+            needleCounts = dict.fromkeys(needles, 0)
+            if resultsFound := keywordTree.search_all(haystack):
+                for keyword, position in resultsFound:
+                    needleCounts[keyword] += 1
+            return needleCounts
+
+        return matchNeedles
+
+    if searchMethod == "COUNT":       # Search method is Python str.count() method
+        needleMatchers = [(needle, lambda haystack, needle=needle: haystack.count(needle)) for needle in needles]
+    elif searchMethod == "BM" and backend == "fast":
+        needleMatchers = [(needle, lambda haystack, needle=needle, tables=BMcompileBytes(needle): len(BMsearchBytes(needle, haystack, tables)))
+            for needle in needles]
+    elif searchMethod == "KMP" and backend == "fast":
+        needleMatchers = [(needle, lambda haystack, needle=needle, table=KMPtable(needle): len(KMPsearchFind(needle, haystack, table)))
+            for needle in needles]
+    elif searchMethod == "RK" and backend == "fast":
+        needleMatchers = [(needle, lambda haystack, needle=needle, constants=RKcompileNumpy(needle): len(RKsearchNumpy(needle, haystack, constants)))
+            for needle in needles]
+    elif searchMethod == "BM":     # Search method is Boyer-Moore algorithm
+        needleMatchers = [(needle, lambda haystack, needle=needle, tables=BMcompile(needle): len(BMsearch(needle, haystack, tables)))
+            for needle in needles]
+    elif searchMethod == "KMP":     # Search method is Knuth-Morris-Pratt algorithm
+        needleMatchers = [(needle, lambda haystack, needle=needle, table=KMPtable(needle): len(KMPsearch(needle, haystack, table)))
+            for needle in needles]
+    elif searchMethod == "RK":     # Search method is Robin-Karp algorithm
+        needleMatchers = [(needle, lambda haystack, needle=needle, constants=RKcompile(needle): len(RKsearch(needle, haystack, constants=constants)))
+            for needle in needles]
+    else:
+        raise ValueError(f'Unknown search method "{searchMethod}"')
+
+    def matchNeedles(haystack):
+        return {needle: countMatches(haystack) for needle, countMatches in needleMatchers}
+
+    return matchNeedles
+
+
+@lru_cache(maxsize=matcherCacheSize)
+def compileAnalyzedMatcher(searchMethod, needles, backend=None):
+    '''
+    Compiles a matcher (see compileMatcher) for each needle as analyzed by analyzer_utils, so it can be run
+        directly on a page's stored page_tokens instead of on its lowercased text.
+    Returns a function that accepts a haystack of page tokens and returns a dict mapping each original needle to its number of matches.
+        Needles the analyzer drops entirely (e.g. a lone stop word) never match.
+    '''
+    needleTokens = analyzer.analyzeNeedles(needles)
+    tokenNeedles = tuple(dict.fromkeys(tokens for tokens in needleTokens.values() if tokens))
+    if not tokenNeedles:
+        return lambda haystack: dict.fromkeys(needles, 0)
+
+    matchTokens = compileMatcher(searchMethod, tokenNeedles, backend)
+
+    def matchNeedles(haystack):
+        tokenCounts = matchTokens(haystack)
+        return {needle: tokenCounts.get(tokens, 0) for needle, tokens in needleTokens.items()}
+
+    return matchNeedles
\ No newline at end of file
@@ -0,0 +1,142 @@
+import os
+import re
+from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Which parser pulls links, title, description and text out of a page's HTML:
+#   "bs4": BeautifulSoup's html.parser tree, walked once for each piece of data
+#   "lxml": lxml's C parser feeding PageExtractor events in a single pass (falls back to "stream" if lxml isn't installed)
+#   "stream": the standard library's HTMLParser tokenizer feeding PageExtractor events in a single pass, without building a tree
+parserBackends = ("bs4", "lxml", "stream")
+parserBackend = os.environ.get('PARSER_BACKEND', "bs4")
+
+# Everything in a page's text that isn't a letter or digit (of any script), apostrophe or hyphen is replaced with a space.
+#   Accented letters are kept, so the analyzer's "fold" stage decides whether they match their plain letters
+nonWordPattern = re.compile(r"[^\w'\-]|_")
+
+# Strings inside these tags aren't part of a page's visible text (the same ones BeautifulSoup's get_text() leaves out)
+hiddenTags = frozenset(('script', 'style', 'template', 'rt', 'rp'))
+
+
+class PageExtractor:
+    '''
+    Collects a page's links, title, description and visible text from a stream of start/end/data parser events.
+    Used directly as an lxml parser target, and fed by StreamParser for the standard library's parser.
+    '''
+    def __init__(self):
+        self.links = []
+        self.titleParts = None
+        self.pageDesc = None
+        self.textParts = []
+        self.hiddenDepth = 0
+        self.inTitle = False
+
+    def start(self, tag, attrib):
+        if tag == 'a':
+            if link := attrib.get('href'):
+                self.links.append(link)
+        elif tag in hiddenTags:
+            self.hiddenDepth += 1
+        elif tag == 'title' and self.titleParts is None:
+            self.titleParts = []
+            self.inTitle = True
+        elif tag == 'meta' and self.pageDesc is None and (attrib.get('name') or '').lower() == 'description':
+            self.pageDesc = attrib.get('content')
+
+    def end(self, tag):
+        if tag in hiddenTags and self.hiddenDepth:
+            self.hiddenDepth -= 1
+        elif tag == 'title':
+            self.inTitle = False
+
+    def data(self, data):
+        if self.hiddenDepth:
+            return
+        self.textParts.append(data)
+        if self.inTitle:
+            self.titleParts.append(data)
+
+    def close(self):
+        pageTitle = "None" if self.titleParts is None else ''.join(self.titleParts)
+        pageText = nonWordPattern.sub(' ', ''.join(self.textParts))
+        return (self.links, pageTitle, self.pageDesc or "None", pageText)
+
+
+class StreamParser(HTMLParser):
+    '''
+    Standard library HTML tokenizer that forwards its events to a PageExtractor.
+    '''
+    def __init__(self, extractor):
+        super().__init__()
+        self.extractor = extractor
+
+    def handle_starttag(self, tag, attrs):
+        self.extractor.start(tag, dict(attrs))
+
+    def handle_endtag(self, tag):
+        self.extractor.end(tag)
+
+    def handle_data(self, data):
+        self.extractor.data(data)
+
+
+def parsePage(pageHTML, backend=None):
+    '''
+    Parses a page's HTML with backend (one of parserBackends, defaulting to parserBackend).
+    Returns a tuple of (links, pageTitle, pageDesc, pageText), where links are the raw hrefs of the page's <a> tags
+        and pageText is the page's visible text with every non-word character replaced by a space.
+    '''
+    backend = backend or parserBackend
+    if backend not in parserBackends:
+        raise ValueError(f'Unknown parser backend "{backend}"')
+
+    if backend == "bs4":
+        return parseSoup(pageHTML)
+
+    extractor = PageExtractor()
+    if backend == "lxml" and etree is not None:
+        # lxml refuses to parse an empty document
+        if not pageHTML.strip():
+            return extractor.close()
+        parser = etree.HTMLParser(target=extractor)
+        parser.feed(pageHTML)
+        return parser.close()
+
+    streamParser = StreamParser(extractor)
+    streamParser.feed(pageHTML)
+    streamParser.close()
+    return extractor.close()
+
+
+def parseSoup(pageHTML):
+    '''
+    Parses a page's HTML into a BeautifulSoup tree and pulls each piece of data out of it.
+    Returns a tuple of (links, pageTitle, pageDesc, pageText), as parsePage() does.
+    '''
+    parsedPage = BeautifulSoup(pageHTML, 'html.parser')
+
+    # Find all valid links (not NoneType) from the <a> tags on the webpage
+    links = []
+    for reference in parsedPage.find_all('a'):
+        if (link := reference.get('href')):
+            links.append(link)
+
+    if parsedPage.title:
+        pageTitle = parsedPage.title.string
+    else:
+        pageTitle = "None"
+
+    pageText = nonWordPattern.sub(' ', parsedPage.get_text())
+
+    pageDesc = None
+    if descTag := parsedPage.find("meta", attrs={'name': 'description'}):
+        pageDesc = descTag.get('content')
+    if not pageDesc:
+        pageDesc = "None"
+
+    return (links, pageTitle, pageDesc, pageText)
@@ -0,0 +1,137 @@
+import os
+import src.fetch_utils as fetch
+import src.redis_utils as redis
+from time import time
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+from uuid import uuid4
+
+# robots.txt is fetched once per host and cached in Redis (and in each process) for this many seconds
+robotsCacheSeconds = 86400
+
+# Name matched against robots.txt User-agent lines ("*" entries apply to every crawler), the same one sent in fetch.requestHeaders
+robotsUserAgent = fetch.crawlerName
+
+# Concurrent requests per host, adjusted by additive increase/multiplicative decrease:
+#   every successful request raises the limit by hostIncrease / limit (about +hostIncrease per round of requests),
+#   and every 429/503 or latency spike (latencySpikeFactor times the host's average latency) multiplies it by hostDecrease
+hostStartConcurrency = 2
+hostMinConcurrency = 1
+hostMaxConcurrency = int(os.environ.get('HOST_MAX_CONCURRENCY', 16))
+hostIncrease = 1
+hostDecrease = 0.5
+latencySpikeFactor = 3
+latencySmoothing = 0.2
+
+# Responses meaning the host wants us to slow down, and how long to back off if it doesn't send Retry-After
+throttleStatuses = (429, 503)
+throttleBackoffSeconds = 5
+
+# A slot that is never released (e.g. its worker died) frees itself after this many seconds
+slotLeaseSeconds = fetch.fetchTimeoutSeconds * (fetch.fetchRetries + 1)
+
+# Inside a process: {hostname: (loadTime, RobotFileParser)}
+robotsParsers = {}
+
+
+def getRobotsParser(url):
+    '''
+    Returns the parsed robots.txt of {url}'s host, fetching it (and storing the host's crawl delay) if it isn't cached.
+    '''
+    parsedURL = urlsplit(url)
+    hostname = parsedURL.hostname
+
+    loadTime, robotsParser = robotsParsers.get(hostname, (0, None))
+    if robotsParser and time() - loadTime < robotsCacheSeconds:
+        return robotsParser
+
+    if (robotsText := redis.getRobotsText(hostname)) is None:
+        robotsText = fetchRobotsText(f"{parsedURL.scheme}://{parsedURL.netloc}/robots.txt")
+        redis.cacheRobotsText(hostname, robotsText, robotsCacheSeconds)
+
+    robotsParser = RobotFileParser()
+    robotsParser.parse(robotsText.splitlines())
+    robotsParsers[hostname] = (time(), robotsParser)
+
+    # Space requests at least Crawl-delay (or 1 / Request-rate) seconds apart
+    crawlDelay = float(robotsParser.crawl_delay(robotsUserAgent) or 0)
+    if requestRate := robotsParser.request_rate(robotsUserAgent):
+        crawlDelay = max(crawlDelay, requestRate.seconds / requestRate.requests)
+    redis.setHostState(hostname, delay=crawlDelay)
+
+    return robotsParser
+
+
+def fetchRobotsText(robotsURL):
+    '''
+    Fetches a robots.txt. Returns its text, "disallow everything" if access to it is denied,
+        or "" (allow everything) if there isn't one or it can't be fetched.
+    '''
+    try:
+        robotsResponse = fetch.getSession().get(robotsURL, timeout=fetch.fetchTimeoutSeconds)
+    except Exception:
+        return ""
+
+    if robotsResponse.status_code in (401, 403):
+        return "User-agent: *\nDisallow: /"
+    if robotsResponse.status_code != 200:
+        return ""
+    return robotsResponse.text
+
+
+def isAllowed(url):
+    '''
+    Checks if the host's robots.txt allows crawling {url}.
+    '''
+    return getRobotsParser(url).can_fetch(robotsUserAgent, url)
+
+
+def acquireSlot(url):
+    '''
+    Tries to take a request slot for {url}'s host, respecting its crawl delay and concurrency limit.
+    Returns a tuple of (slotId, waitSeconds): slotId is None if no slot was taken, in which case waitSeconds
+        is how long until the host may be requested again (-1 if it's waiting for a slot to be released).
+    '''
+    slotId = uuid4().hex
+    waitSeconds = redis.acquireHostSlot(urlsplit(url).hostname, slotId, slotLeaseSeconds, hostStartConcurrency)
+    if waitSeconds == 0:
+        return (slotId, 0)
+    return (None, waitSeconds)
+
+
+def releaseSlot(url, slotId, pageStatus, latency, retryAfter=None):
+    '''
+    Releases a slot taken for {url}, reporting how the request went so the host's concurrency limit adapts.
+    pageStatus is the response status (None if the request failed), latency its time in seconds,
+        and retryAfter the response's Retry-After header.
+    '''
+    redis.releaseHostSlot(urlsplit(url).hostname, slotId,
+        lambda hostState: adjustHostState(hostState, pageStatus, latency, retryAfter))
+
+
+def adjustHostState(hostState, pageStatus, latency, retryAfter=None):
+    '''
+    Applies additive increase/multiplicative decrease to a host's concurrency limit after a request.
+    Accepts the host's state ({'limit', 'latency', ...}, {} for a new host) and the request's outcome.
+    Returns the state fields to change.
+    '''
+    limit = hostState.get('limit', hostStartConcurrency)
+    averageLatency = hostState.get('latency')
+    stateChanges = {}
+
+    isThrottled = pageStatus in throttleStatuses
+    isLatencySpike = pageStatus is not None and averageLatency and latency > latencySpikeFactor * averageLatency
+    if isThrottled or isLatencySpike:
+        stateChanges['limit'] = max(hostMinConcurrency, limit * hostDecrease)
+    elif pageStatus is not None:
+        stateChanges['limit'] = min(hostMaxConcurrency, limit + hostIncrease / limit)
+
+    # Throttled hosts get no requests at all until they've had time to recover
+    if isThrottled:
+        backoffSeconds = float(retryAfter) if retryAfter and retryAfter.isdigit() else throttleBackoffSeconds
+        stateChanges['next'] = max(hostState.get('next', 0), time() + backoffSeconds)
+
+    if pageStatus is not None:
+        stateChanges['latency'] = latency if averageLatency is None else (1 - latencySmoothing) * averageLatency + latencySmoothing * latency
+
+    return stateChanges
@@ -0,0 +1,63 @@
+import re
+
+# A query token is either a "quoted phrase" or a run of non-whitespace characters
+queryTokenPattern = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def parseQuery(userInput):
+    '''
+    Parses a user's search input into a list of conjunctions of needles (lowercase strings).
+    A page matches the query if it contains every needle of at least one conjunction:
+        dragon sword            -> [['dragon', 'sword']]
+        dragon OR sword         -> [['dragon'], ['sword']]
+        "fire staff" OR dragon  -> [['fire staff'], ['dragon']]
+    '''
+    parsedQuery = [[]]
+    for phrase, word in queryTokenPattern.findall(userInput):
+        if word == "OR":
+            parsedQuery.append([])
+            continue
+
+        needle = (phrase or word.strip('"')).strip().lower()
+        if needle and needle not in parsedQuery[-1]:
+            parsedQuery[-1].append(needle)
+
+    return [conjunction for conjunction in parsedQuery if conjunction]
+
+
+def getNeedles(parsedQuery):
+    '''
+    Returns a list of every distinct needle in a parsed query, in the order they first appear.
+    '''
+    needles = []
+    for conjunction in parsedQuery:
+        for needle in conjunction:
+            if needle not in needles:
+                needles.append(needle)
+
+    return needles
+
+
+def dropEmptyNeedles(parsedQuery, analyzedNeedles):
+    '''
+    Accepts a parsed query and a dict mapping each of its needles to its analyzed tokens (see analyzer_utils.analyzeNeedles).
+    Returns the query without the needles the analyzer drops entirely (e.g. stop words), which no page could contain,
+        so lord of the rings matches pages with both "lord" and "rings". A conjunction left with no needles is dropped too,
+        so the query is only empty if every needle in it was dropped.
+    '''
+    prunedQuery = [[needle for needle in conjunction if analyzedNeedles[needle]] for conjunction in parsedQuery]
+    return [conjunction for conjunction in prunedQuery if conjunction]
+
+
+def evaluateQuery(parsedQuery, needleCounts):
+    '''
+    Accepts a parsed query and a dict of how many times each of its needles was found on a page.
+    Returns the number of matches on the page: the total count of every needle in a satisfied
+        conjunction, or 0 if the page doesn't match the query.
+    '''
+    matchedNeedles = set()
+    for conjunction in parsedQuery:
+        if all(needleCounts.get(needle, 0) > 0 for needle in conjunction):
+            matchedNeedles.update(conjunction)
+
+    return sum(needleCounts[needle] for needle in matchedNeedles)
@@ -1,40 +1,510 @@
+import json
+import math
+import os
 from redis import Redis
+from time import time
+from uuid import uuid4
 
 redisConnection = Redis(host='redis', port=6379)
 
-toVisitKey = 'crawling:to_visit'
-visitedKey = 'crawling:visited'
+# Every crawl keeps its keys under its own namespace, crawling:{crawlId}:{key}, so crawls can run side by side
+toVisitKey = 'to_visit'
+seenKey = 'seen'
+seenCountKey = 'seen_count'
+visitedCountKey = 'visited_count'
+inFlightKey = 'in_flight'
+crawlEventsKey = 'events'
+pageBufferKey = 'page_buffer'
+pageBufferStartKey = 'page_buffer_start'
+errorCountKey = 'error_count'
+validatorsKey = 'validators'
+pageUpdatesKey = 'page_updates'
+throttledKey = 'throttled'
+crawlKeys = (toVisitKey, seenKey, seenCountKey, visitedCountKey, inFlightKey, crawlEventsKey, pageBufferKey, pageBufferStartKey,
+    errorCountKey, validatorsKey, pageUpdatesKey, throttledKey)
 
-# Queue of URLs to visit
-def addToQueue(url):
-    '''Add url to queue of URLs to be visited'''
-    return redisConnection.sadd(toVisitKey, url)
+# Hash of crawlId -> JSON details of every crawl that is running (or was never cleaned up)
+crawlRegistryKey = 'crawling:crawls'
 
-def popFromQueue():
-    '''Pop first-in URL from the queue of URLs to be visited'''
-    if item := redisConnection.spop(toVisitKey):
-        return item.decode('utf-8')
+# Each table being crawled is locked (tables:{tableName}:crawl_lock, holding the crawl's id) so only one crawl writes to it.
+#   The lock expires this many seconds after the crawl last refreshed it, so a crawl whose process died doesn't hold its table forever
+crawlLockKey = 'crawl_lock'
+crawlLockSeconds = int(os.environ.get('CRAWL_LOCK_SECONDS', 60))
 
-def getQueueCount():
+# A crawl job's status and progress (crawling:{crawlId}:job) outlives its crawl keys, and expires this many seconds after it last changed
+crawlJobKey = 'job'
+crawlJobExpirySeconds = 86400
+
+# A queued or running job whose crawl hasn't sent a heartbeat for this many seconds is marked failed,
+#   since the process crawling it must have died (e.g. the web server it was started from restarted)
+crawlJobStaleSeconds = int(os.environ.get('CRAWL_JOB_STALE_SECONDS', 120))
+
+# A pre-processing job's status and progress (preprocessing:{jobId}:job), which expires and goes stale just like a crawl's job
+preProcessJobKey = 'job'
+
+# How the seen set is stored:
+#   "set": every URL in full, exact but growing with the length and number of URLs
+#   "bloom": a fixed-size Bloom filter bitmap sized for bloomCapacity URLs at bloomErrorRate, so memory stays flat,
+#       at the cost of skipping roughly bloomErrorRate of new URLs as already seen
+visitedSetModes = ("set", "bloom")
+visitedSetMode = os.environ.get('VISITED_SET_MODE', "set")
+bloomCapacity = int(os.environ.get('BLOOM_CAPACITY', 10000000))
+bloomErrorRate = float(os.environ.get('BLOOM_ERROR_RATE', 0.001))
+
+# Optimal bitmap size and number of hashes for the capacity and error rate (Redis bitmaps hold at most 2^32 bits)
+bloomBits = min(math.ceil(-bloomCapacity * math.log(bloomErrorRate) / math.log(2) ** 2), 2 ** 32)
+bloomHashes = max(1, round(bloomBits / bloomCapacity * math.log(2)))
+
+# Lua that sets KEYS[1] (the Bloom filter) to a URL's bit positions, using ARGV[1] bits and ARGV[2] hashes.
+#   Positions come from double hashing the URL's SHA-1. isNew is true if any bit wasn't already set
+bloomAddLua = '''
+local function bloomAdd(url)
+    local digest = redis.sha1hex(url)
+    local h1 = tonumber(string.sub(digest, 1, 8), 16)
+    local h2 = tonumber(string.sub(digest, 9, 16), 16)
+    local isNew = false
+    for i = 0, tonumber(ARGV[2]) - 1 do
+        if redis.call('SETBIT', KEYS[1], (h1 + i * h2) % tonumber(ARGV[1]), 1) == 0 then
+            isNew = true
+        end
+    end
+    return isNew
+end
+'''
+
+# Server-side frontier operations, so each is a single atomic round-trip however many URLs it covers
+# KEYS: seen set, queue. ARGV: URLs. Queues every URL that has never been queued or visited, returns how many were queued
+queueLinksScript = redisConnection.register_script('''
+local queuedCount = 0
+for i, url in ipairs(ARGV) do
+    if redis.call('SADD', KEYS[1], url) == 1 then
+        redis.call('RPUSH', KEYS[2], url)
+        queuedCount = queuedCount + 1
+    end
+end
+return queuedCount
+''')
+
+# Same as queueLinksScript, with a Bloom filter as the seen set. KEYS: filter, queue, seen counter. ARGV: bits, hashes, URLs
+queueLinksBloomScript = redisConnection.register_script(bloomAddLua + '''
+local queuedCount = 0
+for i = 3, #ARGV do
+    if bloomAdd(ARGV[i]) then
+        redis.call('RPUSH', KEYS[2], ARGV[i])
+        queuedCount = queuedCount + 1
+    end
+end
+redis.call('INCRBY', KEYS[3], queuedCount)
+return queuedCount
+''')
+
+# KEYS: filter, seen counter. ARGV: bits, hashes, URL. Adds the URL to the filter, returns 1 if it wasn't already in it
+markVisitedBloomScript = redisConnection.register_script(bloomAddLua + '''
+if bloomAdd(ARGV[3]) then
+    redis.call('INCR', KEYS[2])
+    return 1
+end
+return 0
+''')
+
+# KEYS: filter. ARGV: bits, hashes, URL. Returns 1 if every one of the URL's bits is set
+bloomContainsScript = redisConnection.register_script('''
+local digest = redis.sha1hex(ARGV[3])
+local h1 = tonumber(string.sub(digest, 1, 8), 16)
+local h2 = tonumber(string.sub(digest, 9, 16), 16)
+for i = 0, tonumber(ARGV[2]) - 1 do
+    if redis.call('GETBIT', KEYS[1], (h1 + i * h2) % tonumber(ARGV[1])) == 0 then
+        return 0
+    end
+end
+return 1
+''')
+
+# KEYS: queue, visited counter. ARGV: count. Pops up to count URLs and counts them as visited
+popVisitsScript = redisConnection.register_script('''
+local urls = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #urls > 0 then
+    redis.call('LTRIM', KEYS[1], #urls, -1)
+    redis.call('INCRBY', KEYS[2], #urls)
+end
+return urls
+''')
+
+
+# Frontier of URLs to visit. A URL enters the seen set when it is first queued, so it is never queued twice
+def queueLinks(crawlId, urls):
+    '''Queues every URL in urls that hasn't been queued or visited before. Returns the number of URLs queued'''
+    if not urls:
+        return 0
+    seenSet, queue = getCrawlKey(crawlId, seenKey), getCrawlKey(crawlId, toVisitKey)
+    if visitedSetMode == "bloom":
+        return queueLinksBloomScript(keys=[seenSet, queue, getCrawlKey(crawlId, seenCountKey)], args=[bloomBits, bloomHashes, *urls])
+    return queueLinksScript(keys=[seenSet, queue], args=list(urls))
+
+def addToQueue(crawlId, url):
+    '''Add url to queue of URLs to be visited, unless it has already been queued or visited'''
+    return queueLinks(crawlId, [url])
+
+def popVisits(crawlId, count):
+    '''Atomically pops up to count URLs from the queue and marks them visited'''
+    urls = popVisitsScript(keys=[getCrawlKey(crawlId, toVisitKey), getCrawlKey(crawlId, visitedCountKey)], args=[count])
+    return [url.decode('utf-8') for url in urls]
+
+def requeueThrottled(crawlId, url, maxRequeues):
+    '''
+    Puts a URL whose host throttled it back on the queue (no longer counting it as visited),
+        unless it has already been put back {maxRequeues} times. Returns whether it was queued again
+    '''
+    if redisConnection.hincrby(getCrawlKey(crawlId, throttledKey), url) > maxRequeues:
+        return False
+    pipeline = redisConnection.pipeline()
+    pipeline.rpush(getCrawlKey(crawlId, toVisitKey), url)
+    pipeline.decr(getCrawlKey(crawlId, visitedCountKey))
+    pipeline.execute()
+    return True
+
+def getQueueCount(crawlId):
     '''Gets the number of URLs in the queue'''
-    return redisConnection.scard(toVisitKey)
+    return redisConnection.llen(getCrawlKey(crawlId, toVisitKey))
 
 
 # Already visited URLs
-def markVisited(url):
-    '''Moves URL from queue to visited'''
-    redisConnection.sadd(visitedKey, url)
+def markVisited(crawlId, url):
+    '''Marks a URL that didn't come through the queue as visited'''
+    if visitedSetMode == "bloom":
+        isNew = markVisitedBloomScript(keys=[getCrawlKey(crawlId, seenKey), getCrawlKey(crawlId, seenCountKey)], args=[bloomBits, bloomHashes, url])
+    else:
+        isNew = redisConnection.sadd(getCrawlKey(crawlId, seenKey), url)
+    if isNew:
+        redisConnection.incr(getCrawlKey(crawlId, visitedCountKey))
 
-def hasBeenVisited(url):
-    """Checks if URL has already been visited"""
-    return redisConnection.sismember(visitedKey, url)
+def hasBeenVisited(crawlId, url):
+    """Checks if URL has already been visited (or queued to be). In bloom mode this can be a false positive"""
+    if visitedSetMode == "bloom":
+        return bool(bloomContainsScript(keys=[getCrawlKey(crawlId, seenKey)], args=[bloomBits, bloomHashes, url]))
+    return redisConnection.sismember(getCrawlKey(crawlId, seenKey), url)
 
-def getVisitedCount():
+def getVisitedCount(crawlId):
     '''Gets the number of URLs already visited by program'''
-    return redisConnection.scard(visitedKey)
+    return int(redisConnection.get(getCrawlKey(crawlId, visitedCountKey)) or 0)
+
+def getVisitedSetStats(crawlId):
+    '''
+    Reports on the seen set: its mode, how many URLs it holds, how many bytes of Redis memory it uses,
+        and the estimated chance that a new URL is wrongly treated as seen (always 0 in set mode)
+    '''
+    if visitedSetMode == "bloom":
+        itemCount = int(redisConnection.get(getCrawlKey(crawlId, seenCountKey)) or 0)
+        errorRate = (1 - math.exp(-bloomHashes * itemCount / bloomBits)) ** bloomHashes
+    else:
+        itemCount = redisConnection.scard(getCrawlKey(crawlId, seenKey))
+        errorRate = 0.0
+
+    return {'mode': visitedSetMode, 'items': itemCount,
+        'bytes': redisConnection.memory_usage(getCrawlKey(crawlId, seenKey)) or 0, 'errorRate': errorRate}
+
+
+# Coordination between crawlWebsite and the Celery workers
+def startTasks(crawlId, count=1):
+    '''Counts {count} URLs as dispatched to workers. Must be called before the tasks are sent'''
+    return redisConnection.incrby(getCrawlKey(crawlId, inFlightKey), count)
+
+def finishTask(crawlId):
+    '''Counts a worker's task as finished and wakes up the coordinator'''
+    pipeline = redisConnection.pipeline()
+    pipeline.decr(getCrawlKey(crawlId, inFlightKey))
+    pipeline.rpush(getCrawlKey(crawlId, crawlEventsKey), 'done')
+    inFlightCount, eventCount = pipeline.execute()
+    return inFlightCount
+
+def getInFlightCount(crawlId):
+    '''Gets the number of URLs dispatched to workers that haven't finished yet'''
+    return int(redisConnection.get(getCrawlKey(crawlId, inFlightKey)) or 0)
+
+def waitForCrawlEvent(crawlId, timeout):
+    '''Blocks until a worker finishes a task or {timeout} seconds pass. Returns False on timeout'''
+    return redisConnection.blpop([getCrawlKey(crawlId, crawlEventsKey)], timeout=timeout) is not None
+
+
+def recordError(crawlId):
+    '''Counts a page that couldn't be processed'''
+    return redisConnection.incr(getCrawlKey(crawlId, errorCountKey))
+
+def recordPageUpdate(crawlId, pageUpdate):
+    '''Counts a page a re-crawl found "unchanged" or "removed", or that robots.txt "blocked"'''
+    return redisConnection.hincrby(getCrawlKey(crawlId, pageUpdatesKey), pageUpdate)
+
+
+# Validators of pages stored by an earlier crawl, so a re-crawl can skip pages that haven't changed
+def storePageValidators(crawlId, pageValidators):
+    '''Accepts a dict of URL -> (etag, lastModified, contentHash) and stores it for crawl {crawlId}'''
+    if pageValidators:
+        redisConnection.hset(getCrawlKey(crawlId, validatorsKey), mapping={url: json.dumps(validators) for url, validators in pageValidators.items()})
+
+def getPageValidators(crawlId, url):
+    '''Returns a URL's (etag, lastModified, contentHash) from the earlier crawl, or None if it wasn't crawled before'''
+    if validators := redisConnection.hget(getCrawlKey(crawlId, validatorsKey), url):
+        return tuple(json.loads(validators))
+
+
+# Background jobs (crawls and pre-processing), so their progress can be followed while they run
+def setJobFields(jobKey, fields):
+    '''Sets fields of the job at {jobKey}, which expires crawlJobExpirySeconds after it last changed'''
+    pipeline = redisConnection.pipeline()
+    pipeline.hset(jobKey, mapping={field: json.dumps(value) for field, value in fields.items()})
+    pipeline.expire(jobKey, crawlJobExpirySeconds)
+    pipeline.execute()
+
+def isStaleJob(jobFields):
+    '''Checks whether a queued or running job has gone crawlJobStaleSeconds without a heartbeat, so its process must have died'''
+    return jobFields.get('status') in ("queued", "running") and \
+        time() - jobFields.get('heartbeat', jobFields.get('startTime', 0)) > crawlJobStaleSeconds
+
+def updateCrawlJob(crawlId, **fields):
+    '''Sets fields of crawl {crawlId}'s job (e.g. status, visited, queued, errors)'''
+    setJobFields(getCrawlKey(crawlId, crawlJobKey), fields)
+
+def getCrawlProgress(crawlId):
+    '''
+    Returns crawl {crawlId}'s job fields, or None if there is no such job.
+    While a Celery crawl is running, visited/queued/inFlight/errors/unchanged/removed/blocked are read live from its counters.
+    A queued or running job that hasn't had a heartbeat for crawlJobStaleSeconds is marked failed.
+    Adds elapsed seconds and pagesPerSecond.
+    '''
+    pipeline = redisConnection.pipeline()
+    pipeline.hgetall(getCrawlKey(crawlId, crawlJobKey))
+    pipeline.get(getCrawlKey(crawlId, visitedCountKey))
+    pipeline.llen(getCrawlKey(crawlId, toVisitKey))
+    pipeline.get(getCrawlKey(crawlId, inFlightKey))
+    pipeline.get(getCrawlKey(crawlId, errorCountKey))
+    pipeline.hgetall(getCrawlKey(crawlId, pageUpdatesKey))
+    crawlJob, visitedCount, queueCount, inFlightCount, errorCount, pageUpdates = pipeline.execute()
+    if not crawlJob:
+        return None
+
+    crawlProgress = {field.decode('utf-8'): json.loads(value) for field, value in crawlJob.items()}
+    if isStaleJob(crawlProgress):
+        crawlProgress.update(status="failed", error="The crawl stopped responding (its process may have been restarted)")
+        updateCrawlJob(crawlId, status=crawlProgress['status'], error=crawlProgress['error'])
+    if crawlProgress.get('status') == "running" and crawlProgress.get('crawlMode') == "celery":
+        crawlProgress.update(visited=int(visitedCount or 0), queued=queueCount,
+            inFlight=int(inFlightCount or 0), errors=int(errorCount or 0),
+            unchanged=int(pageUpdates.get(b'unchanged', 0)), removed=int(pageUpdates.get(b'removed', 0)),
+            blocked=int(pageUpdates.get(b'blocked', 0)))
+
+    elapsed = crawlProgress.get('crawlTime') or (time() - crawlProgress.get('startTime', time()))
+    crawlProgress['elapsed'] = elapsed
+    crawlProgress['pagesPerSecond'] = crawlProgress.get('visited', 0) / elapsed if elapsed else 0
+    return crawlProgress
+
+def getPreProcessKey(jobId):
+    '''Returns the Redis key of pre-processing job {jobId}'''
+    return f"preprocessing:{jobId}:{preProcessJobKey}"
+
+def updatePreProcessJob(jobId, **fields):
+    '''Sets fields of pre-processing job {jobId} (e.g. status, stage, processed, total)'''
+    setJobFields(getPreProcessKey(jobId), fields)
+
+def getPreProcessProgress(jobId):
+    '''
+    Returns pre-processing job {jobId}'s fields, or None if there is no such job.
+    A queued or running job that hasn't had a heartbeat for crawlJobStaleSeconds is marked failed.
+    Adds elapsed seconds and pagesPerSecond.
+    '''
+    preProcessJob = redisConnection.hgetall(getPreProcessKey(jobId))
+    if not preProcessJob:
+        return None
+
+    jobProgress = {field.decode('utf-8'): json.loads(value) for field, value in preProcessJob.items()}
+    if isStaleJob(jobProgress):
+        jobProgress.update(status="failed", error="Pre-processing stopped responding (its process may have been restarted)")
+        updatePreProcessJob(jobId, status=jobProgress['status'], error=jobProgress['error'])
+
+    elapsed = jobProgress.get('processTime') or (time() - jobProgress.get('startTime', time()))
+    jobProgress['elapsed'] = elapsed
+    jobProgress['pagesPerSecond'] = jobProgress.get('processed', 0) / elapsed if elapsed else 0
+    return jobProgress
+
+
+# Per-host politeness state, shared by every crawl (and worker) that visits a host
+def getHostKey(hostname, key):
+    '''Returns the Redis key {key} for host {hostname}'''
+    return f"politeness:{hostname}:{key}"
+
+# KEYS: host's slot leases (sorted set of slotId -> expiry), host's state hash. ARGV: now, slotId, leaseSeconds, startLimit.
+#   Takes a slot if the host is below its concurrency limit and past its next allowed request time.
+#   Returns "0" if the slot was taken, the seconds until the next allowed request, or "-1" if every slot is taken
+acquireSlotScript = redisConnection.register_script('''
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local nextTime = tonumber(redis.call('HGET', KEYS[2], 'next') or 0)
+if nextTime > now then
+    return tostring(nextTime - now)
+end
+local limit = tonumber(redis.call('HGET', KEYS[2], 'limit') or ARGV[4])
+if redis.call('ZCARD', KEYS[1]) >= math.max(1, math.floor(limit)) then
+    return '-1'
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[2])
+redis.call('HSET', KEYS[2], 'next', now + tonumber(redis.call('HGET', KEYS[2], 'delay') or 0))
+return '0'
+''')
+
+def acquireHostSlot(hostname, slotId, leaseSeconds, startLimit):
+    '''
+    Tries to take a request slot for host {hostname}, leased for {leaseSeconds} in case it is never released.
+    Returns 0 if the slot was taken, the seconds to wait before the host may be requested again,
+        or -1 if the host is at its concurrency limit (wait for a slot to be released)
+    '''
+    return float(acquireSlotScript(keys=[getHostKey(hostname, 'leases'), getHostKey(hostname, 'state')],
+        args=[time(), slotId, leaseSeconds, startLimit]))
+
+def releaseHostSlot(hostname, slotId, updateHostState):
+    '''
+    Releases a request slot for host {hostname} and atomically updates the host's state.
+    updateHostState accepts the state as a dict of floats ({} for a new host) and returns the fields to change
+    '''
+    leasesKey, stateKey = getHostKey(hostname, 'leases'), getHostKey(hostname, 'state')
+
+    def releaseSlot(pipeline):
+        hostState = {field.decode('utf-8'): float(value) for field, value in pipeline.hgetall(stateKey).items()}
+        stateChanges = updateHostState(hostState)
+        pipeline.multi()
+        pipeline.zrem(leasesKey, slotId)
+        if stateChanges:
+            pipeline.hset(stateKey, mapping=stateChanges)
+
+    redisConnection.transaction(releaseSlot, stateKey)
+
+def setHostState(hostname, **fields):
+    '''Sets fields of host {hostname}'s state (e.g. delay)'''
+    redisConnection.hset(getHostKey(hostname, 'state'), mapping=fields)
+
+def getHostState(hostname):
+    '''Returns host {hostname}'s state as a dict of floats, plus the number of slots in use'''
+    pipeline = redisConnection.pipeline()
+    pipeline.hgetall(getHostKey(hostname, 'state'))
+    pipeline.zcount(getHostKey(hostname, 'leases'), time(), '+inf')
+    hostState, slotsInUse = pipeline.execute()
+    hostState = {field.decode('utf-8'): float(value) for field, value in hostState.items()}
+    hostState['slotsInUse'] = slotsInUse
+    return hostState
+
+def getRobotsText(hostname):
+    '''Returns host {hostname}'s cached robots.txt, or None if it isn't cached'''
+    if robotsText := redisConnection.get(getHostKey(hostname, 'robots')):
+        return robotsText.decode('utf-8')
+    return None
+
+def cacheRobotsText(hostname, robotsText, cacheSeconds):
+    '''Caches host {hostname}'s robots.txt for {cacheSeconds}'''
+    redisConnection.set(getHostKey(hostname, 'robots'), robotsText, ex=cacheSeconds)
+
+
+# Per-table versions, bumped whenever a table's pages (or index) change, and search results cached against them
+def getTableKey(tableName, key):
+    '''Returns the Redis key {key} for table {tableName}'''
+    return f"tables:{tableName}:{key}"
+
+def getTableVersion(tableName):
+    '''Returns table {tableName}'s current version (0 if it has never changed)'''
+    return int(redisConnection.get(getTableKey(tableName, 'version')) or 0)
+
+def bumpTableVersion(*tableNames):
+    '''Bumps the version of every table in {tableNames}, so anything cached against their old versions is ignored'''
+    pipeline = redisConnection.pipeline(transaction=False)
+    for tableName in tableNames:
+        pipeline.incr(getTableKey(tableName, 'version'))
+    pipeline.execute()
+
+def getCachedSearch(tableName, tableVersion, searchKey):
+    '''Returns the JSON-decoded search result cached under {searchKey} for version {tableVersion} of table {tableName}, or None'''
+    if cachedSearch := redisConnection.get(getTableKey(tableName, f"search:{tableVersion}:{searchKey}")):
+        return json.loads(cachedSearch)
+    return None
+
+def cacheSearch(tableName, tableVersion, searchKey, searchResult, cacheSeconds):
+    '''Caches a search result for version {tableVersion} of table {tableName} for {cacheSeconds}'''
+    redisConnection.set(getTableKey(tableName, f"search:{tableVersion}:{searchKey}"), json.dumps(searchResult), ex=cacheSeconds)
+
+
+# Scraped pages waiting to be written to the database
+def bufferPage(crawlId, url, pageData):
+    '''Adds a scraped page to the write buffer. Returns (bufferLength, secondsSinceOldestPage)'''
+    pipeline = redisConnection.pipeline()
+    pipeline.rpush(getCrawlKey(crawlId, pageBufferKey), json.dumps([url, *pageData]))
+    pipeline.set(getCrawlKey(crawlId, pageBufferStartKey), time(), nx=True)
+    pipeline.get(getCrawlKey(crawlId, pageBufferStartKey))
+    bufferLength, isFirstPage, bufferStart = pipeline.execute()
+    return (bufferLength, time() - float(bufferStart))
+
+def popBufferedPages(crawlId, count):
+    '''Atomically removes and returns up to count pages from the write buffer'''
+    pipeline = redisConnection.pipeline()
+    pipeline.lrange(getCrawlKey(crawlId, pageBufferKey), 0, count - 1)
+    pipeline.ltrim(getCrawlKey(crawlId, pageBufferKey), count, -1)
+    pipeline.delete(getCrawlKey(crawlId, pageBufferStartKey))
+    pages, trimmed, deleted = pipeline.execute()
+    return [tuple(json.loads(page)) for page in pages]
+
+def requeueBufferedPages(crawlId, pages):
+    '''Puts pages back in the write buffer (e.g. after a failed flush)'''
+    if pages:
+        redisConnection.rpush(getCrawlKey(crawlId, pageBufferKey), *[json.dumps(page) for page in pages])
+
+
+# Crawl namespaces and registry
+def getCrawlKey(crawlId, key):
+    '''Returns the Redis key {key} namespaced to crawl {crawlId}'''
+    return f"crawling:{crawlId}:{key}"
+
+# KEYS: table's crawl lock. ARGV: crawlId, lockSeconds. Extends the lock if crawl {crawlId} still holds it, returns 1 if it does
+refreshCrawlLockScript = redisConnection.register_script('''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+''')
+
+# KEYS: table's crawl lock. ARGV: crawlId. Deletes the lock only if crawl {crawlId} still holds it
+releaseCrawlLockScript = redisConnection.register_script('''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+''')
+
+def registerCrawl(tableName, initialURL, crawlId=None):
+    '''
+    Registers a new crawl of {initialURL} into table {tableName}, with crawlId defaulting to a new random id,
+        and locks the table for crawlLockSeconds (see refreshCrawl()).
+    Returns the crawl's id, or None if another crawl is already writing to the same table
+    '''
+    crawlId = crawlId or uuid4().hex
+    if not redisConnection.set(getTableKey(tableName, crawlLockKey), crawlId, nx=True, ex=crawlLockSeconds):
+        return None
+
+    crawlDetails = {'tableName': tableName, 'initialURL': initialURL, 'startTime': time()}
+    redisConnection.hset(crawlRegistryKey, crawlId, json.dumps(crawlDetails))
+    return crawlId
+
+def refreshCrawl(tableName, crawlId):
+    '''Extends crawl {crawlId}'s lock on table {tableName} by crawlLockSeconds. Returns False if the crawl no longer holds it'''
+    return bool(refreshCrawlLockScript(keys=[getTableKey(tableName, crawlLockKey)], args=[crawlId, crawlLockSeconds]))
+
+def getCrawls():
+    '''Returns a dict of crawlId -> details ({tableName, initialURL, startTime}) for every registered crawl'''
+    return {crawlId.decode('utf-8'): json.loads(crawlDetails) for crawlId, crawlDetails in redisConnection.hgetall(crawlRegistryKey).items()}
 
+def clearCrawl(crawlId):
+    '''
+    Deletes every key belonging to crawl {crawlId}, removes it from the registry and unlocks its table,
+        leaving other crawls untouched
+    '''
+    if crawlDetails := redisConnection.hget(crawlRegistryKey, crawlId):
+        releaseCrawlLockScript(keys=[getTableKey(json.loads(crawlDetails)['tableName'], crawlLockKey)], args=[crawlId])
 
-# Misc
-def clearCache():
-    '''Clears the Redis database for re-crawling a website'''
-    redisConnection.flushall()
\ No newline at end of file
+    pipeline = redisConnection.pipeline()
+    pipeline.delete(*[getCrawlKey(crawlId, key) for key in crawlKeys])
+    pipeline.hdel(crawlRegistryKey, crawlId)
+    pipeline.execute()
@@ -2,7 +2,7 @@ ALPHABET_SIZE = 256
 
 def alphabet_index(c):
     val = ord(c)
-    if val > ALPHABET_SIZE:
+    if val >= ALPHABET_SIZE:
         return 63
     return val
 
@@ -76,14 +76,15 @@ def full_shift_table(S):
         F[-i - 1] = longest
     return F
 
-def BMsearch(P, T):
+def BMcompile(P):
+    return (bad_character_table(P), good_suffix_table(P), full_shift_table(P))
+
+def BMsearch(P, T, tables=None):
     if len(P) == 0 or len(T) == 0 or len(T) < len(P):
         return []
 
     matches = []
-    R = bad_character_table(P)
-    L = good_suffix_table(P)
-    F = full_shift_table(P)
+    R, L, F = tables or BMcompile(P)
 
     k = len(P) - 1
     previous_k = -1
@@ -95,6 +96,7 @@ def BMsearch(P, T):
             h -= 1
         if i == -1 or h == previous_k:
             matches.append(k - len(P) + 1)
+            previous_k = k if len(P) > 1 else -1
             k += len(P) - F[1] if len(P) > 1 else 1
         else:
             char_shift = i - R[alphabet_index(T[h])][i]
@@ -105,6 +107,36 @@ def BMsearch(P, T):
             else:
                 suffix_shift = len(P) - 1 - L[i + 1]
             shift = max(char_shift, suffix_shift)
-            previous_k = k if shift >= i + 1 else previous_k
+            previous_k = -1
             k += shift
-    return matches
\ No newline at end of file
+    return matches
+
+def BMcompileBytes(P):
+    P = P.encode('utf-8')
+    m = len(P)
+    shift = [m] * ALPHABET_SIZE
+    for i, c in enumerate(P[:-1]):
+        shift[c] = m - 1 - i
+    period = m - full_shift_table(P)[1] if m > 1 else 1
+    return (P, shift, period)
+
+def BMsearchBytes(P, T, tables=None):
+    P, shift, period = tables or BMcompileBytes(P)
+    T = T.encode('utf-8')
+    m = len(P)
+    if m == 0 or len(T) < m:
+        return []
+
+    matches = []
+    last = P[-1]
+    window = memoryview(T)
+    k = m - 1
+    while k < len(T):
+        c = T[k]
+        # Compare the whole window at C speed instead of character by character
+        if c == last and window[k - m + 1:k + 1] == P:
+            matches.append(k - m + 1)
+            k += period
+        else:
+            k += shift[c]
+    return matches
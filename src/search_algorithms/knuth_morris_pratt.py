@@ -1,30 +1,70 @@
-def KMPsearch(pattern, text):
+def KMPtable(pattern):
+    temp = [0] * (len(pattern) + 1)
+    j = 0
+    for i in range(1, len(pattern)):
+        while j > 0 and pattern[j] != pattern[i]:
+            j = temp[j]
+
+        if pattern[j] == pattern[i]:
+            j = j + 1
+        temp[i + 1] = j
+
+    return temp
+
+def KMPsearch(pattern, text, temp=None):
     results = []
     if not pattern:
-        return
+        return results
 
     if not text or len(pattern) > len(text):
-        return
+        return results
 
-    chars = list(pattern)
-    temp = [0] * (len(pattern) + 1)
-    for i in range(1, len(pattern)):
-        j = temp[i + 1]
+    if temp is None:
+        temp = KMPtable(pattern)
 
-        while j > 0 and chars[j] is not chars[i]:
+    j = 0
+    for i in range(len(text)):
+        while j > 0 and text[i] != pattern[j]:
             j = temp[j]
 
-        if j > 0 or chars[j] == chars[i]:
-            temp[i + 1] = j + 1
+        if text[i] == pattern[j]:
+            j = j + 1
+            if j == len(pattern):
+                results.append(i - j + 1)
+                j = temp[j]
+
+    return results
+
+def KMPsearchFind(pattern, text, temp=None):
+    results = []
+    if not pattern:
+        return results
+
+    if not text or len(pattern) > len(text):
+        return results
 
+    if temp is None:
+        temp = KMPtable(pattern)
+
+    first = pattern[0]
+    find = text.find
+    i = 0
     j = 0
-    for i in range(len(text)):
-        if j < len(pattern) and text[i] == pattern[j]:
+    while i < len(text):
+        # With nothing matched yet, jump straight to the next occurrence of the first character
+        if j == 0:
+            i = find(first, i)
+            if i < 0:
+                break
+
+        while j > 0 and text[i] != pattern[j]:
+            j = temp[j]
+
+        if text[i] == pattern[j]:
             j = j + 1
             if j == len(pattern):
-                results.append(i - j)
-        elif j > 0:
-            j = temp[j]
-            i = i - 1
+                results.append(i - j + 1)
+                j = temp[j]
+        i = i + 1
 
-    return results
\ No newline at end of file
+    return results
@@ -1,13 +1,13 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 ALPHABET_SIZE = 256
 
-def RKsearch(pat, txt, q=13):
-    results = []
+def RKcompile(pat, q=13):
     M = len(pat)
-    N = len(txt)
-    i = 0
-    j = 0
     p = 0
-    t = 0
     h = 1
 
     for i in range(M-1):
@@ -15,6 +15,21 @@ def RKsearch(pat, txt, q=13):
 
     for i in range(M):
         p = (ALPHABET_SIZE*p + ord(pat[i])) % q
+
+    return (h, p)
+
+def RKsearch(pat, txt, q=13, constants=None):
+    results = []
+    M = len(pat)
+    N = len(txt)
+    t = 0
+
+    if M == 0 or N < M:
+        return results
+
+    h, p = constants or RKcompile(pat, q)
+
+    for i in range(M):
         t = (ALPHABET_SIZE*t + ord(txt[i])) % q
 
     for i in range(N-M+1):
@@ -22,9 +37,7 @@ def RKsearch(pat, txt, q=13):
             for j in range(M):
                 if txt[i+j] != pat[j]:
                     break
-
-            j += 1
-            if j == M:
+            else:
                 results.append(i)
 
         if i < N-M:
@@ -32,4 +45,39 @@ def RKsearch(pat, txt, q=13):
             if t < 0:
                 t = t+q
 
-    return results
\ No newline at end of file
+    return results
+
+# Odd base, so it has an inverse modulo 2**64 (numpy's uint64 arithmetic wraps around at 2**64)
+NUMPY_BASE = 257
+NUMPY_BASE_INVERSE = pow(NUMPY_BASE, -1, 2**64)
+
+def RKpowersNumpy(base, count):
+    powers = numpy.ones(count, dtype=numpy.uint64)
+    numpy.cumprod(numpy.full(count - 1, base, dtype=numpy.uint64), out=powers[1:])
+    return powers
+
+def RKcompileNumpy(pat):
+    patRaw = pat.encode('utf-8')
+    p = sum(c * pow(NUMPY_BASE_INVERSE, j, 2**64) for j, c in enumerate(patRaw)) % 2**64
+    return (patRaw, p)
+
+def RKsearchNumpy(pat, txt, constants=None):
+    if numpy is None:
+        return RKsearch(pat, txt)
+
+    patRaw, p = constants or RKcompileNumpy(pat)
+    raw = txt.encode('utf-8')
+    M = len(patRaw)
+    N = len(raw)
+    if M == 0 or N < M:
+        return []
+
+    # Prefix sums of txt[k] * BASE**-k let every window's hash be computed at once:
+    #   hash(i) = (prefix[i+M] - prefix[i]) * BASE**i = sum(txt[i+j] * BASE**-j)
+    txt = numpy.frombuffer(raw, dtype=numpy.uint8).astype(numpy.uint64)
+    prefix = numpy.zeros(N + 1, dtype=numpy.uint64)
+    numpy.cumsum(txt * RKpowersNumpy(NUMPY_BASE_INVERSE, N), out=prefix[1:])
+    hashes = (prefix[M:] - prefix[:N - M + 1]) * RKpowersNumpy(NUMPY_BASE, N - M + 1)
+
+    # Verify hash hits byte-for-byte, just like the character loop does
+    return [int(i) for i in numpy.flatnonzero(hashes == numpy.uint64(p)) if raw[i:i + M] == patRaw]
@@ -1,55 +1,113 @@
-from ahocorapy.keywordtree import KeywordTree
-from src.database_utils import fetchAllData
-from src.search_algorithms.boyer_moore import BMsearch
-from src.search_algorithms.knuth_morris_pratt import KMPsearch
-from src.search_algorithms.robin_karp import RKsearch
+import heapq
+import src.analyzer_utils as analyzer
+import src.cache_utils as cache
+import src.index_utils as index
+import src.query_utils as query
+import src.redis_utils as redis
+import src.shard_utils as shard
+from src.database_utils import streamTokens
+from src.matcher_utils import compileAnalyzedMatcher
 from time import time
 
 
-def runSearch(tableName, userInput, searchMethod):
+def runSearch(tableName, userInput, searchMethod, amountOfResults=None, backend=None):
     '''
     Parent function for running a search for userInput in tableName.
-    Also allows for the selection of one of five different search methods.
-    Returns a sorted list of lists of length numberOfResults, taking the form:
+    Also allows for the selection of one of five different search methods, or of the
+        table's inverted index ("INDEX"), which counts whole-word matches only,
+        or BM25 relevance ranking over the index ("BM25").
+    Returns a tuple of (searchResults, foundPages, searchTime, shardTimes), where searchResults is a sorted list
+        of the top amountOfResults results (all results if not given), taking the form:
         (numberOfMatches, pageURL, pageTitle)
+    and shardTimes lists each shard's search time when the table was searched in parallel shards.
+    For BM25, numberOfMatches is the page's relevance score instead.
+    userInput may combine words, "quoted phrases" and OR (see query_utils.parseQuery);
+        every needle in it is counted in the same pass over the table.
+    Needles are run through the same analyzer chain as page text (see analyzer_utils) and matched against
+        each page's stored tokens, so no page text is normalized at query time. Needles the chain drops entirely
+        (e.g. stop words) are left out of the query instead of failing every conjunction they're in.
+    backend optionally overrides matcher_utils.searchBackend for the BM/KMP/RK methods.
     '''
-    # Read website data into the program from database
     startSearchTime = time()
-    websiteData = fetchAllData(tableName)
-    needle = userInput.lower()
+    parsedQuery = query.parseQuery(userInput)
+    parsedQuery = query.dropEmptyNeedles(parsedQuery, analyzer.analyzeNeedles(query.getNeedles(parsedQuery)))
+    needles = query.getNeedles(parsedQuery)
+    if not needles:
+        return ([], 0, time() - startSearchTime, [])
+
+    foundPages = None
+    shardTimes = []
+
+    # Index lookups never read page text; build the index first if the table doesn't have one yet
+    if searchMethod in ("INDEX", "BM25"):
+        if not index.indexExists(tableName):
+            index.buildIndex(tableName)
+        websiteData = []
+        if searchMethod == "INDEX":
+            indexResults = index.searchIndex(tableName, parsedQuery)
+        else:
+            indexResults = index.rankIndex(tableName, parsedQuery)
+    elif shard.shardCount > 1:   # Scan the table's shards in parallel worker processes
+        websiteData = []
+        indexResults, foundPages, shardTimes = shard.runShardedSearch(tableName, parsedQuery, searchMethod, amountOfResults, backend)
+    else:   # Stream website data (each page's analyzed tokens) into the program from database
+        websiteData = streamTokens(tableName)
+        indexResults = []
+
+        # Preprocess the needles once per query (or reuse a cached matcher), not once per page
+        matchNeedles = compileAnalyzedMatcher(searchMethod, tuple(needles), backend)
 
     # Keep track of page titles to prevent duplicate entries caused by redirects
-    searchTitles = []
+    searchTitles = set()
 
     # Store the search results in a list of lists
     searchResults = []
+    for numberOfMatches, pageURL, pageTitle in indexResults:
+        if pageTitle not in searchTitles:
+            searchResults.append((numberOfMatches, pageURL, pageTitle))
+            searchTitles.add(pageTitle)
+
     for pageData in websiteData:
         pageURL = pageData[0]
         pageTitle = pageData[1]
-        pageDesc = pageData[2]
-        haystack = pageData[3].lower()
-
-        numberOfMatches = 0
-        if searchMethod == "COUNT":       # Search method is Python str.count() method
-            numberOfMatches = (haystack.count(needle))
-        elif searchMethod == "BM":     # Search method is Boyer-Moore algorithm
-            numberOfMatches = len(BMsearch(needle, haystack))
-        elif searchMethod == "KMP":     # Search method is Knuth-Morris-Pratt algorithm
-            numberOfMatches = len(KMPsearch(needle, haystack))
-        elif searchMethod == "RK":     # Search method is Robin-Karp algorithm
-            numberOfMatches = len(RKsearch(needle, haystack))
-        elif searchMethod == "AC":     # Search method is Aho-Corasick algorithm
-            kwtree = KeywordTree(case_insensitive=True)
-            kwtree.add(needle)
-            kwtree.finalize()
-            if resultsFound := kwtree.search_all(haystack):
-                numberOfMatches = sum(1 for result in resultsFound)
+        haystack = pageData[2]
+
+        needleCounts = matchNeedles(haystack)
+        numberOfMatches = query.evaluateQuery(parsedQuery, needleCounts)
 
         if numberOfMatches > 0 and pageTitle not in searchTitles:
             searchResults.append((numberOfMatches, pageURL, pageTitle))
-            searchTitles.append(pageTitle)
+            searchTitles.add(pageTitle)
 
-    # Sort and return the list of results
-    searchResultsSorted = (sorted(searchResults, reverse=True))
+    # Sort and return the list of results. A bounded heap keeps only the top results instead of sorting every match
+    if foundPages is None:
+        foundPages = len(searchResults)
+    if amountOfResults:
+        searchResultsSorted = heapq.nlargest(amountOfResults, searchResults)
+    else:
+        searchResultsSorted = sorted(searchResults, reverse=True)
     searchTime = time() - startSearchTime
-    return(searchResultsSorted, searchTime)
\ No newline at end of file
+    return(searchResultsSorted, foundPages, searchTime, shardTimes)
+
+
+def runCachedSearch(tableName, userInput, searchMethod, amountOfResults=None, backend=None):
+    '''
+    Runs a search like runSearch(), but returns the cached result of an identical earlier search
+        if table {tableName} hasn't changed since (see cache_utils).
+    Returns a tuple of (searchResults, foundPages, searchTime, shardTimes, cacheHit).
+    '''
+    if not cache.resultCacheSize:
+        return runSearch(tableName, userInput, searchMethod, amountOfResults, backend) + (False,)
+
+    startSearchTime = time()
+    searchKey = cache.getSearchKey(tableName, userInput, searchMethod, amountOfResults, backend)
+
+    # Read the version before searching, so a change made during the search leaves the result stale rather than cached as current
+    tableVersion = redis.getTableVersion(tableName)
+    if cachedSearch := cache.getCachedSearch(tableName, searchKey, tableVersion):
+        searchResults, foundPages, shardTimes = cachedSearch
+        return (searchResults, foundPages, time() - startSearchTime, shardTimes, True)
+
+    searchResults, foundPages, searchTime, shardTimes = runSearch(tableName, userInput, searchMethod, amountOfResults, backend)
+    cache.cacheSearch(tableName, searchKey, tableVersion, (searchResults, foundPages, shardTimes))
+    return (searchResults, foundPages, searchTime, shardTimes, False)
\ No newline at end of file
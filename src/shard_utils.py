@@ -0,0 +1,134 @@
+import heapq
+import os
+import src.database_utils as database
+import src.query_utils as query
+import src.redis_utils as redis
+from concurrent.futures import ProcessPoolExecutor
+from psycopg2 import sql
+from src.matcher_utils import compileAnalyzedMatcher
+from threading import Lock
+from time import time
+
+# Number of worker processes a table's pages are split across (0 or 1 searches sequentially)
+shardCount = int(os.environ.get('SEARCH_SHARDS', 0))
+
+# Seconds a worker keeps its shard of a table resident before reloading it from the database.
+#   A shard is also reloaded as soon as its table's version (see redis_utils.bumpTableVersion) changes
+shardCacheSeconds = 300
+
+# One single-process executor per shard, so every shard of a table always lands in the same worker
+shardExecutors = []
+shardExecutorsLock = Lock()
+
+# Inside a worker process: {tableName: (loadTime, tableVersion, pages)} for the shard that worker owns
+residentShards = {}
+
+
+def getShardExecutors():
+    '''
+    Returns the list of shard worker executors, starting them on first use.
+    '''
+    with shardExecutorsLock:
+        if not shardExecutors:
+            for shardIndex in range(shardCount):
+                shardExecutors.append(ProcessPoolExecutor(max_workers=1))
+
+    return shardExecutors
+
+
+def loadShard(tableName, shardIndex, totalShards):
+    '''
+    Reads one shard of table {tableName} from the database. Pages are assigned to shards by a hash of their URL.
+    Returns a list of (pageURL, pageTitle, haystack) tuples, where each haystack is the page's stored tokens
+        (see database.readTokens).
+    '''
+    tokenColumns = database.getTokenColumns(tableName)
+
+    with database.getDatabaseConnection() as databaseConnection:
+        databaseCursor = databaseConnection.cursor(name=f"shard_{shardIndex}")
+        databaseCursor.itersize = database.streamItersize
+
+        shardQuery = sql.SQL("SELECT page_url, page_title, {columns} FROM {table} WHERE (hashtext(page_url) & 2147483647) %% %s = %s").format(
+            columns = sql.SQL(', ').join(tokenColumns),
+            table = sql.Identifier(tableName))
+        databaseCursor.execute(shardQuery, (totalShards, shardIndex))
+        pages = [(pageURL, pageTitle, database.readTokens(*pageTokens)) for pageURL, pageTitle, *pageTokens in databaseCursor]
+
+    return pages
+
+
+def searchShard(tableName, tableVersion, shardIndex, totalShards, parsedQuery, searchMethod, amountOfResults, backend):
+    '''
+    Runs in a shard worker process. Searches the worker's resident shard of table {tableName},
+        loading it first if it isn't resident, has expired, or was loaded from a version of the table other than {tableVersion}.
+    Returns a tuple of (searchResults, foundTitles, shardTime), where searchResults holds the shard's
+        top amountOfResults results (all results if not given) and foundTitles is the set of titles of every matching page.
+    '''
+    startShardTime = time()
+
+    loadTime, loadedVersion, pages = residentShards.get(tableName, (0, None, None))
+    if pages is None or loadedVersion != tableVersion or time() - loadTime > shardCacheSeconds:
+        pages = loadShard(tableName, shardIndex, totalShards)
+        residentShards[tableName] = (time(), tableVersion, pages)
+
+    matchNeedles = compileAnalyzedMatcher(searchMethod, tuple(query.getNeedles(parsedQuery)), backend)
+
+    searchTitles = set()
+    searchResults = []
+    for pageURL, pageTitle, haystack in pages:
+        numberOfMatches = query.evaluateQuery(parsedQuery, matchNeedles(haystack))
+        if numberOfMatches > 0 and pageTitle not in searchTitles:
+            searchResults.append((numberOfMatches, pageURL, pageTitle))
+            searchTitles.add(pageTitle)
+
+    if amountOfResults:
+        searchResults = heapq.nlargest(amountOfResults, searchResults)
+
+    return (searchResults, searchTitles, time() - startShardTime)
+
+
+def dropShard(tableName):
+    '''
+    Runs in a shard worker process. Evicts the worker's shard of table {tableName}.
+    '''
+    residentShards.pop(tableName, None)
+
+
+def runShardedSearch(tableName, parsedQuery, searchMethod, amountOfResults=None, backend=None):
+    '''
+    Searches every shard of table {tableName} in parallel and merges their top results.
+    Returns a tuple of (searchResults, foundPages, shardTimes), where shardTimes lists each shard's search time.
+    '''
+    executors = getShardExecutors()
+    tableVersion = redis.getTableVersion(tableName)
+    shardSearches = [executor.submit(searchShard, tableName, tableVersion, shardIndex, len(executors), parsedQuery, searchMethod, amountOfResults, backend)
+        for shardIndex, executor in enumerate(executors)]
+
+    # Titles are only unique within a shard, so keep the best-scoring page for each title across shards,
+    #   and count each title once however many shards found it (as the sequential search does)
+    bestResults = {}
+    foundTitles = set()
+    shardTimes = []
+    for shardSearch in shardSearches:
+        shardResults, shardTitles, shardTime = shardSearch.result()
+        foundTitles |= shardTitles
+        shardTimes.append(shardTime)
+        for result in shardResults:
+            if result[2] not in bestResults or result > bestResults[result[2]]:
+                bestResults[result[2]] = result
+
+    if amountOfResults:
+        searchResults = heapq.nlargest(amountOfResults, bestResults.values())
+    else:
+        searchResults = sorted(bestResults.values(), reverse=True)
+
+    return (searchResults, len(foundTitles), shardTimes)
+
+
+def invalidateShards(tableName):
+    '''
+    Makes every shard worker reload table {tableName} the next time it is searched.
+    '''
+    if shardExecutors:
+        for executor in shardExecutors:
+            executor.submit(dropShard, tableName)
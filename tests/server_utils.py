@@ -0,0 +1,41 @@
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    '''
+    Base handler for a stand-in website: speaks keep-alive HTTP/1.1 and keeps the test output quiet.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def sendPage(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for header, value in headers:
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandInServerTestCase(unittest.TestCase):
+    '''
+    Starts a local server running handlerClass before each test and stops it after, so tests never touch the network.
+    The server's base URL is self.baseURL, and any serverState is set as attributes of the server for the handler to use.
+    '''
+    handlerClass = StandInHandler
+    serverState = {}
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handlerClass)
+        for attribute, value in self.serverState.items():
+            setattr(self.server, attribute, value() if callable(value) else value)
+        self.baseURL = f"http://127.0.0.1:{self.server.server_address[1]}"
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
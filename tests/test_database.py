@@ -0,0 +1,30 @@
+import src.database_utils as database
+import unittest
+
+
+class PageSourceTests(unittest.TestCase):
+    def testCompressedTextRoundTrips(self):
+        for pageText in ("", "A dragon's fire-staff", "Café au lait in 東京 " * 50):
+            with self.subTest(pageText=pageText[:20]):
+                self.assertEqual(database.decompressText(database.compressText(pageText)), pageText)
+        self.assertEqual(database.decompressText(database.compressText(None)), "")
+
+    def testPreProcessPageAnalyzesSource(self):
+        pageSource = database.compressText("The Dragon SWORD")
+        self.assertEqual(database.preProcessPage(("https://example.com/", pageSource, None)),
+            ("https://example.com/", database.preProcessText("The Dragon SWORD"), None))
+
+    def testPreProcessPageMovesLegacyText(self):
+        pageURL, pageTokens, pageSource = database.preProcessPage(("https://example.com/", None, "The Dragon SWORD"))
+        self.assertEqual(pageTokens, database.preProcessText("The Dragon SWORD"))
+        self.assertEqual(database.decompressText(pageSource), "The Dragon SWORD")
+
+    def testReadTokens(self):
+        self.assertEqual(database.readTokens("the dragon sword"), "the dragon sword")
+        self.assertEqual(database.readTokens(None), "")
+        self.assertEqual(database.readTokens(None, "The Dragon SWORD"), database.preProcessText("The Dragon SWORD"))
+        self.assertEqual(database.readTokens("", "ignored"), "")
+
+
+if __name__ == '__main__':
+    unittest.main()
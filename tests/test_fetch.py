@@ -0,0 +1,107 @@
+import asyncio
+import time
+import src.fetch_utils as fetch
+import unittest
+from tests.server_utils import StandInHandler, StandInServerTestCase
+
+
+class PageHandler(StandInHandler):
+    '''
+    Serves a few pages the way a real website would, recording every request it gets:
+        /page        always 200
+        /throttled   always 503 with a Retry-After
+        /flaky       answers too slowly (after the client has timed out) until it has failed server.failures times, then 200
+        /validated   304 if the request's If-None-Match is the page's ETag, 200 with the ETag otherwise
+    '''
+    pageETag = '"v1"'
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.client_address, dict(self.headers)))
+
+        if self.path == '/throttled':
+            self.sendPage(503, headers=[('Retry-After', '30')])
+        elif self.path == '/flaky' and self.server.failures > 0:
+            self.server.failures -= 1
+            time.sleep(self.server.slowSeconds)
+            self.sendPage(200, b'<title>Too late</title>')
+        elif self.path == '/validated' and self.headers.get('If-None-Match') == self.pageETag:
+            self.sendPage(304, headers=[('ETag', self.pageETag)])
+        elif self.path == '/validated':
+            self.sendPage(200, b'<title>Validated</title>', [('ETag', self.pageETag)])
+        else:
+            self.sendPage(200, f'<title>{self.path}</title>'.encode('utf-8'))
+
+
+class FetchTests(StandInServerTestCase):
+    handlerClass = PageHandler
+    serverState = {'requests': list, 'failures': 0, 'slowSeconds': 0.5}
+
+    def setUp(self):
+        super().setUp()
+        self.backoffSeconds, self.timeoutSeconds = fetch.fetchBackoffSeconds, fetch.fetchTimeoutSeconds
+        fetch.fetchBackoffSeconds, fetch.fetchTimeoutSeconds = 0, 0.2
+
+    def tearDown(self):
+        fetch.fetchBackoffSeconds, fetch.fetchTimeoutSeconds = self.backoffSeconds, self.timeoutSeconds
+        super().tearDown()
+
+    def fetchAll(self, paths, headers=None):
+        async def fetchAll():
+            async with fetch.createAsyncSession() as session:
+                return [await fetch.fetchPage(session, self.baseURL + path, headers) for path in paths]
+        return asyncio.run(fetchAll())
+
+    def testAsyncSessionReusesConnection(self):
+        fetchResults = self.fetchAll(['/page', '/other', '/page'])
+
+        self.assertEqual([fetchResult[0] for fetchResult in fetchResults], [200, 200, 200])
+        self.assertEqual(len(set(clientAddress for path, clientAddress, headers in self.server.requests)), 1)
+
+    def testThreadSessionReusesConnection(self):
+        self.assertIs(fetch.getSession(), fetch.getSession())
+
+        for path in ('/page', '/other'):
+            self.assertEqual(fetch.getSession().get(self.baseURL + path).status_code, 200)
+        self.assertEqual(len(set(clientAddress for path, clientAddress, headers in self.server.requests)), 1)
+        self.assertEqual(self.server.requests[0][2]['User-Agent'], fetch.requestHeaders['User-Agent'])
+
+    def testRetriesTimeouts(self):
+        self.server.failures = fetch.fetchRetries
+        status, pageText, responseHeaders = self.fetchAll(['/flaky'])[0]
+
+        self.assertEqual((status, pageText), (200, '<title>/flaky</title>'))
+        self.assertEqual(len(self.server.requests), fetch.fetchRetries + 1)
+
+    def testGivesUpAfterRetries(self):
+        self.server.failures = fetch.fetchRetries + 1
+        self.assertIsNone(self.fetchAll(['/flaky'])[0])
+        self.assertEqual(len(self.server.requests), fetch.fetchRetries + 1)
+
+    def testReturnsThrottledResponse(self):
+        status, pageText, responseHeaders = self.fetchAll(['/throttled'])[0]
+
+        self.assertEqual(status, 503)
+        self.assertIsNone(pageText)
+        self.assertEqual(responseHeaders.get('Retry-After'), '30')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def testBackoffGrowsExponentially(self):
+        fetch.fetchBackoffSeconds = 1
+        self.assertTrue(1 <= fetch.getBackoff(0) < 2)
+        self.assertTrue(4 <= fetch.getBackoff(2) < 8)
+
+    def testConditionalRequest(self):
+        status, pageText, responseHeaders = self.fetchAll(['/validated'])[0]
+        self.assertEqual((status, pageText), (200, '<title>Validated</title>'))
+
+        pageValidators = (responseHeaders.get('ETag'), None, None)
+        conditionalHeaders = fetch.getConditionalHeaders(pageValidators)
+        self.assertEqual(conditionalHeaders, {'If-None-Match': PageHandler.pageETag})
+
+        status, pageText, responseHeaders = self.fetchAll(['/validated'], conditionalHeaders)[0]
+        self.assertEqual((status, pageText), (304, None))
+        self.assertEqual(fetch.getConditionalHeaders(None), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import src.fetch_utils as fetch
+import src.politeness_utils as politeness
+import unittest
+from tests.server_utils import StandInHandler, StandInServerTestCase
+from time import time
+from urllib.robotparser import RobotFileParser
+
+
+class RobotsHandler(StandInHandler):
+    '''
+    Serves /robots.txt with server.robotsStatus and server.robotsText, recording the User-Agent of every request it gets.
+    '''
+    def do_GET(self):
+        self.server.userAgents.append(self.headers.get('User-Agent'))
+        self.sendPage(self.server.robotsStatus, self.server.robotsText.encode('utf-8') if self.server.robotsStatus == 200 else b'')
+
+
+class AdjustHostStateTests(unittest.TestCase):
+    def testSuccessRaisesLimitAdditively(self):
+        stateChanges = politeness.adjustHostState({}, 200, 0.1)
+        self.assertEqual(stateChanges['limit'], politeness.hostStartConcurrency + politeness.hostIncrease / politeness.hostStartConcurrency)
+        self.assertEqual(stateChanges['latency'], 0.1)
+        self.assertNotIn('next', stateChanges)
+
+        hostState = {'limit': 4.0, 'latency': 0.1}
+        for request in range(20):
+            hostState.update(politeness.adjustHostState(hostState, 200, 0.1))
+        self.assertGreater(hostState['limit'], 6)
+        self.assertLessEqual(hostState['limit'], politeness.hostMaxConcurrency)
+
+    def testLimitStaysWithinBounds(self):
+        self.assertEqual(politeness.adjustHostState({'limit': politeness.hostMaxConcurrency}, 200, 0.1)['limit'], politeness.hostMaxConcurrency)
+        self.assertEqual(politeness.adjustHostState({'limit': politeness.hostMinConcurrency}, 503, 0.1)['limit'], politeness.hostMinConcurrency)
+
+    def testThrottleHalvesLimitAndBacksOff(self):
+        for pageStatus in politeness.throttleStatuses:
+            stateChanges = politeness.adjustHostState({'limit': 8.0, 'latency': 0.1}, pageStatus, 0.1)
+            self.assertEqual(stateChanges['limit'], 8.0 * politeness.hostDecrease)
+            self.assertAlmostEqual(stateChanges['next'], time() + politeness.throttleBackoffSeconds, delta=1)
+
+        stateChanges = politeness.adjustHostState({'limit': 8.0}, 429, 0.1, "30")
+        self.assertAlmostEqual(stateChanges['next'], time() + 30, delta=1)
+
+    def testThrottleNeverShortensBackoff(self):
+        nextTime = time() + 600
+        self.assertEqual(politeness.adjustHostState({'limit': 8.0, 'next': nextTime}, 503, 0.1)['next'], nextTime)
+
+    def testLatencySpikeHalvesLimit(self):
+        hostState = {'limit': 8.0, 'latency': 0.1}
+        stateChanges = politeness.adjustHostState(hostState, 200, 0.1 * politeness.latencySpikeFactor * 2)
+        self.assertEqual(stateChanges['limit'], 8.0 * politeness.hostDecrease)
+        self.assertGreater(stateChanges['latency'], hostState['latency'])
+
+    def testFailedRequestChangesNothing(self):
+        self.assertEqual(politeness.adjustHostState({'limit': 8.0, 'latency': 0.1}, None, 15), {})
+
+
+class RobotsTests(StandInServerTestCase):
+    handlerClass = RobotsHandler
+    serverState = {'userAgents': list, 'robotsStatus': 200, 'robotsText': ""}
+
+    def setUp(self):
+        super().setUp()
+        self.robotsURL = f"{self.baseURL}/robots.txt"
+
+    def tearDown(self):
+        super().tearDown()
+        politeness.robotsParsers.clear()
+
+    def getParser(self, robotsText):
+        robotsParser = RobotFileParser()
+        robotsParser.parse(robotsText.splitlines())
+        return robotsParser
+
+    def testRobotsAgentIsTheAgentSent(self):
+        self.server.robotsText = "User-agent: *\nAllow: /\n"
+        politeness.fetchRobotsText(self.robotsURL)
+
+        sentAgent = self.server.userAgents[0]
+        self.assertEqual(sentAgent, fetch.requestHeaders['User-Agent'])
+        self.assertIn(politeness.robotsUserAgent, sentAgent)
+
+    def testDisallowForCrawler(self):
+        robotsParser = self.getParser(f"User-agent: {politeness.robotsUserAgent}\nDisallow: /private\n\nUser-agent: *\nDisallow: /\n")
+        politeness.robotsParsers['example.com'] = (time(), robotsParser)
+
+        self.assertFalse(politeness.isAllowed("https://example.com/private/page"))
+        self.assertTrue(politeness.isAllowed("https://example.com/public/page"))
+
+    def testDisallowForEveryone(self):
+        politeness.robotsParsers['example.com'] = (time(), self.getParser("User-agent: *\nDisallow: /\n"))
+        self.assertFalse(politeness.isAllowed("https://example.com/"))
+
+    def testFetchRobotsText(self):
+        self.server.robotsText = "User-agent: *\nDisallow: /private\n"
+        self.assertEqual(politeness.fetchRobotsText(self.robotsURL), self.server.robotsText)
+
+        self.server.robotsStatus = 403
+        self.assertFalse(self.getParser(politeness.fetchRobotsText(self.robotsURL)).can_fetch(politeness.robotsUserAgent, "/"))
+
+        self.server.robotsStatus = 404
+        self.assertEqual(politeness.fetchRobotsText(self.robotsURL), "")
+
+
+if __name__ == '__main__':
+    unittest.main()
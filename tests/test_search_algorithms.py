@@ -0,0 +1,92 @@
+import random
+import unittest
+from src.matcher_utils import compileMatcher, searchBackends
+from src.search_algorithms.boyer_moore import BMsearch, BMsearchBytes
+from src.search_algorithms.knuth_morris_pratt import KMPsearch, KMPsearchFind
+from src.search_algorithms.robin_karp import RKsearch, RKsearchNumpy
+
+# (needle, haystack) pairs covering empty inputs, needles longer than the haystack, overlapping and repeated patterns,
+#   and characters outside ASCII (accented letters are kept in page text, see parser_utils.nonWordPattern)
+searchCases = [
+    ("", "dragon"),
+    ("dragon", ""),
+    ("", ""),
+    ("dragonsword", "dragon"),
+    ("dragon", "dragon"),
+    ("dragon", "a dragon and a dragon"),
+    ("aa", "aaaaa"),
+    ("aba", "abababa"),
+    ("abab", "abababab"),
+    ("a", "banana"),
+    ("ana", "bananas ananas"),
+    ("abcab", "abcabcabcab"),
+    ("ab", "ba"),
+    ("z", "banana"),
+    ("café", "café au lait, café"),
+    ("é", "ééé"),
+    ("東京", "東京 and 東京東京"),
+    ("ā", "ĀāĀā"),
+    ("fire staff", "fire staff fire staffs firestaff"),
+]
+
+# Every function that finds a needle's match positions in a haystack
+searchFunctions = {
+    'BMsearch': BMsearch,
+    'BMsearchBytes': BMsearchBytes,
+    'KMPsearch': KMPsearch,
+    'KMPsearchFind': KMPsearchFind,
+    'RKsearch': RKsearch,
+    'RKsearchNumpy': RKsearchNumpy,
+}
+
+
+def countNaive(needle, haystack):
+    '''
+    Counts every (overlapping) occurrence of {needle} in {haystack} by checking every position. An empty needle never matches.
+    '''
+    if not needle:
+        return 0
+    return sum(1 for position in range(len(haystack) - len(needle) + 1) if haystack.startswith(needle, position))
+
+
+class SearchAlgorithmTests(unittest.TestCase):
+    def testFunctionsMatchNaiveCount(self):
+        for name, searchFunction in searchFunctions.items():
+            for needle, haystack in searchCases:
+                with self.subTest(function=name, needle=needle, haystack=haystack):
+                    self.assertEqual(len(searchFunction(needle, haystack)), countNaive(needle, haystack))
+
+    def testFunctionsMatchNaiveCountOnRandomText(self):
+        # A small alphabet makes overlapping and nearly-matching windows common
+        randomCases = random.Random(7)
+        for case in range(300):
+            needle = ''.join(randomCases.choices("abé", k=randomCases.randint(1, 5)))
+            haystack = ''.join(randomCases.choices("abé", k=randomCases.randint(0, 40)))
+            for name, searchFunction in searchFunctions.items():
+                with self.subTest(function=name, needle=needle, haystack=haystack):
+                    self.assertEqual(len(searchFunction(needle, haystack)), countNaive(needle, haystack))
+
+    def testCharacterFunctionsReturnPositions(self):
+        for name in ('BMsearch', 'KMPsearch', 'KMPsearchFind', 'RKsearch'):
+            with self.subTest(function=name):
+                self.assertEqual(searchFunctions[name]("aba", "abababa"), [0, 2, 4])
+
+    def testBackendsMatchNaiveCount(self):
+        for backend in searchBackends:
+            for searchMethod in ("BM", "KMP", "RK"):
+                for needle, haystack in searchCases:
+                    with self.subTest(backend=backend, method=searchMethod, needle=needle, haystack=haystack):
+                        matchNeedles = compileMatcher(searchMethod, (needle,), backend)
+                        self.assertEqual(matchNeedles(haystack), {needle: countNaive(needle, haystack)})
+
+    def testBackendsCountEveryNeedleInOnePass(self):
+        needles = ("ana", "an", "banana", "z")
+        for backend in searchBackends:
+            for searchMethod in ("BM", "KMP", "RK"):
+                with self.subTest(backend=backend, method=searchMethod):
+                    needleCounts = compileMatcher(searchMethod, needles, backend)("bananas ananas")
+                    self.assertEqual(needleCounts, {needle: countNaive(needle, "bananas ananas") for needle in needles})
+
+
+if __name__ == '__main__':
+    unittest.main()
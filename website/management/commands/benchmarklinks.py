@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+import src.link_utils as link
+import src.parser_utils as parser
+from pathlib import Path
+from time import perf_counter
+from urllib.parse import urlparse
+
+
+def legacyCleanLinks(links, pageURL):
+    '''
+    The original crawler.cleanLinks, kept as the baseline: rebuilds the filter lists on every call,
+        tests each bad inclusion separately, and parses every link twice.
+    '''
+    badInclusions = list(link.badInclusions)
+    badExtensions = tuple(link.badExtensions)
+    javaNonsense = "/javascript:void(0);"
+    parsedPage = urlparse(pageURL)
+
+    cleanLinks = []
+    for pageLink in links:
+        potentialLink = pageLink.rstrip('/')
+        if not potentialLink:
+            continue
+        if potentialLink.endswith(badExtensions):
+            continue
+        if any(tag in potentialLink for tag in badInclusions):
+            continue
+        if not (potentialLink := potentialLink.split('#', 1)[0]):
+            continue
+        if not (potentialLink := potentialLink.split('?', 1)[0]):
+            continue
+        if "http" not in potentialLink:
+            if potentialLink[0] == '/':
+                potentialLink = "https://" + parsedPage.hostname + potentialLink
+            else:
+                potentialLink = "https://" + parsedPage.hostname + (parsedPage.path).rstrip('/') + "/" + potentialLink
+        if parsedPage.hostname != urlparse(potentialLink).hostname:
+            continue
+        if urlparse(potentialLink).scheme == "http":
+            potentialLink = "https" + potentialLink[4:]
+        if javaNonsense in potentialLink:
+            potentialLink = potentialLink.replace(javaNonsense, '')
+        cleanLinks.append(potentialLink)
+
+    return cleanLinks
+
+
+class Command(BaseCommand):
+    help = 'Times the compiled link filter against the original cleanLinks over the links of a corpus of saved pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', nargs='?', default='benchmarks/pages', help='Directory of saved .html pages')
+        parser.add_argument('--page-url', default='https://www.example.com/wiki/Page', help='URL the pages are treated as coming from')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of runs per filter (best time is reported)')
+
+    def handle(self, *args, **options):
+        pageLinks = [parser.parsePage(pagePath.read_text(encoding='utf-8', errors='replace'))[0]
+            for pagePath in sorted(Path(options['corpus']).glob('*.html'))]
+        if not pageLinks:
+            self.stdout.write(f"ERROR: No .html pages in {options['corpus']}")
+            return
+        self.stdout.write(f"{len(pageLinks)} pages, {sum(len(links) for links in pageLinks)} links")
+
+        filterResults = {}
+        for filterName, filterLinks in (("legacy", legacyCleanLinks), ("compiled", link.cleanLinks)):
+            bestTime = None
+            for run in range(options['repeat']):
+                startTime = perf_counter()
+                filterResults[filterName] = [filterLinks(links, options['page_url']) for links in pageLinks]
+                runTime = perf_counter() - startTime
+                if bestTime is None or runTime < bestTime:
+                    bestTime = runTime
+
+            self.stdout.write(f"  {filterName:<9} {bestTime * 1000:>10.2f} ms  {sum(len(links) for links in filterResults[filterName]):>6} links kept")
+
+        if filterResults["legacy"] != filterResults["compiled"]:
+            self.stdout.write("ERROR: The compiled filter kept different links than the original")
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+import src.fetch_utils as fetch
+import src.parser_utils as parser
+from pathlib import Path
+from time import perf_counter
+from urllib.parse import urlparse
+
+
+class Command(BaseCommand):
+    help = 'Times every parser backend over a corpus of saved pages and compares their output with the "bs4" backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', nargs='?', default='benchmarks/pages', help='Directory of saved .html pages')
+        parser.add_argument('--save', nargs='+', metavar='URL', help='Fetch these pages and save them to the corpus first')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of runs per backend (best time is reported)')
+
+    def handle(self, *args, **options):
+        corpus = Path(options['corpus'])
+        corpus.mkdir(parents=True, exist_ok=True)
+
+        for url in options['save'] or []:
+            pageResponse = fetch.getSession().get(url, timeout=fetch.fetchTimeoutSeconds)
+            if pageResponse.status_code != 200:
+                self.stdout.write(f"ERROR: Could not fetch {url} ({pageResponse.status_code})")
+                continue
+            pageName = (urlparse(url).hostname + urlparse(url).path).strip('/').replace('/', '_')
+            (corpus / f"{pageName}.html").write_text(pageResponse.text, encoding='utf-8')
+
+        pages = [pagePath.read_text(encoding='utf-8', errors='replace') for pagePath in sorted(corpus.glob('*.html'))]
+        if not pages:
+            self.stdout.write(f"ERROR: No .html pages in {corpus}")
+            return
+        self.stdout.write(f"{len(pages)} pages, {sum(len(page) for page in pages) / 1024:.0f} KiB of HTML")
+
+        if parser.etree is None:
+            self.stdout.write('lxml is not installed, so the "lxml" backend falls back to "stream"')
+
+        soupResults = None
+        for backend in parser.parserBackends:
+            bestTime = None
+            for run in range(options['repeat']):
+                startTime = perf_counter()
+                results = [parser.parsePage(page, backend) for page in pages]
+                runTime = perf_counter() - startTime
+                if bestTime is None or runTime < bestTime:
+                    bestTime = runTime
+
+            if soupResults is None:
+                soupResults = results
+
+            # Text is compared word by word, since backends may split whitespace differently
+            sameLinks = sum(result[0] == soupResult[0] for result, soupResult in zip(results, soupResults))
+            sameText = sum(result[3].split() == soupResult[3].split() for result, soupResult in zip(results, soupResults))
+
+            self.stdout.write(f"  {backend:<6} {bestTime * 1000:>10.2f} ms  {len(pages) / bestTime:>8.1f} pages/sec"
+                f"  {sameLinks:>4}/{len(pages)} same links  {sameText:>4}/{len(pages)} same text as bs4")
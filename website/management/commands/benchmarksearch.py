@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+import src.index_utils as index
+from src.matcher_utils import searchBackends
+from src.search_utils import runSearch
+
+
+class Command(BaseCommand):
+    help = 'Times every search method against the inverted index for a table and compares their results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', help='Name of the table to search')
+        parser.add_argument('terms', nargs='+', help='Search terms to benchmark')
+        parser.add_argument('--backend', choices=searchBackends, help='Implementation of the BM/KMP/RK algorithms to time')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of runs per method (best time is reported)')
+
+    def handle(self, *args, **options):
+        tableName = options['table']
+        if not index.indexExists(tableName):
+            self.stdout.write(f"Building index for {tableName}...")
+            index.buildIndex(tableName)
+
+        searchMethods = ("COUNT", "BM", "KMP", "RK", "AC", "INDEX")
+        for searchTerm in options['terms']:
+            self.stdout.write(f'\n"{searchTerm}"')
+
+            # The index only counts whole words, so compare the set of pages found rather than the counts
+            indexPages = None
+            for searchMethod in reversed(searchMethods):
+                bestTime = None
+                for run in range(options['repeat']):
+                    searchResults, foundPages, searchTime, shardTimes = runSearch(tableName, searchTerm, searchMethod, backend=options['backend'])
+                    if bestTime is None or searchTime < bestTime:
+                        bestTime = searchTime
+
+                foundPages = set(result[1] for result in searchResults)
+                if indexPages is None:
+                    indexPages = foundPages
+
+                self.stdout.write(f"  {searchMethod:<6} {bestTime * 1000:>10.2f} ms  {len(foundPages):>6} pages"
+                    f"  {len(foundPages & indexPages):>6} shared with INDEX")
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+import src.index_utils as index
+
+
+class Command(BaseCommand):
+    help = "Compares a table's inverted index against the table's contents"
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', help='Name of the table to check')
+        parser.add_argument('--rebuild', action='store_true', help='Rebuild the index from scratch if it is inconsistent')
+        parser.add_argument('--verbose-pages', action='store_true', help='List the URL of every inconsistent page')
+
+    def handle(self, *args, **options):
+        tableName = options['table']
+        if not index.indexExists(tableName):
+            raise CommandError(f'Table "{tableName}" has no index')
+
+        indexReport = index.checkIndex(tableName)
+        for problem, pageURLs in indexReport.items():
+            self.stdout.write(f"{problem}: {len(pageURLs)} pages")
+            if options['verbose_pages']:
+                for pageURL in pageURLs:
+                    self.stdout.write(f"  {pageURL}")
+
+        if not any(indexReport.values()):
+            self.stdout.write(self.style.SUCCESS(f"Index of {tableName} is consistent"))
+        elif options['rebuild']:
+            index.buildIndex(tableName)
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt index of {tableName}"))
+        else:
+            self.stdout.write(self.style.ERROR(f"Index of {tableName} is inconsistent (run with --rebuild to fix)"))
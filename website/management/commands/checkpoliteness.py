@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+import src.fetch_utils as fetch
+import src.politeness_utils as politeness
+import src.redis_utils as redis
+from threading import Lock
+from time import sleep, time
+from urllib.parse import urlsplit
+
+
+class Command(BaseCommand):
+    help = "Requests a URL repeatedly through the politeness scheduler (e.g. against a local mock server) and reports how the host's limits adapt"
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='URL to request, e.g. http://localhost:8080/page')
+        parser.add_argument('--requests', type=int, default=200, help='Total number of requests')
+        parser.add_argument('--workers', type=int, default=politeness.hostMaxConcurrency, help='Number of threads requesting at once')
+
+    def handle(self, *args, **options):
+        url = options['url']
+        hostname = urlsplit(url).hostname
+        if not politeness.isAllowed(url):
+            self.stdout.write(f"ERROR: robots.txt doesn't allow {url}")
+            return
+
+        statusCounts = {}
+        statusLock = Lock()
+        startTime = time()
+
+        def requestPage(requestNumber):
+            slotId, waitSeconds = politeness.acquireSlot(url)
+            while not slotId:
+                sleep(waitSeconds if waitSeconds > 0 else 0.01)
+                slotId, waitSeconds = politeness.acquireSlot(url)
+
+            startRequestTime = time()
+            try:
+                pageResponse = fetch.getSession().get(url, timeout=fetch.fetchTimeoutSeconds)
+                pageStatus, retryAfter = pageResponse.status_code, pageResponse.headers.get('Retry-After')
+            except Exception:
+                pageStatus, retryAfter = None, None
+            politeness.releaseSlot(url, slotId, pageStatus, time() - startRequestTime, retryAfter)
+
+            with statusLock:
+                statusCounts[pageStatus] = statusCounts.get(pageStatus, 0) + 1
+                if sum(statusCounts.values()) % 20 == 0:
+                    hostState = redis.getHostState(hostname)
+                    self.stdout.write(f"  {time() - startTime:>7.2f}s  limit {hostState.get('limit', 0):>5.2f}  in use {hostState['slotsInUse']:>3}"
+                        f"  latency {hostState.get('latency', 0) * 1000:>8.1f} ms  statuses {statusCounts}")
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            list(executor.map(requestPage, range(options['requests'])))
+
+        totalTime = time() - startTime
+        self.stdout.write(f"{options['requests']} requests in {totalTime:.2f}s ({options['requests'] / totalTime:.1f} requests/sec), statuses {statusCounts}")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+import src.database_utils as database
+
+
+class Command(BaseCommand):
+    help = ("Creates the table catalog if it doesn't exist, or recounts every table's rows and size if it has drifted. "
+        "Also builds any missing page-list indexes (see database.createListIndexes) without locking the tables")
+
+    def handle(self, *args, **options):
+        tableData = database.rebuildCatalog()
+        for tableName, rowCount, tableBytes, crawledAt, preProcessed in tableData:
+            crawlTime = crawledAt.strftime("%Y-%m-%d %H:%M") if crawledAt else "-"
+            self.stdout.write(f"  {tableName:<40} {rowCount:>9} pages  {filesizeformat(tableBytes):>10}  crawled {crawlTime}"
+                f"{'  pre-processed' if preProcessed else ''}")
+
+        self.stdout.write(self.style.SUCCESS(f"Catalog rebuilt with {len(tableData)} tables"))
+
+        for tableName, *tableDetails in tableData:
+            self.stdout.write(f"  Indexing {tableName}...", ending="")
+            createdIndexes = database.createListIndexes(tableName)
+            self.stdout.write(f" created {', '.join(createdIndexes)}" if createdIndexes else " already indexed")
+        self.stdout.write(self.style.SUCCESS("Page-list indexes are up to date"))
@@ -5,8 +5,12 @@ from django.urls import path
 urlpatterns = [
     path('', views.home, name='home'),
     path('crawl/', views.crawl, name='crawl'),
+    path('crawl/<str:crawlId>/progress/', views.crawlProgress, name='crawl-progress'),
+    path('pre-process/<str:jobId>/progress/', views.preProcessProgress, name='pre-process-progress'),
     path('search/', views.search, name='search'),
     path('manage-database/', views.manageDatabase, name='manage-database'),
+    path('pool-metrics/', views.poolMetrics, name='pool-metrics'),
+    path('cache-metrics/', views.cacheMetrics, name='cache-metrics'),
     path('manage-database/<str:table>/', views.manageTable, name='manage-table'),
     path('manage-database/<str:table>/rename/', views.renameTable, name='rename-table'),
     path('manage-database/<str:table>/delete/', views.deleteTable, name='delete-table'),
@@ -1,13 +1,27 @@
+from django.http import JsonResponse
 from django.shortcuts import redirect, render
-from src.crawler import crawlWebsite
+from src.crawler import mergeIndexSegments, startCrawlJob, startPreProcessJob
+import src.analyzer_utils as analyzer
+import src.cache_utils as cache
 import src.database_utils as database
-from src.search_utils import runSearch
+import src.index_utils as index
+import src.redis_utils as redis
+import src.shard_utils as shard
+from src.search_utils import runCachedSearch
 
 
 def home(request):
     return render(request, 'home.html')
 
 
+def poolMetrics(request):
+    return JsonResponse(database.getPoolMetrics())
+
+
+def cacheMetrics(request):
+    return JsonResponse(cache.getCacheMetrics())
+
+
 def crawl(request):
     renderArguments = {}
     renderArguments['activeTab'] = "/crawl"
@@ -20,18 +34,26 @@ def crawl(request):
             return render(request, 'crawl.html', renderArguments)
         renderArguments['userInput'] = websiteURL
 
-        # If valid input, (attempt to) crawl the website
-        webpageVisitCount, crawlTime = crawlWebsite(websiteURL)
-        renderArguments['webpageVisitCount'] = webpageVisitCount
-        renderArguments['crawlTime'] = round(crawlTime, 2)
-
-        # If the crawler was unable to connect to the provided URL...
-        if not webpageVisitCount:
-            renderArguments['badURL'] = True
+        # If valid input, (attempt to) crawl the website in the background; the page follows its progress
+        crawlMode = "async" if request.POST.get('input_async') else None
+        incremental = bool(request.POST.get('input_incremental'))
+        renderArguments['crawlId'] = startCrawlJob(websiteURL, crawlMode, incremental)
 
     return render(request, 'crawl.html', renderArguments)
 
 
+def crawlProgress(request, crawlId):
+    if crawlJob := redis.getCrawlProgress(crawlId):
+        return JsonResponse(crawlJob)
+    return JsonResponse({'error': f'No crawl "{crawlId}"'}, status=404)
+
+
+def preProcessProgress(request, jobId):
+    if preProcessJob := redis.getPreProcessProgress(jobId):
+        return JsonResponse(preProcessJob)
+    return JsonResponse({'error': f'No pre-processing job "{jobId}"'}, status=404)
+
+
 def search(request):
     # Initiate renderArguments
     renderArguments = {}
@@ -42,10 +64,7 @@ def search(request):
     tableNames = []
     for table in database.getAllTables():
         tableNames.append(table[0])
-        if table[0].endswith("_pp"):
-            websiteNames.append((table[0][:-3]).replace('_', '.') + " (pre-processed)")
-        else:
-            websiteNames.append(table[0].replace('_', '.'))
+        websiteNames.append(table[0].replace('_', '.'))
 
     renderArguments['searchableWebsites'] = zip(websiteNames, tableNames)
 
@@ -55,7 +74,9 @@ def search(request):
         ('Boyer-Moore', 'BM'),
         ('Knuth-Morris-Pratt','KMP'),
         ('Robin-Karp','RK'),
-        ('Aho-Corasick','AC'))
+        ('Aho-Corasick','AC'),
+        ('Inverted index','INDEX'),
+        ('BM25 relevance ranking','BM25'))
     renderArguments['amountOfResultsOptions'] = (10, 50, 100, 1000)
 
     if request.method == "POST":
@@ -84,13 +105,16 @@ def search(request):
             renderArguments['amountOfResults'] = 10
         renderArguments['amountOfResults'] = int(renderArguments['amountOfResults'])
 
-        # If all fields filled in properly, run a search with the provided arguments
-        searchResults, searchTime = runSearch(renderArguments['searchTable'], renderArguments['searchTerm'], renderArguments['searchMethod'])
+        # If all fields filled in properly, run a search with the provided arguments (or reuse an identical earlier one)
+        searchResults, foundPages, searchTime, shardTimes, cacheHit = runCachedSearch(renderArguments['searchTable'], renderArguments['searchTerm'],
+            renderArguments['searchMethod'], renderArguments['amountOfResults'])
 
         # Store the results of the search in arguments to be passed to the results page
-        renderArguments['searchResults'] = searchResults[:renderArguments['amountOfResults']]
+        renderArguments['searchResults'] = searchResults
         renderArguments['searchTime'] = round((searchTime * 1000), 2)
-        renderArguments['foundPages'] = len(searchResults)
+        renderArguments['shardTimes'] = [round((shardTime * 1000), 2) for shardTime in shardTimes]
+        renderArguments['foundPages'] = foundPages
+        renderArguments['cacheHit'] = cacheHit
         renderArguments['totalPages'] = database.getRowCount(renderArguments['searchTable'])
 
         # If less results found than the selected amount to display, adjust results output
@@ -105,13 +129,7 @@ def search(request):
 def manageDatabase(request):
     renderArguments = {}
     renderArguments['activeTab'] = "/manage-database"
-    databaseTables = database.getAllTables()
-    for table in databaseTables:
-        if table[0].endswith("_pp"):
-            table.append(1)
-        else:
-            table.append(0)
-    renderArguments['tableData'] = databaseTables
+    renderArguments['tableData'] = database.getAllTables()
 
     return render(request, 'manage-database.html', renderArguments)
 
@@ -122,15 +140,35 @@ def manageTable(request, table):
     renderArguments['table'] = table
     renderArguments['website'] = "https://" + table.replace('_', '.')
 
-    websiteData = database.fetchAllData(table)
-    websiteData.sort(key=lambda x: x[1])
-    renderArguments['pages'] = websiteData
-
     if request.method == "POST":
         renderArguments['row'] = request.POST.get('row')
         database.deleteRow(table, renderArguments['row'])
-        url = "/manage-database/" + table
-        return redirect(url)
+        shard.invalidateShards(table)
+        if index.indexExists(table):
+            index.removePage(renderArguments['row'], table)
+            if index.getDeltaSize(table) >= index.indexMergeThreshold:
+                mergeIndexSegments.delay(table)
+
+        # Return to the same page of the listing
+        return redirect(request.get_full_path())
+
+    # List one page of rows at a time, starting after (or ending before) the row the user paged from
+    renderArguments['filter'] = request.GET.get('filter', '')
+    after = before = None
+    if 'after_url' in request.GET:
+        after = (request.GET.get('after_title', ''), request.GET['after_url'])
+    elif 'before_url' in request.GET:
+        before = (request.GET.get('before_title', ''), request.GET['before_url'])
+
+    pages, hasMore = database.listPages(table, after, before, renderArguments['filter'])
+    renderArguments['pages'] = pages
+    renderArguments['totalPages'] = database.getRowCount(table)
+    if pages:
+        # Paging forwards, there's a previous page if we came from one (and vice versa)
+        renderArguments['hasNext'] = hasMore if not before else True
+        renderArguments['hasPrevious'] = hasMore if before else bool(after)
+        renderArguments['firstPage'] = (pages[0][1] or '', pages[0][0])
+        renderArguments['lastPage'] = (pages[-1][1] or '', pages[-1][0])
 
     return render(request, 'manage-table.html', renderArguments)
 
@@ -155,6 +193,8 @@ def renameTable(request, table):
 
         # Rename the table and redirect back to the manage-database/ page
         database.changeTableName(renderArguments['oldTable'], renderArguments['newTable'])
+        index.renameIndex(renderArguments['oldTable'], renderArguments['newTable'])
+        shard.invalidateShards(renderArguments['oldTable'])
         return redirect('/manage-database')
 
     return render(request, 'rename.html', renderArguments)
@@ -167,6 +207,8 @@ def deleteTable(request, table):
 
     if request.method == "POST":
         database.dropTable(table)
+        index.dropIndex(table)
+        shard.invalidateShards(table)
         return redirect('/manage-database')
 
     return render(request, 'delete.html', renderArguments)
@@ -176,22 +218,12 @@ def processTable(request, table):
     renderArguments['activeTab'] = "/manage-database"
     renderArguments['table'] = table
 
-    if request.method == "POST":
-        newtable = table + "_pp"
-
-        # If a pre-processed table for the website already exists, raise an error
-        if database.tableExists(newtable):
-            renderArguments['tableExists'] = True
-            return render(request, 'pre-process.html', renderArguments)
-
-        checked = request.POST.get('input_newtable')
-        if checked:     # If the user checked the "make a new table" option, create a new table
-            database.copyTable(table, newtable)
-            database.preProcessTable(newtable)
-        else:           # Otherwise, overwrite existing data
-            database.preProcessTable(table)
-            database.changeTableName(table, newtable)
+    renderArguments['analyzerStages'] = ", ".join(analyzer.analyzerStages)
+    renderArguments['shingleSize'] = analyzer.shingleSize
 
-        return redirect('/manage-database')
+    if request.method == "POST":
+        # Re-analyze the table's page_tokens in place and rebuild the index from them in the background; the page follows its progress.
+        #   Both bump the table's version once they finish, which reloads its shards
+        renderArguments['jobId'] = startPreProcessJob(table)
 
     return render(request, 'pre-process.html', renderArguments)
\ No newline at end of file